@@ -8,9 +8,18 @@ from flask import Blueprint, request, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from models import db
 from models.user import User
+from utils.user_cache import user_cache
+from utils.hashing import password_hasher, AuthBusy
+from utils.metrics import ops_required
 import re
 # 创建蓝图，指定名称和模块名,创建一个名为 auth 的蓝图，后续会将相关的路由注册到这个蓝图中。
 auth_bp = Blueprint('auth', __name__)
+
+
+#密码哈希排队过多时统一返回 429，提示客户端稍后重试
+@auth_bp.errorhandler(AuthBusy)
+def handle_auth_busy(error):
+    return jsonify({'error': '登录请求过多，请稍后重试'}), 429
 """
 @auth_bp.route('/register', methods=['POST'])：定义一个路由，处理 /register 地址的 POST 请求，调用 register 函数。
 这是蓝图（Blueprint）的路由装饰器，用于在蓝图中注册路由。
@@ -80,4 +89,48 @@ def logout():
 @login_required
 #定义一个路由，处理 /profile 地址的 GET 请求，调用 profile 函数，并使用 @login_required 装饰器保护该路由。
 def profile():
-    return jsonify({'user': current_user.to_dict()}), 200
\ No newline at end of file
+    return jsonify({'user': current_user.to_dict()}), 200
+#修改用户资料 API（目前支持修改邮箱）
+@auth_bp.route('/profile', methods=['PUT'])
+@login_required
+def update_profile():
+    data = request.get_json()
+    email = data.get('email')
+    if not email or not re.match(r'^[^@]+@[^@]+\.[^@]+$', email):
+        return jsonify({'error': '邮箱格式不正确'}), 400
+    if User.query.filter(User.email == email, User.id != current_user.id).first():
+        return jsonify({'error': '邮箱已被注册'}), 400
+    #current_user 是缓存中的轻量对象，修改需要加载数据库中的用户
+    user = db.session.get(User, current_user.id)
+    user.email = email
+    db.session.commit()
+    user_cache.invalidate(user.id)
+    return jsonify({'message': '资料已更新', 'user': user.to_dict()}), 200
+#修改密码 API
+@auth_bp.route('/password', methods=['POST'])
+@login_required
+def change_password():
+    data = request.get_json()
+    old_password = data.get('old_password')
+    new_password = data.get('new_password')
+    if not all([old_password, new_password]):
+        return jsonify({'error': '原密码和新密码都是必需的'}), 400
+    if len(new_password) < 6:
+        return jsonify({'error': '密码长度至少6位'}), 400
+    user = db.session.get(User, current_user.id)
+    if not user.check_password(old_password):
+        return jsonify({'error': '原密码错误'}), 401
+    user.set_password(new_password)
+    db.session.commit()
+    user_cache.invalidate(user.id)
+    return jsonify({'message': '密码已修改'}), 200
+#密码哈希池统计
+@auth_bp.route('/hash/stats', methods=['GET'])
+@ops_required
+def hash_stats():
+    return jsonify(password_hasher.stats()), 200
+#用户身份缓存统计
+@auth_bp.route('/user-cache/stats', methods=['GET'])
+@ops_required
+def user_cache_stats():
+    return jsonify(user_cache.stats()), 200
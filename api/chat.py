@@ -9,66 +9,590 @@ ChatMessage 和 ChatSession：导入聊天消息和会话模型。
 ai_handler：自定义模块，处理 AI 相关功能。
 uuid：生成唯一标识符。
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
+from sqlalchemy import select, func, and_, or_
+from sqlalchemy.orm import load_only
 from models import db
 from models.chat import ChatMessage, ChatSession
-from utils.ai_handlers import ai_handler
+from utils.ai_handlers import ai_handler, SYSTEM_PROMPT
+from utils.context_builder import context_builder, SUMMARY_KEY
+from utils.streaming import stream_manager
+from utils.scheduler import llm_scheduler, SchedulerBusy
+from utils.providers import provider_pool
+from utils.response_cache import response_cache
+from utils.pagination import encode_cursor, decode_cursor, parse_limit
+from utils.turn_cache import turn_cache
+from utils.write_behind import write_behind, persist_message, persist_batch, patch_context
+from utils.batch import batch_runner, BatchItem
+from utils.search import search_index, snippet
+from utils.archive import message_archive, message_key
+from utils.maintenance import maintenance
+from utils.log_pipeline import bind_log_context
+from utils.http_cache import make_etag, not_modified, add_validators
+from utils.db_routing import replica_read
+from utils.rate_limit import rate_limited, rate_limiter
+from utils.metrics import ops_required
+from utils.usage import usage_rollup
+from utils.export import chat_exporter, parse_export_cursor, FORMATS as EXPORT_FORMATS
+from datetime import datetime
+import logging
+import time
 import uuid
 import json
+
+logger = logging.getLogger(__name__)
 #创建蓝图：定义一个名为 chat 的蓝图，用于组织聊天相关的路由。
 chat_bp = Blueprint('chat', __name__)
 
+#会话列表可通过 include 参数附带的非摘要字段
+SESSION_EXTRA_FIELDS = ('context', 'meta_data', 'feedback')
+
+
+def _load_meta(session):
+    return json.loads(session.meta_data) if session.meta_data else {}
+
+
+def _load_context(session):
+    return json.loads(session.context) if session.context else {}
+
+
+def _cursor_key(cursor):
+    ts, row_id = decode_cursor(cursor)
+    return ts or datetime.min, row_id
+
+
+def _keyset_before(ts_column, id_column, cursor):
+    #(时间, id) 严格早于游标位置；展开成 OR 形式以便命中联合索引
+    ts, row_id = decode_cursor(cursor)
+    return or_(ts_column < ts, and_(ts_column == ts, id_column < row_id))
+
+
+def _keyset_after(ts_column, id_column, cursor):
+    ts, row_id = decode_cursor(cursor)
+    return or_(ts_column > ts, and_(ts_column == ts, id_column > row_id))
+
+
+def _ndjson_response(query, serialize, head=()):
+    #通过服务端游标分批读取（yield_per），逐行输出 NDJSON，内存占用与总行数无关；head 为先于查询结果输出的字典
+    def generate():
+        for item in head:
+            yield json.dumps(item, ensure_ascii=False) + '\n'
+        for row in db.session.execute(query.execution_options(yield_per=200)).scalars():
+            yield json.dumps(serialize(row), ensure_ascii=False) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def _reopen(chat_sessions):
+    #空闲会话被后台维护任务关闭后，用户继续发送消息时重新激活
+    closed = [chat_session for chat_session in chat_sessions if chat_session.status == 'closed']
+    for chat_session in closed:
+        chat_session.status = 'active'
+        chat_session.end_time = None
+    if closed:
+        db.session.commit()
+
+
+def _with_archived(user_id, chat_session, history):
+    #热数据不足一个上下文窗口时（更早的消息已归档），从冷归档补齐；history 与返回值均按时间升序
+    need = context_builder.history_turns - len(history)
+    if need <= 0 or not message_archive.may_contain(chat_session):
+        return history
+    boundary = (history[0].timestamp or datetime.min, history[0].id) if history else None
+    return message_archive.before(user_id, chat_session.session_id, boundary, need)[::-1] + list(history)
+
+
+def _fresh_entries(user_id, entries):
+    #最近轮次缓存按 worker 保存：命中后用一条查询核对会话版本号与最新消息 id，其他 worker 修改过会话
+    #（上下文、缓存开关、状态）、追加过消息或会话已删除时丢弃缓存，按未命中处理
+    if not entries:
+        return entries
+    session_ids = list(entries)
+    last_ids = select(ChatMessage.session_id, func.max(ChatMessage.id).label('last_id')).where(
+        ChatMessage.user_id == user_id, ChatMessage.session_id.in_(session_ids)).group_by(
+        ChatMessage.session_id).subquery()
+    current = {row.session_id: (row.version, row.last_id) for row in db.session.execute(
+        select(ChatSession.session_id, ChatSession.version, last_ids.c.last_id).outerjoin(
+            last_ids, last_ids.c.session_id == ChatSession.session_id).where(
+            ChatSession.user_id == user_id, ChatSession.session_id.in_(session_ids)))}
+    return {session_id: entry for session_id, entry in entries.items()
+            if turn_cache.check(user_id, session_id, *current.get(session_id, (None, None)))}
+
+
+def _stage_session(user_id, session_id, chat_session, is_new_session, summary, version):
+    #暂存本轮的会话变更（新建会话 / 写回滚动摘要）：启用延迟写入时登记到队列并返回待写行，否则加入当前事务。
+    #已有会话只合并 _summary 一个键，并要求版本号仍为读取时的 version，不覆盖其他请求同时写入的 context
+    patch = {SUMMARY_KEY: summary} if summary is not None else None
+    if write_behind.enabled:
+        if is_new_session:
+            return [write_behind.add_session(user_id, session_id,
+                                             context=json.dumps(patch, ensure_ascii=False) if patch else None)]
+        elif patch is not None:
+            return [write_behind.patch_context(user_id, session_id, patch, version)]
+        return []
+    if is_new_session:
+        if patch is not None:
+            chat_session.context = json.dumps(patch, ensure_ascii=False)
+        db.session.add(chat_session)
+    elif patch is not None:
+        patch_context(user_id, session_id, patch, version)
+    return []
+
 #发送消息 API
 @chat_bp.route('/send', methods=['POST'])
 @login_required
+@rate_limited
 #定义路由：处理 /send 的 POST 请求，用户必须登录才能访问。
 def send_message():
     #处理 HTTP 请求数据
     data = request.get_json()
     message = data.get('message', '').strip()
     session_id = data.get('session_id')
+    user_id = current_user.id  # 提前取出，避免提交后 current_user 过期重新查询
+    bind_log_context(session_id=session_id, user_id=user_id)
     #消息验证：如果消息为空，返回 400 错误。
     if not message:
         return jsonify({'error': '消息不能为空'}), 400
     #会话管理：如果没有提供 session_id，生成一个新的 UUID，并创建一个新的 ChatSession 实例。
-    if not session_id:
+    chat_session = None
+    is_new_session = not session_id
+    if is_new_session:
         session_id = str(uuid.uuid4())
-        chat_session = ChatSession(user_id=current_user.id, session_id=session_id)
-        db.session.add(chat_session)
-#获取聊天历史：查询当前用户在指定会话中的最近 10 条聊天记录，并将其转换为字典格式。
-    chat_history = ChatMessage.query.filter_by(user_id=current_user.id, session_id=session_id).order_by(ChatMessage.timestamp.desc()).limit(10).all()
-    chat_history_dict = [chat.to_dict() for chat in reversed(chat_history)]
-#生成 AI 回复：调用 ai_handler 的 generate_response 方法，生成 AI 的回复。
-    ai_response = ai_handler.generate_response(message, chat_history_dict)
-#保存消息：创建 ChatMessage 实例，保存用户发送的消息和 AI 回复，并提交到数据库。
-    chat_message = ChatMessage(user_id=current_user.id, message=message, response=ai_response, session_id=session_id)
-    db.session.add(chat_message)
-    db.session.commit()
+        bind_log_context(session_id=session_id)
+        chat_session = ChatSession(user_id=user_id, session_id=session_id)
+        chat_history_dict, context, meta_data, version = [], {}, {}, 1
+    else:
+        #最近轮次缓存命中（且与数据库中的版本一致）时直接使用内存中的历史与会话状态
+        entry = turn_cache.get(user_id, session_id)
+        if entry is not None:
+            entry = _fresh_entries(user_id, {session_id: entry}).get(session_id)
+        if entry is None:
+            chat_session = ChatSession.query.filter_by(session_id=session_id, user_id=user_id).first()
+            if chat_session is None:
+                return jsonify({'error': '会话不存在'}), 404
+            _reopen([chat_session])
+#获取聊天历史：查询当前用户在指定会话中最近的若干条聊天记录（条数由上下文构建器决定）。
+            chat_history = ChatMessage.query.filter_by(user_id=user_id, session_id=session_id).order_by(
+                ChatMessage.timestamp.desc()).limit(context_builder.history_turns).all()
+            chat_history = _with_archived(user_id, chat_session, chat_history[::-1])
+            entry = turn_cache.fill(user_id, session_id, _load_context(chat_session),
+                                    _load_meta(chat_session), chat_history, chat_session.version)
+        chat_history_dict, context, meta_data = entry.history(), entry.context, entry.meta_data
+        version = entry.version
+#会话级缓存开关保存在 ChatSession.meta_data 的 response_cache 字段中，默认开启。
+    use_cache = data.get('cache', True) and meta_data.get('response_cache', True)
+#构建上下文：按 token 预算装入最近轮次，移出窗口的轮次增量折叠进 ChatSession.context 中的滚动摘要。
+    prompt_messages, summary, context_stats = context_builder.build(
+        SYSTEM_PROMPT, message, chat_history_dict, context.get(SUMMARY_KEY))
+    if summary is not None:
+        context = dict(context, **{SUMMARY_KEY: summary})
+#流式模式：立即返回 stream_id，回复通过 Socket.IO 推送到该用户的 user_<id> 房间（事件带 session_id），结束后统一保存。
+    if data.get('stream'):
+        if llm_scheduler.is_saturated():
+            return jsonify({'error': 'AI服务繁忙，请稍后重试'}), 429
+        pending = _stage_session(user_id, session_id, chat_session, is_new_session, summary, version)
+        # 确保新会话先落库（延迟写入时等待所在批次提交）
+        if write_behind.enabled:
+            write_behind.wait(pending)
+        else:
+            db.session.commit()
+        if is_new_session:
+            turn_cache.fill(user_id, session_id, context, meta_data)
+        generation = stream_manager.start(current_app._get_current_object(), user_id,
+                                          session_id, message, prompt_messages, use_cache, context,
+                                          client_ip=request.remote_addr)
+        return jsonify({'stream_id': generation.stream_id, 'session_id': session_id,
+                        'context_stats': context_stats}), 202
+#生成 AI 回复：调用 ai_handler 的 generate_from_messages 方法，基于构建好的提示生成 AI 的回复。
+#调度：缓存未命中时受全局/单用户并发上限约束，队列满或排队超时直接返回 429。
+    usage = {}
+    try:
+        ai_response = ai_handler.generate_from_messages(prompt_messages, user_id=user_id,
+                                                        use_cache=use_cache, usage=usage)
+    except SchedulerBusy:
+        db.session.rollback()
+        return jsonify({'error': 'AI服务繁忙，请稍后重试'}), 429
+#保存消息：会话变更与本轮消息一起提交（或登记到延迟写入队列），并追加到最近轮次缓存。
+    pending = _stage_session(user_id, session_id, chat_session, is_new_session, summary, version)
+    if is_new_session:
+        turn_cache.fill(user_id, session_id, context, meta_data)
+    payload = persist_message(user_id, session_id, message, ai_response, context, usage)
+    write_behind.wait(pending)
+#按实际用量扣除 token 限额（命中回复缓存时没有用量）
+    rate_limiter.charge(user_id, request.remote_addr, usage)
+
+    return jsonify({'message': payload, 'session_id': session_id,
+                    'context_stats': context_stats}), 200
+def _load_session_entries(user_id, session_ids):
+    #批量读取会话状态与最近历史：先查最近轮次缓存（一条查询核对版本），未命中的会话合并为两条查询（会话 + 按会话开窗取最近 N 条）
+    entries = {}
+    for session_id in session_ids:
+        entry = turn_cache.get(user_id, session_id)
+        if entry is not None:
+            entries[session_id] = entry
+    entries = _fresh_entries(user_id, entries)
+    missing = [session_id for session_id in session_ids if session_id not in entries]
+    if not missing:
+        return entries
+    sessions = ChatSession.query.filter(ChatSession.user_id == user_id, ChatSession.session_id.in_(missing)).all()
+    if not sessions:
+        return entries
+    _reopen(sessions)
+    rank = func.row_number().over(partition_by=ChatMessage.session_id,
+                                  order_by=(ChatMessage.timestamp.desc(), ChatMessage.id.desc())).label('turn_rank')
+    recent = select(ChatMessage.id, rank).where(
+        ChatMessage.user_id == user_id,
+        ChatMessage.session_id.in_([s.session_id for s in sessions])).subquery()
+    history = {}
+    for msg in ChatMessage.query.join(recent, ChatMessage.id == recent.c.id).filter(
+            recent.c.turn_rank <= context_builder.history_turns).order_by(ChatMessage.timestamp, ChatMessage.id):
+        history.setdefault(msg.session_id, []).append(msg)
+    for chat_session in sessions:
+        entries[chat_session.session_id] = turn_cache.fill(
+            user_id, chat_session.session_id, _load_context(chat_session), _load_meta(chat_session),
+            _with_archived(user_id, chat_session, history.get(chat_session.session_id, [])), chat_session.version)
+    return entries
+
+def _batch_line(item=None, **fields):
+    if item is not None:
+        fields = dict({'index': item.index, 'id': item.client_id, 'session_id': item.session_id}, **fields)
+    return json.dumps(fields, ensure_ascii=False) + '\n'
 
-    return jsonify({'message': chat_message.to_dict(), 'session_id': session_id}), 200
+def _batch_cost():
+    #批量接口每个条目都会调用一次大模型，按条目数扣除请求令牌
+    items = (request.get_json(silent=True) or {}).get('items')
+    return len(items) if isinstance(items, list) else 1
+
+#批量发送 API：一次提交多条相互独立的提示（可各自指定 session_id），有界并发调用大模型，
+#每条完成后立即输出一行 NDJSON；成功的轮次按 BATCH_PERSIST_SIZE 条合并为一个事务保存，单条失败不影响其余条目。
+@chat_bp.route('/batch', methods=['POST'])
+@login_required
+@rate_limited(cost=_batch_cost)
+def batch_messages():
+    data = request.get_json(silent=True) or {}
+    raw_items = data.get('items')
+    user_id = current_user.id
+    bind_log_context(user_id=user_id)
+    if not isinstance(raw_items, list) or not raw_items:
+        return jsonify({'error': 'items 必须为非空数组'}), 400
+    if len(raw_items) > batch_runner.max_items:
+        return jsonify({'error': f'单次最多提交 {batch_runner.max_items} 条'}), 400
+    try:
+        concurrency = int(data.get('concurrency') or 0) or None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency 必须为整数'}), 400
+    if llm_scheduler.is_saturated():
+        return jsonify({'error': 'AI服务繁忙，请稍后重试'}), 429
+    #条目可以是字符串或 {"message", "session_id", "id", "cache"} 对象
+    raw_items = [raw if isinstance(raw, dict) else {'message': raw} for raw in raw_items]
+    entries = _load_session_entries(user_id, {raw['session_id'] for raw in raw_items if raw.get('session_id')})
+
+    items, rejected, prepared, session_updates = [], [], {}, {}
+    for index, raw in enumerate(raw_items):
+        message = str(raw.get('message') or '').strip()
+        session_id = raw.get('session_id')
+        item = BatchItem(index, raw.get('id'), session_id, message, None)
+        if not message:
+            rejected.append(_batch_line(item, status=400, error='消息不能为空'))
+            continue
+        if session_id:
+            if session_id not in entries:
+                rejected.append(_batch_line(item, status=404, error='会话不存在'))
+                continue
+            if session_id not in prepared:
+                entry = entries[session_id]
+                prepared[session_id] = (entry.history(), entry.context, entry.meta_data, entry.version)
+            chat_history_dict, context, meta_data, version = prepared[session_id]
+        else:
+            item.session_id = str(uuid.uuid4())
+            item.is_new_session = True
+            chat_history_dict, context, meta_data, version = [], {}, {}, 1
+        item.use_cache = raw.get('cache', data.get('cache', True)) and meta_data.get('response_cache', True)
+        item.prompt_messages, summary, _ = context_builder.build(
+            SYSTEM_PROMPT, message, chat_history_dict, context.get(SUMMARY_KEY))
+        if summary is not None:
+            context = dict(context, **{SUMMARY_KEY: summary})
+            session_updates[item.session_id] = ({SUMMARY_KEY: summary}, version)
+        item.context = context
+        items.append(item)
+
+    app = current_app._get_current_object()
+    socketio = app.extensions['socketio']
+    client_ip = request.remote_addr
+
+    def generate():
+        started = time.perf_counter()
+        totals = {'succeeded': 0, 'failed': len(rejected), 'persisted': 0, 'persist_failed': 0}
+        staged = []
+
+        def persist():
+            turns, new_sessions, updates = [], {}, {}
+            for item, response in staged:
+                turns.append((item.session_id, item.message, response, item.context, item.usage))
+                if item.is_new_session:
+                    new_sessions[item.session_id] = None
+                    turn_cache.fill(user_id, item.session_id, item.context, {})
+                elif item.session_id in session_updates:
+                    updates[item.session_id] = session_updates.pop(item.session_id)
+            try:
+                persist_batch(user_id, turns, new_sessions, updates)
+                totals['persisted'] += len(turns)
+            except Exception as e:
+                db.session.rollback()
+                totals['persist_failed'] += len(turns)
+                logger.error(f"批量保存 {len(turns)} 轮对话失败: {str(e)}")
+                for session_id, *_ in turns:
+                    turn_cache.invalidate(user_id, session_id)
+            staged.clear()
+
+        yield from rejected
+        try:
+            if items:
+                for item, response, error in batch_runner.run(socketio, user_id, items, concurrency):
+                    if error is not None:
+                        totals['failed'] += 1
+                        yield _batch_line(item, status=error.status, error=str(error), reason=error.reason,
+                                          session_id=None if item.is_new_session else item.session_id)
+                        continue
+                    totals['succeeded'] += 1
+                    rate_limiter.charge(user_id, client_ip, item.usage)
+                    staged.append((item, response))
+                    yield _batch_line(item, status=200, response=response, elapsed_ms=item.elapsed_ms)
+                    if len(staged) >= batch_runner.persist_size:
+                        persist()
+        finally:
+            #客户端中途断开时也保存已完成的轮次
+            if staged:
+                persist()
+        yield _batch_line(done=True, total=len(raw_items), **totals,
+                          elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+#全文检索 API：在当前用户的聊天记录中按相关度检索，offset 分页，可用 session_id 限定会话
+@chat_bp.route('/search', methods=['GET'])
+@login_required
+def search_messages():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '检索关键词不能为空'}), 400
+    if search_index.backend is None:
+        return jsonify({'error': '当前数据库不支持全文检索'}), 503
+    limit = parse_limit(request.args.get('limit'), current_app.config['SEARCH_PAGE_SIZE'],
+                        current_app.config['MAX_PAGE_SIZE'])
+    offset = max(0, request.args.get('offset', 0, type=int))
+    try:
+        hits, has_more, truncated = search_index.search(current_user.id, query, limit, offset,
+                                                        request.args.get('session_id'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    results = []
+    for msg, score, terms in hits:
+        field = 'message' if any(run in msg.message.lower() for run, _ in terms) else 'response'
+        results.append({'message': msg.to_dict(), 'score': score, 'field': field,
+                        'snippet': snippet(getattr(msg, field), terms)})
+    #truncated 为 True 表示匹配数超过 SEARCH_MAX_CANDIDATES，只在最近的匹配记录内排序
+    return jsonify({'results': results, 'next_offset': offset + limit if has_more else None,
+                    'truncated': truncated}), 200
+
+#取消流式生成 API
+@chat_bp.route('/stream/<stream_id>/cancel', methods=['POST'])
+@login_required
+def cancel_stream(stream_id):
+    if not stream_manager.cancel(stream_id, current_user.id):
+        return jsonify({'error': '生成任务不存在或已结束'}), 404
+    return jsonify({'message': '已取消'}), 200
+
+#流式生成统计（进行中数量、首字延迟等）
+@chat_bp.route('/stream/stats', methods=['GET'])
+@ops_required
+def stream_stats():
+    return jsonify(stream_manager.stats()), 200
+#批量接口统计（进行中条数、失败数等）
+@chat_bp.route('/batch/stats', methods=['GET'])
+@ops_required
+def batch_stats():
+    return jsonify(batch_runner.stats()), 200
+#后台维护统计（关闭会话数、用量汇总与归档条数等）
+@chat_bp.route('/maintenance/stats', methods=['GET'])
+@ops_required
+def maintenance_stats():
+    return jsonify({'maintenance': maintenance.stats(), 'archive': message_archive.stats(),
+                    'usage': usage_rollup.stats()}), 200
+#导出统计（导出次数、输出行数与字节数）
+@chat_bp.route('/export/stats', methods=['GET'])
+@ops_required
+def export_stats():
+    return jsonify(chat_exporter.stats()), 200
+#限流统计（检查次数、拒绝次数、单次检查耗时等）
+@chat_bp.route('/rate-limit/stats', methods=['GET'])
+@ops_required
+def rate_limit_stats():
+    return jsonify(rate_limiter.stats()), 200
+#当前用户的大模型用量：最近 days 天（默认 30，最多 366）按天汇总，数据由后台维护任务定期汇总，有约一个周期的延迟
+@chat_bp.route('/usage', methods=['GET'])
+@login_required
+@replica_read
+def usage():
+    days = request.args.get('days', 30, type=int)
+    if not days or not 1 <= days <= 366:
+        return jsonify({'error': 'days 必须在 1 到 366 之间'}), 400
+    items = [item.to_dict() for item in usage_rollup.daily(current_user.id, days)]
+    totals = {key: sum(item[key] for item in items)
+              for key in ('turns', 'prompt_tokens', 'completion_tokens', 'total_tokens')}
+    return jsonify({'days': days, 'daily': items, 'totals': totals}), 200
+#调度器统计（队列深度、排队耗时等）
+@chat_bp.route('/scheduler/stats', methods=['GET'])
+@ops_required
+def scheduler_stats():
+    return jsonify(llm_scheduler.stats()), 200
+#回复缓存统计（命中率等）
+@chat_bp.route('/cache/stats', methods=['GET'])
+@ops_required
+def cache_stats():
+    return jsonify(response_cache.stats()), 200
+#上下文构建统计（累计 prompt token 与节省量）
+@chat_bp.route('/context/stats', methods=['GET'])
+@ops_required
+def context_stats():
+    return jsonify(context_builder.stats()), 200
+#最近轮次缓存统计
+@chat_bp.route('/turn-cache/stats', methods=['GET'])
+@ops_required
+def turn_cache_stats():
+    return jsonify(turn_cache.stats()), 200
+#延迟写入统计（待写行数、批次大小等）
+@chat_bp.route('/write-behind/stats', methods=['GET'])
+@ops_required
+def write_behind_stats():
+    return jsonify(write_behind.stats()), 200
+#大模型服务商统计（熔断状态、EWMA 延迟、在途数、对冲次数等）
+@chat_bp.route('/providers/stats', methods=['GET'])
+@ops_required
+def provider_stats():
+    return jsonify(provider_pool.stats()), 200
 #获取聊天历史 API
 @chat_bp.route('/history/', methods=['GET'])
 @login_required
+@replica_read
 #定义路由：处理 /history/ 的 GET 请求，用户必须登录。
 def get_chat_history():
     session_id = request.args.get('session_id')
     if not session_id:
         return jsonify({'error': '缺少session_id'}), 400
-    #查询消息：获取指定会话中的所有消息，按时间升序排列，并返回 JSON 格式。
-    messages = ChatMessage.query.filter_by(user_id=current_user.id, session_id=session_id).order_by(ChatMessage.timestamp.asc()).all()
-    return jsonify({'messages': [msg.to_dict() for msg in messages]}), 200
+    filters = (ChatMessage.user_id == current_user.id, ChatMessage.session_id == session_id)
+    #消息只追加不修改，条数 + 最大 id 即可判断历史是否变化；未变化时不再查询和序列化消息
+    count, last_id, last_modified = db.session.execute(
+        select(func.count(), func.max(ChatMessage.id), func.max(ChatMessage.timestamp)).where(*filters)).one()
+    etag = make_etag('history', current_user.id, session_id, count, last_id)
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+    try:
+        #format=ndjson：按时间升序流式输出全部（或 after 游标之后的）消息，先输出已归档的部分
+        if request.args.get('format') == 'ndjson':
+            query = select(ChatMessage).where(*filters)
+            boundary = None
+            if request.args.get('after'):
+                query = query.where(_keyset_after(ChatMessage.timestamp, ChatMessage.id, request.args['after']))
+                boundary = _cursor_key(request.args['after'])
+            query = query.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+            archived = message_archive.after(current_user.id, session_id, boundary)
+            return add_validators(_ndjson_response(query, lambda msg: msg.to_dict(), archived), etag, last_modified)
+        #默认分页：返回 before 游标之前最近的一页，页内按时间升序；next_cursor 用于继续向前翻页
+        limit = parse_limit(request.args.get('limit'), current_app.config['HISTORY_PAGE_SIZE'],
+                            current_app.config['MAX_PAGE_SIZE'])
+        query = ChatMessage.query.filter(*filters)
+        if request.args.get('before'):
+            query = query.filter(_keyset_before(ChatMessage.timestamp, ChatMessage.id, request.args['before']))
+        messages = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit + 1).all()
+        messages = [msg.to_dict() for msg in messages]
+        #热数据已经读到头时，继续从冷归档读取更早的消息
+        if len(messages) <= limit:
+            if messages:
+                boundary = message_key(messages[-1])
+            else:
+                boundary = _cursor_key(request.args['before']) if request.args.get('before') else None
+            messages += message_archive.before(current_user.id, session_id, boundary, limit + 1 - len(messages))
+    except ValueError:
+        return jsonify({'error': '游标格式不正确'}), 400
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    next_cursor = encode_cursor(*message_key(messages[-1])) if has_more else None
+    messages.reverse()
+    response = jsonify({'messages': messages, 'next_cursor': next_cursor, 'has_more': has_more})
+    return add_validators(response, etag, last_modified), 200
 #获取聊天会话 API
 @chat_bp.route('/sessions', methods=['GET'])
 @login_required
-#定义路由：处理 /sessions 的 GET 请求，用户必须登录。
+@replica_read
+#定义路由：处理 /sessions 的 GET 请求，用户必须登录。按创建时间倒序分页，参数与 /history/ 相同。
+#默认只返回摘要字段，include=context,meta_data,feedback 可附带对应字段
 def get_chat_sessions():
-    sessions = ChatSession.query.filter_by(user_id=current_user.id).order_by(ChatSession.created_at.desc()).all()
-    return jsonify({'sessions': [session.to_dict() for session in sessions]}), 200
+    filters = (ChatSession.user_id == current_user.id,)
+    include = {name for name in request.args.get('include', '').split(',') if name in SESSION_EXTRA_FIELDS}
+    #任何会话的增删改都会改变 条数 / 版本号之和 / 最大 id 之一
+    count, versions, last_id, last_updated, last_created = db.session.execute(
+        select(func.count(), func.sum(ChatSession.version), func.max(ChatSession.id),
+               func.max(ChatSession.updated_at), func.max(ChatSession.created_at)).where(*filters)).one()
+    last_modified = max(filter(None, (last_updated, last_created)), default=None)
+    etag = make_etag('sessions', current_user.id, count, versions, last_id)
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+    #只读取摘要列，context / meta_data 等 JSON 列不查询也不解析
+    columns = load_only(*(getattr(ChatSession, name) for name in ChatSession.SUMMARY_COLUMNS + tuple(include)))
+    try:
+        if request.args.get('format') == 'ndjson':
+            query = select(ChatSession).options(columns).where(*filters)
+            if request.args.get('before'):
+                query = query.where(_keyset_before(ChatSession.created_at, ChatSession.id, request.args['before']))
+            query = query.order_by(ChatSession.created_at.desc(), ChatSession.id.desc())
+            response = _ndjson_response(query, lambda session: session.to_summary_dict(include))
+            return add_validators(response, etag, last_modified)
+        limit = parse_limit(request.args.get('limit'), current_app.config['SESSION_PAGE_SIZE'],
+                            current_app.config['MAX_PAGE_SIZE'])
+        query = ChatSession.query.options(columns).filter(*filters)
+        if request.args.get('before'):
+            query = query.filter(_keyset_before(ChatSession.created_at, ChatSession.id, request.args['before']))
+        sessions = query.order_by(ChatSession.created_at.desc(), ChatSession.id.desc()).limit(limit + 1).all()
+    except ValueError:
+        return jsonify({'error': '游标格式不正确'}), 400
+    has_more = len(sessions) > limit
+    sessions = sessions[:limit]
+    next_cursor = encode_cursor(sessions[-1].created_at, sessions[-1].id) if has_more else None
+    response = jsonify({'sessions': [session.to_summary_dict(include) for session in sessions],
+                        'next_cursor': next_cursor, 'has_more': has_more})
+    return add_validators(response, etag, last_modified), 200
+
+#导出 API：流式导出当前用户的全部会话与消息（含已归档的消息），每个会话一行 session 记录、随后按时间升序是其消息。
+#format=ndjson（默认）/ csv，gzip=1 时边生成边压缩；session_id 可只导出一个会话。
+#每行都带 cursor，连接中断后用 after=最后收到的一行的 cursor 从该位置之后继续导出
+@chat_bp.route('/export', methods=['GET'])
+@login_required
+@replica_read
+def export_chats():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format 只支持 ndjson / csv'}), 400
+    cursor = request.args.get('after')
+    if cursor:
+        try:
+            parse_export_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': '游标格式不正确'}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"chat-export-{datetime.utcnow():%Y%m%d%H%M%S}.{extension}" + ('.gz' if compress else '')
+    body = chat_exporter.stream(current_user.id, fmt, compress, request.args.get('session_id'), cursor)
+    response = Response(stream_with_context(body), mimetype='application/gzip' if compress else mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 #会话反馈 CRUD
 @chat_bp.route('/session/<session_id>/feedback', methods=['GET'])
 @login_required
+@replica_read
 #获取反馈
 def get_feedback(session_id):
     #定义路由：处理获取指定会话反馈的请求。查询会话，如果不存在则返回 404。
@@ -100,6 +624,7 @@ def delete_feedback(session_id):
 # 会话主题 CRUD
 @chat_bp.route('/session/<session_id>/topic', methods=['GET'])
 @login_required
+@replica_read
 def get_topic(session_id):
     session = ChatSession.query.filter_by(session_id=session_id, user_id=current_user.id).first_or_404()
     return jsonify({'topic': session.topic}), 200
@@ -125,6 +650,7 @@ def delete_topic(session_id):
 # 会话上下文 CRUD
 @chat_bp.route('/session/<session_id>/context', methods=['GET'])
 @login_required
+@replica_read
 def get_context(session_id):
     session = ChatSession.query.filter_by(session_id=session_id, user_id=current_user.id).first_or_404()
     context = json.loads(session.context) if session.context else None
@@ -133,14 +659,39 @@ def get_context(session_id):
 @chat_bp.route('/session/<session_id>/context', methods=['POST'])
 @login_required
 def set_context(session_id):
-    session = ChatSession.query.filter_by(session_id=session_id, user_id=current_user.id).first_or_404()
-    data = request.get_json()
-    # 支持部分字段更新
-    context = json.loads(session.context) if session.context else {}
-    context.update(data.get('context', {}))
-    session.context = json.dumps(context, ensure_ascii=False)
+    data = request.get_json() or {}
+    patch = data.get('context') or {}
+    if not isinstance(patch, dict):
+        return jsonify({'error': 'context必须是对象'}), 400
+    #可选的乐观并发控制：请求头 If-Match 或请求体 version 指定期望的会话版本
+    expected = data.get('version')
+    if request.if_match and not request.if_match.star_tag:
+        expected = next(iter(request.if_match.as_set(include_weak=True)), expected)
+    try:
+        expected = int(expected) if expected is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'version格式不正确'}), 400
+    filters = [ChatSession.session_id == session_id, ChatSession.user_id == current_user.id]
+    # 支持部分字段更新（RFC 7396 合并语义，值为 null 的字段会被删除）
+    updated = ChatSession.merge_context(current_user.id, session_id, patch, expected)
+    if not updated:
+        db.session.rollback()
+        current = db.session.execute(select(ChatSession.version).where(*filters)).scalar()
+        if current is None:
+            return jsonify({'error': '会话不存在'}), 404
+        status = 412 if request.if_match else 409
+        return jsonify({'error': '会话已被修改', 'version': current}), status
+    db.session.flush()
+    context, version = db.session.execute(
+        select(ChatSession.context, ChatSession.version).where(*filters)).one()
     db.session.commit()
-    return jsonify({'message': '上下文已更新', 'context': context}), 200
+    turn_cache.invalidate(current_user.id, session_id)
+    #合并结果直接拼接进响应，不在 Python 中重新解析
+    body = (f'{{"message": "上下文已更新", "version": {version}, '
+            f'"context": {context or "null"}}}')
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(str(version))
+    return response, 200
 
 @chat_bp.route('/session/<session_id>/context', methods=['DELETE'])
 @login_required
@@ -148,4 +699,25 @@ def delete_context(session_id):
     session = ChatSession.query.filter_by(session_id=session_id, user_id=current_user.id).first_or_404()
     session.context = None
     db.session.commit()
-    return jsonify({'message': '上下文已删除'}), 200
\ No newline at end of file
+    turn_cache.invalidate(current_user.id, session_id)
+    return jsonify({'message': '上下文已删除'}), 200
+
+# 会话级回复缓存开关
+@chat_bp.route('/session/<session_id>/cache', methods=['GET'])
+@login_required
+@replica_read
+def get_cache_setting(session_id):
+    session = ChatSession.query.filter_by(session_id=session_id, user_id=current_user.id).first_or_404()
+    return jsonify({'enabled': _load_meta(session).get('response_cache', True)}), 200
+
+@chat_bp.route('/session/<session_id>/cache', methods=['POST'])
+@login_required
+def set_cache_setting(session_id):
+    session = ChatSession.query.filter_by(session_id=session_id, user_id=current_user.id).first_or_404()
+    data = request.get_json()
+    meta_data = _load_meta(session)
+    meta_data['response_cache'] = bool(data.get('enabled', True))
+    session.meta_data = json.dumps(meta_data, ensure_ascii=False)
+    db.session.commit()
+    turn_cache.invalidate(current_user.id, session_id)
+    return jsonify({'message': '缓存设置已更新', 'enabled': meta_data['response_cache']}), 200
@@ -1,62 +1,109 @@
 import eventlet
 eventlet.monkey_patch()  # 确保这一行在其他导入之前
-from flask import Flask, render_template, jsonify, request
+from utils.startup import startup_timer  # 尽早导入，从此处开始计时
+from flask import Flask, render_template, jsonify, request, Response
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_login import login_required, current_user
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
 from models import db, login_manager
-from models.user import User
 from api.auth import auth_bp
 from api.chat import chat_bp
+from utils.streaming import stream_manager
+from utils.batch import batch_runner
+from utils.scheduler import llm_scheduler
+from utils.providers import provider_pool
+from utils.response_cache import response_cache
+from utils.context_builder import context_builder
+from utils.migrations import migrations
+from utils.db_routing import db_router
+from utils.search import search_index
+from utils.turn_cache import turn_cache
+from utils.write_behind import write_behind
+from utils.archive import message_archive
+from utils.maintenance import maintenance
+from utils.usage import usage_rollup
+from utils.export import chat_exporter
+from utils.rate_limit import rate_limiter
+from utils.user_cache import user_cache
+from utils.hashing import password_hasher
+from utils.log_pipeline import log_pipeline
+from utils.metrics import metrics, ops_required, token_authorized
+from utils.socket_broker import message_queue_options
+from utils.uploads import store_stream, Base64Reader, EXTENSIONS
 import logging
-from logging.handlers import RotatingFileHandler
 import os
-import base64
-import time
+import binascii
+
+startup_timer.mark('import')
 
 def create_app():
 
     app = Flask(__name__)
     app.config.from_object(Config)
-
-    # 初始化扩展
+    if app.config['PROXY_FIX_X_FOR']:
+        # 部署在反向代理之后：request.remote_addr 取代理转发的客户端地址（限流、日志使用）
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'],
+                                x_proto=app.config['PROXY_FIX_X_FOR'])
+    startup_timer.mark('config')
+
+    # 初始化扩展（db_router 需在 db.init_app 之前组装引擎参数）
+    db_router.init_app(app)
     db.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'login'
+    llm_scheduler.init_app(app)
+    provider_pool.init_app(app)
+    response_cache.init_app(app)
+    context_builder.init_app(app)
+    batch_runner.init_app(app)
+    turn_cache.init_app(app)
+    write_behind.init_app(app)
+    message_archive.init_app(app)
+    usage_rollup.init_app(app)
+    chat_exporter.init_app(app)
+    maintenance.init_app(app)
+    rate_limiter.init_app(app)
+    user_cache.init_app(app)
+    password_hasher.init_app(app)
+    search_index.init_app(app)
+    metrics.init_app(app)
+    for component, source in (('scheduler', llm_scheduler), ('stream', stream_manager), ('batch', batch_runner),
+                              ('response_cache', response_cache), ('context', context_builder),
+                              ('turn_cache', turn_cache), ('write_behind', write_behind),
+                              ('user_cache', user_cache), ('password_hash', password_hasher),
+                              ('search', search_index), ('archive', message_archive),
+                              ('maintenance', maintenance), ('usage', usage_rollup), ('rate_limit', rate_limiter),
+                              ('export', chat_exporter), ('startup', startup_timer),
+                              ('db', db_router), ('log', log_pipeline)):
+        metrics.register_stats(component, source.stats)
+    for provider in provider_pool.providers:
+        metrics.register_stats(f'provider_{provider.name}', provider.stats)
+    startup_timer.mark('extensions')
 
     # 注册蓝图
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(chat_bp, url_prefix='/api/chat')
+    startup_timer.mark('blueprints')
 
     # 日志目录
     log_dir = os.path.join(os.path.dirname(__file__), 'logs')
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
 
-    # 日志文件路径
-    log_file = os.path.join(log_dir, 'app_log.txt')
-
-    # 配置日志处理器
-    handler = RotatingFileHandler(
-        log_file, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8'
-    )
-    formatter = logging.Formatter(
-        '[%(asctime)s] [%(levelname)s] %(pathname)s:%(lineno)d - %(message)s'
-    )
-    handler.setFormatter(formatter)
-    handler.setLevel(logging.INFO)
-
-    logging.basicConfig(
-        level=logging.INFO,
-        handlers=[handler],
-        format='[%(asctime)s] [%(levelname)s] %(pathname)s:%(lineno)d - %(message)s'
-    )
+    # 日志文件路径（可通过 LOG_FILE 指定）
+    log_file = app.config.get('LOG_FILE') or os.path.join(log_dir, 'app_log.txt')
+
+    # 配置日志处理器（默认异步写入，见 LOG_ASYNC / LOG_JSON 等配置）
+    log_pipeline.init_app(app, log_file)
 
     logging.info("日志系统初始化完成")
+    startup_timer.mark('logging')
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        #每个请求和 Socket.IO 事件都会调用，优先使用身份缓存
+        return user_cache.get(int(user_id))
 
     # 路由
     @app.route('/')
@@ -78,24 +125,49 @@ def create_app():
 
     @app.route('/api/upload_screenshot', methods=['POST'])
     def upload_screenshot():
-        data = request.get_json()
-        img_base64 = data.get('image')
-        if not img_base64:
-            return jsonify({'success': False, 'msg': 'No image data'}), 400
+        # 三种上传方式：multipart 表单（字段 image）、原始二进制请求体（Content-Type 为图片类型）、
+        # 兼容旧版的 JSON base64（{"image": "..."}）。均分块落盘并按内容哈希去重
+        save_dir = os.path.join(os.path.dirname(__file__), 'logs', 'screenshots')
         try:
-            img_bytes = base64.b64decode(img_base64)
-            filename = f"screenshot_{int(time.time())}.png"
-            save_dir = os.path.join(os.path.dirname(__file__), 'logs', 'screenshots')
-            if not os.path.exists(save_dir):
-                os.makedirs(save_dir)
-            file_path = os.path.join(save_dir, filename)
-            with open(file_path, 'wb') as f:
-                f.write(img_bytes)
-            logging.info(f"收到前端上传的截图，已保存为 {file_path}")
-            return jsonify({'success': True, 'msg': 'Screenshot saved'})
+            if request.mimetype == 'application/json':
+                data = request.get_json()
+                img_base64 = data.get('image') if data else None
+                if not img_base64:
+                    return jsonify({'success': False, 'msg': 'No image data'}), 400
+                result = store_stream(Base64Reader(img_base64), save_dir)
+                # JSON 正文本身仍需整体解析，缓冲峰值按 base64 文本长度计
+                result['peak_buffer_bytes'] += len(img_base64)
+            elif request.mimetype == 'multipart/form-data':
+                image = request.files.get('image')
+                if image is None:
+                    return jsonify({'success': False, 'msg': 'No image data'}), 400
+                result = store_stream(image.stream, save_dir, EXTENSIONS.get(image.mimetype, '.png'))
+            else:
+                if not request.content_length:
+                    return jsonify({'success': False, 'msg': 'No image data'}), 400
+                result = store_stream(request.stream, save_dir, EXTENSIONS.get(request.mimetype, '.png'))
+        except binascii.Error:
+            return jsonify({'success': False, 'msg': 'Invalid base64 data'}), 400
         except Exception as e:
             logging.error(f"保存截图失败: {str(e)}")
             return jsonify({'success': False, 'msg': 'Save failed'}), 500
+        logging.info(f"收到前端上传的截图 {result['size']} 字节，已保存为 {result['path']}"
+                     f"{'（内容重复）' if result['duplicate'] else ''}，{result['throughput_mb_s']} MB/s")
+        result.pop('path')
+        return jsonify(dict(result, success=True, msg='Screenshot saved'))
+
+    #日志队列统计（排队数、丢弃数、采样丢弃数），与各组件的 /stats 接口一样凭 METRICS_TOKEN 访问
+    @app.route('/api/log/stats', methods=['GET'])
+    @ops_required
+    def log_stats():
+        return jsonify(log_pipeline.stats()), 200
+
+    #Prometheus 指标（汇总所有 worker），配置 METRICS_TOKEN 时需携带 Bearer token
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        if not token_authorized():
+            return jsonify({'error': '未授权'}), 401
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
     # 错误处理
     @app.errorhandler(404)
@@ -107,18 +179,23 @@ def create_app():
         db.session.rollback()
         return jsonify({'error': '服务器内部错误'}), 500
 
-    # 创建数据库表
-    with app.app_context():
-        db.create_all()
+    # 表结构由迁移脚本维护（flask --app app db upgrade），启动时不连接数据库
+    migrations.init_app(app)
 
     return app
 
 # 创建应用和SocketIO实例
 app = create_app()
-socketio = SocketIO(app, cors_allowed_origins="*")
+# 多 worker 时通过 SOCKETIO_MESSAGE_QUEUE 在 worker 之间分发房间事件
+socketio = SocketIO(app, cors_allowed_origins="*", **message_queue_options(app.config))
+if hasattr(socketio.server.manager, 'stats'):
+    metrics.register_stats('socketio_queue', socketio.server.manager.stats)
+startup_timer.mark('socketio')
+startup_timer.report('应用加载')
 
 # WebSocket事件处理
 @socketio.on('connect')
+@metrics.timed_event('connect')
 @login_required
 def handle_connect():
     join_room(f'user_{current_user.id}')
@@ -130,6 +207,7 @@ def handle_disconnect():
     leave_room(f'user_{current_user.id}')
 
 @socketio.on('join_chat')
+@metrics.timed_event('join_chat')
 @login_required
 def handle_join_chat(data):
     session_id = data.get('session_id')
@@ -137,9 +215,18 @@ def handle_join_chat(data):
         join_room(session_id)
         emit('status', {'msg': f'已加入聊天室 {session_id}'})
 
+@socketio.on('cancel_generation')
+@login_required
+def handle_cancel_generation(data):
+    stream_id = data.get('stream_id')
+    if stream_id and stream_manager.cancel(stream_id, current_user.id):
+        emit('status', {'msg': f'已取消生成 {stream_id}'})
+
 if __name__ == '__main__':
     import eventlet
     import eventlet.wsgi
+    # 开发服务器启动前自动执行迁移；生产环境由部署脚本执行 flask --app app db upgrade
+    migrations.upgrade(app)
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
 
 
@@ -0,0 +1,351 @@
+"""
+端到端压测：启动本地模拟千帆服务和 gunicorn（使用 gunicorn_config.py），模拟用户流程并与基线对比。
+
+每个虚拟用户依次：注册 -> 登录 -> 循环 [发送消息 -> 读取历史 -> 会话列表]，首次发送后通过
+Socket.IO（engine.io 长轮询）加入会话房间。输出各操作的吞吐量、p50/p95/p99 延迟、错误数，
+以及每个 gunicorn worker 的内存（RSS）。
+
+用法：
+  python -m benchmarks.load_test --users 50 --duration 30 --workers 4
+  python -m benchmarks.load_test --save-baseline benchmarks/baseline.json
+  python -m benchmarks.load_test --baseline benchmarks/baseline.json --fail-on-regression
+  python -m benchmarks.load_test --url http://127.0.0.1:5000   # 压测已运行的服务（不启动 gunicorn）
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPS = ('register', 'login', 'send', 'history', 'sessions', 'socketio_join')
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {op: [] for op in OPS}
+        self.errors = {op: 0 for op in OPS}
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def timed(self, op, func, expect=(200,)):
+        start = time.perf_counter()
+        try:
+            response = func()
+            ok = response.status_code in expect
+            status = response.status_code
+        except Exception as e:
+            response, ok, status = None, False, type(e).__name__
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            if ok:
+                self.samples[op].append(elapsed)
+            else:
+                self.errors[op] += 1
+                key = f'{op}:{status}'
+                self.statuses[key] = self.statuses.get(key, 0) + 1
+        return response if ok else None
+
+
+class PollingResponse:
+    """把多步长轮询握手包装成一个带 status_code 的结果，便于统一计时。"""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def socketio_join(client, session_id, timeout=10):
+    """通过 engine.io v4 长轮询完成连接并发送 join_chat，收到 status 事件即视为成功。"""
+    params = {'EIO': '4', 'transport': 'polling'}
+    r = client.get('/socket.io/', params=params)
+    if r.status_code != 200 or not r.text.startswith('0'):
+        return PollingResponse(r.status_code if r.status_code != 200 else 599)
+    params['sid'] = json.loads(r.text[1:])['sid']
+    client.post('/socket.io/', params=params, content='40')
+    client.post('/socket.io/', params=params,
+                content='42' + json.dumps(['join_chat', {'session_id': session_id}], ensure_ascii=False))
+    deadline = time.monotonic() + timeout
+    joined = False
+    while not joined and time.monotonic() < deadline:
+        r = client.get('/socket.io/', params=params, timeout=timeout)
+        if r.status_code != 200:
+            return PollingResponse(r.status_code)
+        for packet in r.text.split('\x1e'):
+            if packet.startswith('42') and session_id in packet:
+                joined = True
+    client.post('/socket.io/', params=params, content='41')
+    return PollingResponse(200 if joined else 598)
+
+
+def user_flow(base_url, index, run_id, deadline, recorder, think_time, stream):
+    username = f'bench_{run_id}_{index}'
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        if recorder.timed('register', lambda: client.post('/api/auth/register', json={
+                'username': username, 'email': f'{username}@bench.local', 'password': 'benchmark'}),
+                expect=(201,)) is None:
+            return
+        client.cookies.clear()
+        if recorder.timed('login', lambda: client.post('/api/auth/login', json={
+                'username': username, 'password': 'benchmark'})) is None:
+            return
+        session_id, joined, turn = None, False, 0
+        while time.monotonic() < deadline:
+            turn += 1
+            payload = {'message': f'压测消息 {index}-{turn} ' + uuid.uuid4().hex[:8], 'session_id': session_id,
+                       'stream': stream}
+            r = recorder.timed('send', lambda: client.post('/api/chat/send', json=payload),
+                               expect=(202,) if stream else (200,))
+            if r is not None:
+                session_id = r.json().get('session_id') or session_id
+            if session_id and not joined:
+                joined = recorder.timed('socketio_join', lambda: socketio_join(client, session_id)) is not None
+            if session_id:
+                recorder.timed('history', lambda: client.get('/api/chat/history/', params={
+                    'session_id': session_id, 'limit': 30}))
+            recorder.timed('sessions', lambda: client.get('/api/chat/sessions', params={'limit': 20}))
+            if think_time:
+                time.sleep(random.uniform(0, 2 * think_time))
+
+
+def worker_pids(master_pid):
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(name))
+    return sorted(pids)
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+class MemorySampler(threading.Thread):
+    """每秒采样一次各 worker 的 RSS，记录当前值与峰值。"""
+
+    def __init__(self, master_pid):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.peak = {}
+        self.last = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            for pid in worker_pids(self.master_pid):
+                value = rss_mb(pid)
+                if value is not None:
+                    self.last[pid] = value
+                    self.peak[pid] = max(self.peak.get(pid, 0), value)
+            self.stopped.wait(1)
+
+    def report(self):
+        return [{'pid': pid, 'rss_mb': self.last.get(pid), 'peak_rss_mb': peak}
+                for pid, peak in sorted(self.peak.items())]
+
+
+def wait_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    return False
+
+
+def start_servers(args, workdir):
+    mock_port = free_port()
+    mock = subprocess.Popen([sys.executable, '-m', 'benchmarks.mock_qianfan', '--port', str(mock_port),
+                             '--latency', str(args.llm_latency), '--ttft', str(args.llm_ttft),
+                             '--error-rate', str(args.llm_error_rate)], cwd=ROOT)
+    app_port = free_port()
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + os.path.join(workdir, 'bench.db'),
+               QIANFAN_BASE_URL=f'http://127.0.0.1:{mock_port}/v2',
+               QIANFAN_API_KEY='benchmark',
+               RESPONSE_CACHE_ENABLED='1' if args.cache else '0',
+               RESPONSE_CACHE_SHARED_PATH=os.path.join(workdir, 'response_cache.db'),
+               METRICS_DIR=os.path.join(workdir, 'metrics'),
+               LOG_FILE=os.path.join(workdir, 'app_log.txt'))
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py',
+               '--bind', f'127.0.0.1:{app_port}', '--workers', str(args.workers), 'app:app']
+    gunicorn = subprocess.Popen(command, cwd=ROOT, env=env)
+    base_url = f'http://127.0.0.1:{app_port}'
+    if not wait_ready(f'http://127.0.0.1:{mock_port}/v2/stats') or not wait_ready(base_url + '/login'):
+        stop(mock, gunicorn)
+        raise SystemExit('服务启动失败')
+    return base_url, mock, gunicorn
+
+
+def stop(*processes):
+    for process in processes:
+        if process is not None and process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    for process in processes:
+        if process is not None:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def summarize(recorder, elapsed):
+    ops = {}
+    for op in OPS:
+        samples = recorder.samples[op]
+        ops[op] = {
+            'count': len(samples),
+            'errors': recorder.errors[op],
+            'throughput': round(len(samples) / elapsed, 2),
+            'p50_ms': round(percentile(samples, 0.5), 1) if samples else None,
+            'p95_ms': round(percentile(samples, 0.95), 1) if samples else None,
+            'p99_ms': round(percentile(samples, 0.99), 1) if samples else None,
+        }
+    total = sum(len(s) for s in recorder.samples.values())
+    return {'ops': ops, 'total_throughput': round(total / elapsed, 2),
+            'total_errors': sum(recorder.errors.values()), 'error_statuses': recorder.statuses}
+
+
+def compare(result, baseline, tolerance):
+    """与基线对比：p95 变慢或吞吐量下降超过 tolerance（比例）、错误率上升视为回归。"""
+    regressions, rows = [], []
+    for op, current in result['ops'].items():
+        base = baseline.get('ops', {}).get(op)
+        if not base or not base.get('count') or not current.get('count'):
+            continue
+        row = {'op': op}
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput'):
+            if base.get(key):
+                row[key] = f'{base[key]} -> {current[key]} ({(current[key] - base[key]) / base[key] * 100:+.1f}%)'
+        rows.append(row)
+        if base.get('p95_ms') and current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{op} p95 {base["p95_ms"]}ms -> {current["p95_ms"]}ms')
+        if base.get('throughput') and current['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f'{op} 吞吐量 {base["throughput"]}/s -> {current["throughput"]}/s')
+        base_rate = base['errors'] / (base['count'] + base['errors'])
+        rate = current['errors'] / (current['count'] + current['errors'])
+        if rate > base_rate + 0.01:
+            regressions.append(f'{op} 错误率 {base_rate:.2%} -> {rate:.2%}')
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='压测已运行的服务，不启动模拟服务和 gunicorn')
+    parser.add_argument('--users', type=int, default=20, help='并发虚拟用户数')
+    parser.add_argument('--duration', type=float, default=20, help='压测时长（秒）')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker 数')
+    parser.add_argument('--think-time', type=float, default=0.2, help='每轮之间的平均等待（秒）')
+    parser.add_argument('--stream', action='store_true', help='发送消息使用流式模式（只统计 202 返回耗时）')
+    parser.add_argument('--cache', action='store_true', help='开启 AI 回复缓存（默认关闭，保证每次都调用模拟服务）')
+    parser.add_argument('--llm-latency', type=float, default=300, help='模拟服务响应耗时（毫秒）')
+    parser.add_argument('--llm-ttft', type=float, default=150, help='模拟服务流式首字延迟（毫秒）')
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--output', help='结果写入 JSON 文件')
+    parser.add_argument('--save-baseline', help='把本次结果保存为基线')
+    parser.add_argument('--baseline', help='与基线 JSON 对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='回归判定阈值（比例）')
+    parser.add_argument('--fail-on-regression', action='store_true', help='发现回归时以非零状态退出')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='flaskchat-bench-')
+    mock = gunicorn = sampler = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        base_url, mock, gunicorn = start_servers(args, workdir)
+        sampler = MemorySampler(gunicorn.pid)
+        sampler.start()
+    try:
+        recorder = Recorder()
+        run_id = uuid.uuid4().hex[:6]
+        started = time.monotonic()
+        deadline = started + args.duration
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            for index in range(args.users):
+                pool.submit(user_flow, base_url, index, run_id, deadline, recorder, args.think_time, args.stream)
+        elapsed = time.monotonic() - started
+    finally:
+        if sampler is not None:
+            sampler.stopped.set()
+            sampler.join()
+        stop(gunicorn, mock)
+
+    result = summarize(recorder, elapsed)
+    result['config'] = {key: getattr(args, key) for key in ('users', 'duration', 'workers', 'think_time', 'stream',
+                                                             'cache', 'llm_latency', 'llm_ttft', 'llm_error_rate')}
+    result['workers'] = sampler.report() if sampler is not None else []
+
+    print(f"{'op':<14}{'count':>8}{'errors':>8}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for op, item in result['ops'].items():
+        print(f"{op:<14}{item['count']:>8}{item['errors']:>8}{item['throughput']:>10}"
+              f"{str(item['p50_ms']):>10}{str(item['p95_ms']):>10}{str(item['p99_ms']):>10}")
+    print(f"总吞吐量 {result['total_throughput']} req/s，错误 {result['total_errors']} {result['error_statuses']}")
+    for worker in result['workers']:
+        print(f"worker {worker['pid']}: RSS {worker['rss_mb']} MB（峰值 {worker['peak_rss_mb']} MB）")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressions = compare(result, baseline, args.tolerance)
+        print('\n与基线对比：')
+        changed = {key: (baseline.get('config', {}).get(key), value) for key, value in result['config'].items()
+                   if baseline.get('config', {}).get(key) != value}
+        if changed:
+            print(f'  注意：压测参数与基线不同 {changed}')
+        for row in rows:
+            print('  ' + '  '.join(f'{k}={v}' for k, v in row.items()))
+        if regressions:
+            print('发现回归：\n  ' + '\n  '.join(regressions))
+            if args.fail_on_regression:
+                sys.exit(1)
+        else:
+            print('未发现回归')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+并发登录对聊天延迟的影响基准。
+
+在同一个 eventlet 进程中同时运行：
+- N 个 greenlet 循环调用 /api/auth/login（密码哈希为 CPU 密集操作）
+- 1 个 greenlet 循环调用 /api/chat/send（AI 调用被替换为立即返回）
+分别用 inline（在事件循环中直接计算）和 thread（tpool）两种模式运行，输出聊天请求的延迟分位数。
+
+用法：python -m benchmarks.login_load --logins 20 --duration 5
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite:///' + tempfile.mktemp(suffix='.db')
+os.environ.setdefault('QIANFAN_API_KEY', 'benchmark')
+os.environ['RESPONSE_CACHE_ENABLED'] = '0'
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def run(app, mode, logins, duration):
+    from utils.hashing import password_hasher
+    password_hasher.mode = mode
+    chat_latencies, login_count, busy = [], [0], [0]
+    deadline = time.monotonic() + duration
+
+    def login_loop():
+        client = app.test_client()
+        while time.monotonic() < deadline:
+            r = client.post('/api/auth/login', json={'username': 'bench', 'password': 'benchmark'})
+            if r.status_code == 200:
+                login_count[0] += 1
+            elif r.status_code == 429:
+                busy[0] += 1
+            eventlet.sleep(0)
+
+    def chat_loop():
+        client = app.test_client()
+        client.post('/api/auth/login', json={'username': 'bench', 'password': 'benchmark'})
+        session_id = None
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            r = client.post('/api/chat/send', json={'message': 'ping', 'session_id': session_id})
+            chat_latencies.append((time.monotonic() - start) * 1000)
+            session_id = r.get_json().get('session_id')
+            eventlet.sleep(0.01)
+
+    pool = eventlet.GreenPool()
+    pool.spawn(chat_loop)
+    for _ in range(logins):
+        pool.spawn(login_loop)
+    pool.waitall()
+    return {
+        'mode': mode,
+        'logins_per_s': round(login_count[0] / duration, 1),
+        'login_rejected': busy[0],
+        'chat_requests': len(chat_latencies),
+        'chat_p50_ms': round(percentile(chat_latencies, 0.5), 1),
+        'chat_p95_ms': round(percentile(chat_latencies, 0.95), 1),
+        'chat_max_ms': round(max(chat_latencies), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=20, help='并发登录 greenlet 数')
+    parser.add_argument('--duration', type=float, default=5, help='每种模式运行秒数')
+    parser.add_argument('--modes', default='inline,thread')
+    args = parser.parse_args()
+
+    from types import SimpleNamespace
+    import app as app_module
+    from utils.providers import provider_pool
+    from utils.migrations import migrations
+    app = app_module.app
+    migrations.upgrade(app)
+    reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='pong'))])
+    provider_pool.providers[0].client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **kwargs: reply)))
+    app.test_client().post('/api/auth/register',
+                           json={'username': 'bench', 'email': 'bench@example.com', 'password': 'benchmark'})
+
+    for mode in args.modes.split(','):
+        print(run(app, mode, args.logins, args.duration))
+
+
+if __name__ == '__main__':
+    main()
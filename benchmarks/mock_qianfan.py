@@ -0,0 +1,160 @@
+"""
+本地 OpenAI 兼容模拟服务（代替千帆 /v2/chat/completions，用于压测）。
+
+- 非流式：等待 --latency 毫秒（±--jitter）后返回完整回复与 usage
+- 流式（stream=true）：等待 --ttft 毫秒后按 SSE 逐段推送，段间隔 --token-interval 毫秒；
+  请求带 stream_options.include_usage 时最后推送 usage
+- --error-rate 比例的请求返回 500（--error-status 可改为 429 等）
+
+用法：python -m benchmarks.mock_qianfan --port 8900 --latency 300
+应用侧设置 QIANFAN_BASE_URL=http://127.0.0.1:8900/v2
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+
+
+class MockOptions:
+    latency = 300
+    jitter = 50
+    ttft = 150
+    token_interval = 20
+    tokens = 40
+    error_rate = 0.0
+    error_status = 500
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    options = MockOptions()
+    counter_lock = threading.Lock()
+    requests = 0
+    errors = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sleep(self, ms):
+        jitter = self.options.jitter
+        time.sleep(max(0.0, ms + random.uniform(-jitter, jitter)) / 1000)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'):
+            self._send_json(200, {'requests': MockHandler.requests, 'errors': MockHandler.errors})
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        with MockHandler.counter_lock:
+            MockHandler.requests += 1
+            failed = random.random() < self.options.error_rate
+            if failed:
+                MockHandler.errors += 1
+        if failed:
+            self._sleep(self.options.ttft)
+            self._send_json(self.options.error_status, {'error': {'message': 'mock upstream error',
+                                                                  'type': 'server_error'}})
+            return
+
+        prompt = ''.join(m.get('content') or '' for m in body.get('messages', []))
+        last = (body.get('messages') or [{}])[-1].get('content') or ''
+        pieces = [f'回复{i}' for i in range(self.options.tokens)]
+        usage = {'prompt_tokens': max(1, len(prompt) // 2), 'completion_tokens': len(pieces),
+                 'total_tokens': max(1, len(prompt) // 2) + len(pieces)}
+        completion_id = 'chatcmpl-' + uuid.uuid4().hex
+        model = body.get('model', 'mock')
+
+        if not body.get('stream'):
+            self._sleep(self.options.latency)
+            self._send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': f'[mock] {last[:50]} ' + ''.join(pieces)}}],
+                'usage': usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def event(payload):
+            self.wfile.write(b'data: ' + json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n\n')
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+
+        try:
+            self._sleep(self.options.ttft)
+            event(chunk({'role': 'assistant', 'content': f'[mock] {last[:50]} '}))
+            for piece in pieces:
+                time.sleep(self.options.token_interval / 1000)
+                event(chunk({'content': piece}))
+            event(chunk({}, 'stop'))
+            if (body.get('stream_options') or {}).get('include_usage'):
+                event({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                       'model': model, 'choices': [], 'usage': usage})
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消生成时会提前断开
+            pass
+        self.close_connection = True
+
+
+def serve(host='127.0.0.1', port=8900, **options):
+    # 每个服务实例使用独立的参数，便于在同一进程中模拟多个快慢不同的服务商
+    mock_options = MockOptions()
+    for key, value in options.items():
+        setattr(mock_options, key, value)
+    handler = type('MockHandler', (MockHandler,), {'options': mock_options})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=MockOptions.latency, help='非流式响应耗时（毫秒）')
+    parser.add_argument('--jitter', type=float, default=MockOptions.jitter, help='耗时随机抖动（毫秒）')
+    parser.add_argument('--ttft', type=float, default=MockOptions.ttft, help='流式首字延迟（毫秒）')
+    parser.add_argument('--token-interval', type=float, default=MockOptions.token_interval, help='流式分段间隔（毫秒）')
+    parser.add_argument('--tokens', type=int, default=MockOptions.tokens, help='每次回复的分段数')
+    parser.add_argument('--error-rate', type=float, default=MockOptions.error_rate, help='返回错误的请求比例')
+    parser.add_argument('--error-status', type=int, default=MockOptions.error_status)
+    args = parser.parse_args()
+    server = serve(args.host, args.port, latency=args.latency, jitter=args.jitter, ttft=args.ttft,
+                   token_interval=args.token_interval, tokens=args.tokens, error_rate=args.error_rate,
+                   error_status=args.error_status)
+    print(f'mock qianfan listening on http://{args.host}:{args.port}/v2', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
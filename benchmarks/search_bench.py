@@ -0,0 +1,166 @@
+"""
+全文检索基准（utils/search.py）。
+
+在临时 SQLite 库中生成 --rows 条中英文混合的聊天记录（用户按 Zipf 分布，头部用户有十万级记录），然后：
+- 用 search_index.rebuild() 建索引，输出回填速度与索引占用空间（相对原始数据的倍数）
+- 对比 ORM 写入 1000 条消息时开启/关闭索引同步的耗时
+- 对重度用户与普通用户分别执行多类查询（双字词、长短语、单字、英文词、多关键词），
+  输出 FTS5 检索与 LIKE '%...%' 扫描的 p50/p95/p99 延迟
+
+用法：python -m benchmarks.search_bench --rows 1000000 --users 1000 --queries 200
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite:///' + tempfile.mktemp(suffix='.db')
+os.environ.setdefault('QIANFAN_API_KEY', 'benchmark')
+os.environ['RESPONSE_CACHE_SHARED_PATH'] = tempfile.mktemp(suffix='.cache.db')
+os.environ['METRICS_ENABLED'] = '0'
+
+WORDS = ('今天 明天 天气 怎么样 推荐 一下 北京 上海 旅游 攻略 学习 编程 教程 数据库 索引 优化 性能 '
+         '模型 训练 问题 解决 方法 为什么 如何 可以 需要 帮我 写 一篇 文章 总结 翻译 代码 错误 '
+         '猫 狗 咖啡 电影 音乐 健身 减肥 食谱 晚饭 周末 计划 工作 面试 简历 项目 经验 '
+         'python java sql linux docker redis flask api http json').split()
+QUERIES = {
+    'bigram': ['天气', '教程', '索引', '咖啡', '面试'],
+    'phrase': ['数据库索引', '旅游攻略', '性能优化', '模型训练'],
+    'single_char': ['猫', '狗', '写'],
+    'english': ['python', 'docker', 'flask'],
+    'multi_term': ['python 教程', '北京 旅游', '天气 周末'],
+}
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))], 2)
+
+
+def sentence(rng, low, high):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return ''.join(w if '\u4e00' <= w[0] <= '\u9fff' else f' {w} ' for w in words)
+
+
+def populate(engine, rows, users, seed):
+    from sqlalchemy import text
+    from datetime import datetime, timedelta
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, users + 1)]
+    counts = {}
+    base = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO user (id, username, email, password_hash, created_at) "
+                          "VALUES (:id, :name, :email, 'x', :ts)"),
+                     [{'id': u, 'name': f'u{u}', 'email': f'u{u}@bench', 'ts': base} for u in range(1, users + 1)])
+        conn.execute(text("INSERT INTO chat_session (session_id, user_id, status, created_at, start_time) "
+                          "VALUES (:sid, :uid, 'active', :ts, :ts)"),
+                     [{'sid': f's{u}', 'uid': u, 'ts': base} for u in range(1, users + 1)])
+    batch = 20000
+    for offset in range(0, rows, batch):
+        params = []
+        for i in range(offset, min(rows, offset + batch)):
+            user_id = rng.choices(range(1, users + 1), weights)[0]
+            counts[user_id] = counts.get(user_id, 0) + 1
+            params.append({'uid': user_id, 'sid': f's{user_id}', 'm': sentence(rng, 3, 12),
+                           'r': sentence(rng, 10, 40), 'ts': base + timedelta(seconds=i)})
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO chat_message (user_id, session_id, message, response, sender, "
+                              "timestamp) VALUES (:uid, :sid, :m, :r, 'user', :ts)"), params)
+    return counts
+
+
+def used_bytes(engine):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        page_size = conn.execute(text('PRAGMA page_size')).scalar()
+        pages = conn.execute(text('PRAGMA page_count')).scalar()
+        pages -= conn.execute(text('PRAGMA freelist_count')).scalar()
+    return page_size * pages
+
+
+def like_search(user_id, query, limit=20):
+    from sqlalchemy import text
+    from models import db
+    params = {'user_id': user_id, 'limit': limit}
+    clauses = []
+    for i, term in enumerate(query.split()):
+        params[f'p{i}'] = f'%{term}%'
+        clauses.append(f'(message LIKE :p{i} OR response LIKE :p{i})')
+    return db.session.execute(text(f"SELECT id FROM chat_message WHERE user_id = :user_id "
+                                   f"AND {' AND '.join(clauses)} ORDER BY id DESC LIMIT :limit"), params).all()
+
+
+def measure(func, user_ids, queries, count):
+    rng = random.Random(1)
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func(rng.choice(user_ids), rng.choice(queries))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {'p50_ms': percentile(latencies, 0.5), 'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='生成的消息条数')
+    parser.add_argument('--users', type=int, default=1000, help='用户数（Zipf 分布）')
+    parser.add_argument('--queries', type=int, default=200, help='每类查询的执行次数')
+    parser.add_argument('--like-queries', type=int, default=20, help='LIKE 基线每类查询的执行次数')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from app import app
+    from models import db
+    from models.chat import ChatMessage
+    from utils.search import search_index
+    from utils.migrations import migrations
+
+    migrations.upgrade(app)
+    with app.app_context():
+        engine = db.engine
+        start = time.perf_counter()
+        counts = populate(engine, args.rows, args.users, args.seed)
+        data_bytes = used_bytes(engine)
+        print({'populate_rows': args.rows, 'elapsed_s': round(time.perf_counter() - start, 1),
+               'data_mb': round(data_bytes / 1024 / 1024, 1)}, flush=True)
+
+        result = search_index.rebuild()
+        index_bytes = used_bytes(engine) - data_bytes
+        print({'rebuild_rows': result['rows'], 'elapsed_s': result['elapsed_s'],
+               'rows_per_s': round(result['rows'] / result['elapsed_s']) if result['elapsed_s'] else None,
+               'index_mb': round(index_bytes / 1024 / 1024, 1),
+               'index_to_data_ratio': round(index_bytes / data_bytes, 2)}, flush=True)
+
+        rng = random.Random(args.seed)
+        for label, backend in (('sync_on', 'fts5'), ('sync_off', None)):
+            search_index.backend = backend
+            start = time.perf_counter()
+            for _ in range(10):
+                db.session.add_all([ChatMessage(user_id=1, session_id='s1', message=sentence(rng, 3, 12),
+                                                response=sentence(rng, 10, 40)) for _ in range(100)])
+                db.session.commit()
+            print({'orm_insert_1000': label, 'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)},
+                  flush=True)
+        search_index.backend = 'fts5'
+
+        ranked = sorted(counts, key=counts.get, reverse=True)
+        groups = {'heavy': ranked[:3], 'typical': ranked[len(ranked) // 2:len(ranked) // 2 + 50]}
+        for group, user_ids in groups.items():
+            rows_per_user = round(sum(counts[u] for u in user_ids) / len(user_ids))
+            for kind, queries in QUERIES.items():
+                fts = measure(lambda u, q: search_index.search(u, q, 20), user_ids, queries, args.queries)
+                like = measure(like_search, user_ids, queries, args.like_queries)
+                print({'users': group, 'rows_per_user': rows_per_user, 'query': kind,
+                       'fts': fts, 'like': like}, flush=True)
+                db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Socket.IO 跨 worker 分发基准（utils/socket_broker.py 的中转进程 + UnixSocketManager）。
+
+启动中转进程后，分别用 2、4、8 个进程模拟 worker：每个进程通过 UnixSocketManager.emit
+以固定速率向房间发送事件，同时统计从其他进程收到的事件和投递延迟（发送到对方 _handle_emit 的时间）。
+输出每种 worker 数下的发送/投递吞吐量、延迟分位数和平均批大小。
+
+用法：python -m benchmarks.socketio_fanout --workers 2,4,8 --rate 2000 --duration 5
+      python -m benchmarks.socketio_fanout --batch-interval 0   # 对比不合并发送
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.socket_broker import UnixSocketManager, start_broker
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class RecordingManager(UnixSocketManager):
+    """只替换最终投递给本地客户端的一步，改为记录延迟；发布、合并、转发均为真实路径。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def _handle_emit(self, message):
+        if message.get('host_id') == self.host_id:
+            return  # 本进程发出的事件在本地直接投递，不计入跨进程延迟
+        self.latencies.append((time.time() - message['data'][0]['t']) * 1000)
+
+
+def worker(url, batch_interval, rate, duration, results):
+    manager = RecordingManager(url, batch_interval=batch_interval)
+    threading.Thread(target=lambda: [manager._handle_emit(m) for m in manager._listen()], daemon=True).start()
+    time.sleep(0.5)  # 等所有进程完成订阅
+    interval = 1.0 / rate
+    started = time.monotonic()
+    sent = 0
+    while time.monotonic() - started < duration:
+        manager.emit('ai_token', {'t': time.time(), 'delta': '字' * 8}, room='session', namespace='/')
+        sent += 1
+        delay = started + sent * interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    time.sleep(0.5)  # 等待最后一批送达
+    results.put({'sent': sent, 'latencies': manager.latencies, 'batches': manager.batches})
+
+
+def run(url, workers, batch_interval, rate, duration):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(url, batch_interval, rate, duration, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    sent = sum(item['sent'] for item in collected)
+    latencies = [value for item in collected for value in item['latencies']]
+    batches = sum(item['batches'] for item in collected)
+    expected = sent * (workers - 1)
+    return {
+        'workers': workers,
+        'sent_per_s': round(sent / duration),
+        'delivered_per_s': round(len(latencies) / duration),
+        'delivery_ratio': round(len(latencies) / expected, 4) if expected else None,
+        'avg_batch': round(sent / batches, 1) if batches else None,
+        'latency_p50_ms': round(percentile(latencies, 0.5), 2) if latencies else None,
+        'latency_p95_ms': round(percentile(latencies, 0.95), 2) if latencies else None,
+        'latency_p99_ms': round(percentile(latencies, 0.99), 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='2,4,8', help='依次测试的 worker 数')
+    parser.add_argument('--rate', type=float, default=2000, help='每个 worker 每秒发送的事件数')
+    parser.add_argument('--duration', type=float, default=5, help='每轮发送秒数')
+    parser.add_argument('--batch-interval', type=float, default=0.002, help='合并发送时间窗（秒），0 表示不等待')
+    args = parser.parse_args()
+
+    url = 'unix://' + os.path.join(tempfile.mkdtemp(), 'broker.sock')
+    broker = start_broker(url)
+    try:
+        for workers in (int(w) for w in args.workers.split(',')):
+            print(run(url, workers, args.batch_interval, args.rate, args.duration), flush=True)
+    finally:
+        broker.terminate()
+        broker.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -23,16 +23,150 @@ class Config:
     # 最大上传文件大小限制
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
 
-    # MySQL 连接池配置
-    SQLALCHEMY_POOL_SIZE = 10  # 数据库连接池的大小
-    SQLALCHEMY_MAX_OVERFLOW = 20  # 连接池允许的最大溢出连接数
-    SQLALCHEMY_POOL_TIMEOUT = 30  # 连接池超时时间
+    # MySQL 连接池配置（Flask-SQLAlchemy 3 不再读取这几项，由 utils/db_routing.py 组装成 SQLALCHEMY_ENGINE_OPTIONS）
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('SQLALCHEMY_POOL_SIZE', 10))  # 数据库连接池的大小
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('SQLALCHEMY_MAX_OVERFLOW', 20))  # 连接池允许的最大溢出连接数
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('SQLALCHEMY_POOL_TIMEOUT', 30))  # 连接池超时时间
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('SQLALCHEMY_POOL_RECYCLE', 3600))  # 连接最长复用时间（秒），需小于 MySQL wait_timeout
+    SQLALCHEMY_POOL_PRE_PING = os.environ.get('SQLALCHEMY_POOL_PRE_PING', '1') == '1'  # 取出连接时先检测是否已断开
+
+    # worker 启动后预热：每个数据库引擎预先建立的连接数；是否预先与各服务商建立 HTTP 连接
+    WARMUP_DB_CONNECTIONS = int(os.environ.get('WARMUP_DB_CONNECTIONS', 2))
+    WARMUP_LLM_CONNECT = os.environ.get('WARMUP_LLM_CONNECT', '1') == '1'
+
+    # SQLite：WAL 模式下读不阻塞写；WAL 下 synchronous=NORMAL 仍能保证崩溃后数据库一致；busy_timeout 单位为毫秒
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+
+    # 只读副本：配置后 /history/、/sessions 及会话反馈/主题/上下文的 GET 请求查询副本；
+    # 用户写操作后 REPLICA_READ_AFTER_WRITE 秒内（由 Cookie 标记，跨 worker 有效）仍读主库，避免读不到自己刚写入的数据
+    SQLALCHEMY_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URL')
+    REPLICA_READ_AFTER_WRITE = float(os.environ.get('REPLICA_READ_AFTER_WRITE', 10))
 
     # AI 模型配置
     AI_MODEL = 'gpt-3.5-turbo'
     AI_MAX_TOKENS = 1000
     AI_TEMPERATURE = 0.7
 
+    # 大模型服务商池：LLM_PROVIDERS 为 JSON 数组或 JSON 文件路径，每项包含 name / base_url / model / api_key_env，
+    # 可选 headers / weight / timeout / max_connections / max_keepalive 等；为空时使用 QIANFAN_* 环境变量的单个服务商。
+    # LLM_HEDGE_PERCENTILE 为 0 时关闭对冲请求；服务商连续失败 LLM_BREAKER_FAILURES 次后熔断 LLM_BREAKER_COOLDOWN 秒
+    LLM_PROVIDERS = os.environ.get('LLM_PROVIDERS')
+    LLM_ROUTING_EWMA_ALPHA = float(os.environ.get('LLM_ROUTING_EWMA_ALPHA', 0.2))
+    LLM_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', 0.95))
+    LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', 20))
+    LLM_MAX_ATTEMPTS = int(os.environ.get('LLM_MAX_ATTEMPTS', 2))
+    LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', 5))
+    LLM_BREAKER_COOLDOWN = float(os.environ.get('LLM_BREAKER_COOLDOWN', 30))
+
+    # 大模型调用调度：全局并发上限、单用户并发上限、等待队列长度与排队超时（秒，需小于 gunicorn timeout）
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 32))
+    LLM_MAX_PER_USER = int(os.environ.get('LLM_MAX_PER_USER', 2))
+    LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', 200))
+    LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 20))
+
+    # 批量接口 /api/chat/batch：单次最多条数、每个批次的并发调用数（实际不超过 LLM_MAX_PER_USER）、每个事务保存的轮数
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 200))
+    BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+    BATCH_PERSIST_SIZE = int(os.environ.get('BATCH_PERSIST_SIZE', 50))
+
+    # 全文检索：SQLite 使用 FTS5 虚拟表（中日韩文本二元分词），MySQL 使用 ngram 全文索引；
+    # 在最近 SEARCH_MAX_CANDIDATES 条匹配记录内按相关度排序；重建每批条数
+    SEARCH_ENABLED = os.environ.get('SEARCH_ENABLED', '1') == '1'
+    SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', 500))
+    SEARCH_REBUILD_BATCH_SIZE = int(os.environ.get('SEARCH_REBUILD_BATCH_SIZE', 5000))
+
+    # AI 回复缓存：进程内 LRU + 共享 SQLite 层（默认位于 instance/response_cache.db），TTL 单位为秒
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1'
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+    RESPONSE_CACHE_SHARED_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_SHARED_MAX_ENTRIES', 20000))
+    RESPONSE_CACHE_SHARED_PATH = os.environ.get('RESPONSE_CACHE_SHARED_PATH')
+
+    # 上下文构建：提示 token 预算（需为回复预留空间）、滚动摘要预算、摘要中每轮保留字数、每次加载的历史轮数
+    AI_CONTEXT_TOKEN_BUDGET = int(os.environ.get('AI_CONTEXT_TOKEN_BUDGET', 6000))
+    AI_SUMMARY_TOKEN_BUDGET = int(os.environ.get('AI_SUMMARY_TOKEN_BUDGET', 800))
+    AI_SUMMARY_TURN_CHARS = int(os.environ.get('AI_SUMMARY_TURN_CHARS', 120))
+    AI_HISTORY_TURNS = int(os.environ.get('AI_HISTORY_TURNS', 10))
+
+    # 最近轮次缓存：每个 worker 在内存中保存活跃会话的最近轮次，空闲超过 CHAT_TIMEOUT 淘汰
+    TURN_CACHE_ENABLED = os.environ.get('TURN_CACHE_ENABLED', '1') == '1'
+    TURN_CACHE_MAX_SESSIONS = int(os.environ.get('TURN_CACHE_MAX_SESSIONS', 2000))
+    TURN_CACHE_MAX_BYTES = int(os.environ.get('TURN_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+    # 延迟写入：把多个请求的消息/会话插入合并为一个事务，按条数或时间间隔（秒）批量提交
+    WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', '0') == '1'
+    WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 200))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', 0.05))
+    WRITE_BEHIND_WAIT_TIMEOUT = float(os.environ.get('WRITE_BEHIND_WAIT_TIMEOUT', 10))  # 请求等待所在批次提交的最长秒数
+
+    # 后台维护：各 worker 每隔 MAINTENANCE_INTERVAL 秒尝试执行，由文件锁（默认 instance/maintenance.lock）保证同一时间只有一个进程执行；
+    # 关闭空闲超过 CHAT_TIMEOUT 的会话，把新消息的 token 用量汇总到 usage_daily，并把早于 ARCHIVE_AFTER_DAYS 天的消息压缩转存到 chat_message_archive（0 表示不归档）。每批处理 MAINTENANCE_BATCH_SIZE 行
+    MAINTENANCE_ENABLED = os.environ.get('MAINTENANCE_ENABLED', '1') == '1'
+    MAINTENANCE_INTERVAL = float(os.environ.get('MAINTENANCE_INTERVAL', 60))
+    MAINTENANCE_BATCH_SIZE = int(os.environ.get('MAINTENANCE_BATCH_SIZE', 500))
+    MAINTENANCE_LOCK_PATH = os.environ.get('MAINTENANCE_LOCK_PATH')
+    # 归档默认关闭：归档后的消息从 chat_message 移出，全文检索（/api/chat/search）不再能搜到
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 0))
+
+    # 限流：按用户与客户端 IP 的令牌桶，格式为 "次数/秒数"，留空表示不限制；桶状态保存在 RATE_LIMIT_PATH（默认 instance/rate_limit.bin）
+    # 的共享文件中，所有 worker 共用。TOKENS 为大模型 token 用量（调用结束后按实际用量扣除，可欠账，欠账期间的新请求返回 429）
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMIT_PATH = os.environ.get('RATE_LIMIT_PATH')
+    RATE_LIMIT_SLOTS = int(os.environ.get('RATE_LIMIT_SLOTS', 65536))
+    RATE_LIMIT_USER_REQUESTS = os.environ.get('RATE_LIMIT_USER_REQUESTS', '20/60')
+    RATE_LIMIT_IP_REQUESTS = os.environ.get('RATE_LIMIT_IP_REQUESTS', '60/60')
+    RATE_LIMIT_USER_TOKENS = os.environ.get('RATE_LIMIT_USER_TOKENS', '100000/3600')
+    RATE_LIMIT_IP_TOKENS = os.environ.get('RATE_LIMIT_IP_TOKENS', '300000/3600')
+    # 前面的可信反向代理层数：大于 0 时按 X-Forwarded-For / X-Forwarded-Proto 还原客户端地址（werkzeug ProxyFix），
+    # 否则按 IP 限流时所有用户共用代理的地址；直接对外暴露时保持 0，避免伪造请求头绕过限流
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+
+    # 导出：会话按 EXPORT_SESSION_BATCH 个一批读取，消息通过服务端游标每次取 EXPORT_YIELD_PER 行；
+    # 输出攒满 EXPORT_FLUSH_BYTES 字节再写给客户端，gzip 压缩级别为 EXPORT_GZIP_LEVEL（1~9）
+    EXPORT_SESSION_BATCH = int(os.environ.get('EXPORT_SESSION_BATCH', 100))
+    EXPORT_YIELD_PER = int(os.environ.get('EXPORT_YIELD_PER', 500))
+    EXPORT_FLUSH_BYTES = int(os.environ.get('EXPORT_FLUSH_BYTES', 64 * 1024))
+    EXPORT_GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL', 6))
+
+    # 用户身份缓存：user_loader 使用，TTL 单位为秒
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+
+    # 密码哈希：thread（eventlet 下使用 tpool 系统线程）/ process（仅非 eventlet 环境）/ inline；计算线程数、同时计算数与排队上限、排队超时（秒）
+    PASSWORD_HASH_POOL = os.environ.get('PASSWORD_HASH_POOL', 'thread')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+    AUTH_MAX_CONCURRENT_HASHES = int(os.environ.get('AUTH_MAX_CONCURRENT_HASHES', 4))
+    AUTH_MAX_PENDING_HASHES = int(os.environ.get('AUTH_MAX_PENDING_HASHES', 64))
+    AUTH_HASH_QUEUE_TIMEOUT = float(os.environ.get('AUTH_HASH_QUEUE_TIMEOUT', 5))
+
+    # 日志：LOG_ASYNC 开启时请求路径只入队，由单独的写线程写文件；队列满时丢弃并计数。
+    # LOG_JSON 输出带 request_id / session_id 的 JSON 行；LOG_SAMPLE_RATES 形如 "utils.context_builder=0.1"，只对 INFO 及以下采样
+    LOG_FILE = os.environ.get('LOG_FILE')  # 默认 logs/app_log.txt
+    LOG_ASYNC = os.environ.get('LOG_ASYNC', '1') == '1'
+    LOG_JSON = os.environ.get('LOG_JSON', '0') == '1'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+
+    # 运行指标：各 worker 每隔 METRICS_SNAPSHOT_INTERVAL 秒把数据写入 METRICS_DIR（默认 instance/metrics），/metrics 汇总输出
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_SNAPSHOT_INTERVAL = float(os.environ.get('METRICS_SNAPSHOT_INTERVAL', 5))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Socket.IO 跨 worker 分发：unix:///路径 使用本机中转进程（gunicorn 启动时自动拉起），
+    # 也可填 redis:// 等 Flask-SocketIO 支持的消息队列；为空时只在单个 worker 内投递
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_BATCH_INTERVAL = float(os.environ.get('SOCKETIO_BATCH_INTERVAL', 0.002))
+
     # 聊天配置
     MAX_CHAT_HISTORY = 50
+    HISTORY_PAGE_SIZE = 50  # /history/ 默认每页消息数
+    SESSION_PAGE_SIZE = 50  # /sessions 默认每页会话数
+    SEARCH_PAGE_SIZE = 20  # /search 默认每页结果数
+    MAX_PAGE_SIZE = 200
     CHAT_TIMEOUT = 300  # 5分钟超时
\ No newline at end of file
@@ -6,4 +6,46 @@ timeout = 30
 keepalive = 2
 max_requests = 1000
 max_requests_jitter = 100
-preload_app = True
\ No newline at end of file
+preload_app = True
+
+
+def on_starting(server):
+    # 使用本机中转进程分发 Socket.IO 事件时，由 master 启动中转进程
+    from config import Config
+    url = Config.SOCKETIO_MESSAGE_QUEUE
+    if url and url.startswith('unix://'):
+        from utils.socket_broker import start_broker
+        server.socketio_broker = start_broker(url)
+
+
+def on_exit(server):
+    broker = getattr(server, 'socketio_broker', None)
+    if broker is not None:
+        broker.terminate()
+        broker.wait(timeout=10)
+
+
+def post_fork(server, worker):
+    # preload_app 时 master 不再连接数据库（表结构由迁移维护），继承的连接池通常为空；
+    # 仍丢弃一次，防止预加载阶段意外建立的连接被多个 worker 共用
+    from app import app
+    from models import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # eventlet hub 就绪后预热：建立数据库连接、在后台创建服务商 HTTP 客户端并建立连接
+    from app import app
+    from utils.startup import warm_up_worker
+    warm_up_worker(app, app.config['WARMUP_DB_CONNECTIONS'], app.config['WARMUP_LLM_CONNECT'])
+
+
+def worker_exit(server, worker):
+    # worker 被回收（max_requests）或正常退出时，把延迟写入队列中的数据落库
+    from utils.write_behind import write_behind
+    write_behind.shutdown()
+    # 等待异步日志队列写完
+    from utils.log_pipeline import log_pipeline
+    log_pipeline.shutdown()
@@ -0,0 +1,171 @@
+"""initial schema
+
+此前表结构由应用启动时的 db.create_all() 创建，并由 ensure_columns() / ensure_indexes() 补加新列与索引。
+本迁移作为基线：新库直接建表；已有的旧库只补齐缺少的表、列与索引，随后记录版本号。
+最后创建全文检索结构（SQLite FTS5 虚拟表 / MySQL FULLTEXT 索引），DDL 写在本文件中，
+不随 utils/search.py 的后续修改而变化。
+
+Revision ID: 4868223b62a5
+Revises:
+Create Date: 2026-10-18 10:40:48.769407
+
+"""
+from alembic import op
+import logging
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4868223b62a5'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+FTS_TABLE = 'chat_message_fts'
+MYSQL_INDEX = 'ix_chat_message_fulltext'
+
+
+def _create_table(inspector, name, *columns, **kwargs):
+    if not inspector.has_table(name):
+        op.create_table(name, *columns, **kwargs)
+
+
+def _add_column(inspector, table, column):
+    # 旧库中后来新增的列（当时由 ensure_columns() 在启动时补加）
+    if column.name not in {c['name'] for c in inspector.get_columns(table)}:
+        op.add_column(table, column)
+
+
+def _create_index(inspector, table, name, columns, unique=False):
+    if name not in {index['name'] for index in inspector.get_indexes(table)}:
+        op.create_index(name, table, columns, unique=unique)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    _create_table(inspector, 'user',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=80), nullable=False),
+    sa.Column('email', sa.String(length=120), nullable=False),
+    sa.Column('password_hash', sa.String(length=255), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    _create_table(inspector, 'chat_session',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.String(length=64), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=True),
+    sa.Column('end_time', sa.DateTime(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('topic', sa.String(length=255), nullable=True),
+    sa.Column('feedback', sa.String(length=255), nullable=True),
+    sa.Column('context', sa.Text(), nullable=True),
+    sa.Column('meta_data', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    _add_column(inspector, 'chat_session', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    _add_column(inspector, 'chat_session', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    _create_index(inspector, 'chat_session', 'ix_chat_session_session_id', ['session_id'], unique=True)
+    _create_index(inspector, 'chat_session', 'ix_chat_session_user_created', ['user_id', 'created_at', 'id'])
+    _create_index(inspector, 'chat_session', 'ix_chat_session_user_updated', ['user_id', 'updated_at'])
+
+    _create_table(inspector, 'usage_daily',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('turns', sa.Integer(), nullable=False),
+    sa.Column('prompt_tokens', sa.Integer(), nullable=False),
+    sa.Column('completion_tokens', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'day', name='uq_usage_daily_user_day')
+    )
+    _create_table(inspector, 'chat_message',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.String(length=64), nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('response', sa.Text(), nullable=True),
+    sa.Column('sender', sa.String(length=20), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('prompt_tokens', sa.Integer(), nullable=True),
+    sa.Column('completion_tokens', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['session_id'], ['chat_session.session_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    _add_column(inspector, 'chat_message', sa.Column('prompt_tokens', sa.Integer(), nullable=True))
+    _add_column(inspector, 'chat_message', sa.Column('completion_tokens', sa.Integer(), nullable=True))
+    _create_index(inspector, 'chat_message', 'ix_chat_message_user_session_ts',
+                  ['user_id', 'session_id', 'timestamp', 'id'])
+
+    _create_table(inspector, 'chat_message_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('session_id', sa.String(length=64), nullable=False),
+    sa.Column('first_id', sa.Integer(), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('first_ts', sa.DateTime(), nullable=True),
+    sa.Column('last_ts', sa.DateTime(), nullable=True),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('payload', sa.LargeBinary(length=16777215), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['session_id'], ['chat_session.session_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    _create_index(inspector, 'chat_message_archive', 'ix_chat_archive_user_session_ts',
+                  ['user_id', 'session_id', 'last_ts', 'last_id'])
+
+    _create_search_schema(inspector)
+
+
+def _create_search_schema(inspector):
+    # 全文检索结构：SQLite 为无内容 FTS5 表（只保存倒排索引，prefix='1' 为单字建前缀索引）；
+    # MySQL 为 ngram 分词的 FULLTEXT 索引（建索引时回填已有数据）。其他数据库不支持全文检索
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        if inspector.has_table(FTS_TABLE):
+            return
+        op.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(owner, message, response, "
+                   f"tokenize = 'unicode61', prefix = '1', content = '', columnsize = 0)")
+        if bind.execute(sa.text('SELECT 1 FROM chat_message LIMIT 1')).first() is not None:
+            logger.warning("已创建全文索引，历史消息需执行 flask --app app search-rebuild 回填")
+    elif bind.dialect.name in ('mysql', 'mariadb'):
+        if MYSQL_INDEX not in {index['name'] for index in inspector.get_indexes('chat_message')}:
+            op.execute(f"ALTER TABLE chat_message ADD FULLTEXT INDEX {MYSQL_INDEX} (message, response) "
+                       f"WITH PARSER ngram")
+
+
+def _drop_search_schema():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif bind.dialect.name in ('mysql', 'mariadb') and MYSQL_INDEX in {
+            index['name'] for index in sa.inspect(bind).get_indexes('chat_message')}:
+        op.execute(f"ALTER TABLE chat_message DROP INDEX {MYSQL_INDEX}")
+
+
+def downgrade():
+    _drop_search_schema()
+    op.drop_index('ix_chat_archive_user_session_ts', table_name='chat_message_archive')
+    op.drop_table('chat_message_archive')
+    op.drop_index('ix_chat_message_user_session_ts', table_name='chat_message')
+    op.drop_table('chat_message')
+    op.drop_table('usage_daily')
+    op.drop_index('ix_chat_session_user_updated', table_name='chat_session')
+    op.drop_index('ix_chat_session_user_created', table_name='chat_session')
+    op.drop_index('ix_chat_session_session_id', table_name='chat_session')
+    op.drop_table('chat_session')
+    op.drop_table('user')
@@ -1,7 +1,27 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_login import LoginManager
+from sqlalchemy.sql.dml import UpdateBase
 
-db = SQLAlchemy()
+#只读副本在 SQLALCHEMY_BINDS 中的键名
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """只读请求（g.db_bind 为 replica，见 utils/db_routing.py）中的查询发往只读副本；
+    flush 以及 INSERT / UPDATE / DELETE 语句始终使用主库。"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) \
+                and has_app_context() and g.get('db_bind') == REPLICA_BIND:
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 #创建一个 LoginManager 实例，用于处理用户认证和会话管理。Flask-Login 是一个扩展库，帮助管理用户登录状态。
 login_manager = LoginManager()
 #初始化函数
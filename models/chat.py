@@ -1,7 +1,24 @@
 from datetime import datetime
+from sqlalchemy import event, func
+from sqlalchemy.orm import object_session
 from models import db
 import json
 
+#在 UPDATE 语句中合并 JSON 的数据库函数（语义均为 RFC 7396）
+CONTEXT_MERGE_FUNCTIONS = {'sqlite': 'json_patch', 'mysql': 'json_merge_patch'}
+
+
+def merge_patch(target, patch):
+    #RFC 7396 JSON Merge Patch，用于不支持 JSON 函数的数据库
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            target[key] = merge_patch(target.get(key) if isinstance(target.get(key), dict) else {}, value)
+        else:
+            target[key] = value
+    return target
+
 
 #定义了两个数据库模型 ChatSession 和 ChatMessage，用于管理聊天会话和聊天消息。
 class ChatSession(db.Model):
@@ -24,6 +41,73 @@ class ChatSession(db.Model):
     context = db.Column(db.Text, nullable=True)  # 可存储JSON字符串
     meta_data = db.Column(db.Text, nullable=True) # 原metadata字段改名
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # 表示聊天会话的创建时间
+    #每次修改递增的版本号与修改时间，用于 ETag / Last-Modified 与上下文的乐观并发更新
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=True)
+
+    #会话列表按 (created_at, id) 做游标分页，需要以 user_id 开头的联合索引；
+    #(user_id, updated_at) 用于快速求出会话列表的最后修改时间
+    __table_args__ = (
+        db.Index('ix_chat_session_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_chat_session_user_updated', 'user_id', 'updated_at'),
+    )
+
+    #会话列表摘要只读取这些列，context / meta_data 等 JSON 列按需加载
+    SUMMARY_COLUMNS = ('id', 'session_id', 'user_id', 'start_time', 'end_time', 'status', 'topic',
+                       'created_at', 'updated_at', 'version')
+
+    @classmethod
+    def touch_values(cls):
+        """批量 UPDATE 语句（不经过 ORM 事件）需合并进 values() 的版本号与修改时间。"""
+        return {'version': cls.version + 1, 'updated_at': datetime.utcnow()}
+
+    @classmethod
+    def merge_context(cls, user_id, session_id, patch, expected_version=None):
+        """把 patch 按 RFC 7396 合并进会话 context（只改动 patch 中出现的键，值为 null 的键删除），返回是否更新。
+
+        expected_version 不为 None 时只在版本号一致时更新（乐观并发），更新后版本号为 expected_version + 1。
+        SQLite / MySQL 在 UPDATE 语句中合并，不必把整段 JSON 读到 Python 里解析再写回。
+        """
+        filters = [cls.session_id == session_id, cls.user_id == user_id]
+        if expected_version is not None:
+            filters.append(cls.version == expected_version)
+        merge = CONTEXT_MERGE_FUNCTIONS.get(db.engine.dialect.name)
+        if merge is not None:
+            merged = getattr(func, merge)(func.coalesce(cls.context, '{}'), json.dumps(patch, ensure_ascii=False))
+            return db.session.execute(db.update(cls).where(*filters).values(
+                context=merged, **cls.touch_values())).rowcount > 0
+        session = cls.query.filter(*filters).first()
+        if session is None:
+            return False
+        context = json.loads(session.context) if session.context else {}
+        session.context = json.dumps(merge_patch(context, patch), ensure_ascii=False)
+        return True
+
+    @property
+    def last_modified(self):
+        #补加 updated_at 列之前的旧会话没有修改时间，以创建时间代替
+        return self.updated_at or self.created_at
+
+    def to_summary_dict(self, include=()):
+        """会话列表使用的摘要结构；include 可包含 'context' / 'meta_data' / 'feedback'。"""
+        data = {
+            'id': self.id,
+            'session_id': self.session_id,
+            'status': self.status,
+            'topic': self.topic,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.last_modified.isoformat() if self.last_modified else None,
+            'version': self.version,
+        }
+        if 'feedback' in include:
+            data['feedback'] = self.feedback
+        if 'context' in include:
+            data['context'] = json.loads(self.context) if self.context else None
+        if 'meta_data' in include:
+            data['meta_data'] = json.loads(self.meta_data) if self.meta_data else None
+        return data
 
     def to_dict(self):
         return {
@@ -37,9 +121,20 @@ class ChatSession(db.Model):
             'feedback': self.feedback,
             'context': json.loads(self.context) if self.context else None,
             'meta_data': json.loads(self.meta_data) if self.meta_data else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.last_modified.isoformat() if self.last_modified else None,
+            'version': self.version
         }
 
+@event.listens_for(ChatSession, 'before_update')
+def _touch_session(mapper, connection, target):
+    #通过 ORM 修改会话时递增版本号（SQL 表达式，在 UPDATE 语句中原子地加一）
+    session = object_session(target)
+    if session is not None and session.is_modified(target, include_collections=False):
+        target.version = ChatSession.version + 1
+        target.updated_at = datetime.utcnow()
+
+
 class ChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -51,6 +146,14 @@ class ChatMessage(db.Model):
     #定义一个名为 sender 的列，类型为字符串，最大长度为 20，默认值为 'user'，表示消息的发送者（用户、助手或系统）。
     sender = db.Column(db.String(20), default='user')  # user/assistant/system
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    #本轮调用大模型消耗的 token 数（服务商返回的 usage；命中回复缓存或调用失败时为空）
+    prompt_tokens = db.Column(db.Integer, nullable=True)
+    completion_tokens = db.Column(db.Integer, nullable=True)
+
+    #历史记录按 (timestamp, id) 做游标分页，过滤条件为 user_id + session_id
+    __table_args__ = (
+        db.Index('ix_chat_message_user_session_ts', 'user_id', 'session_id', 'timestamp', 'id'),
+    )
 
     def to_dict(self):
         return {
@@ -60,8 +163,32 @@ class ChatMessage(db.Model):
             'message': self.message,
             'response': self.response,
             'sender': self.sender,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens
         }
 
     def __repr__(self):
-        return f"<ChatMessage {self.message}>"
\ No newline at end of file
+        return f"<ChatMessage {self.message}>"
+
+class ChatMessageArchive(db.Model):
+    """冷数据归档：同一会话的一批旧消息压缩后存为一行，payload 为 zlib 压缩的 ChatMessage.to_dict() 列表（按 id 升序）。"""
+    __tablename__ = 'chat_message_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    session_id = db.Column(db.String(64), db.ForeignKey('chat_session.session_id'), nullable=False)
+    #本段消息的 (timestamp, id) 范围，读取历史时据此定位需要解压的段
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    first_ts = db.Column(db.DateTime, nullable=True)
+    last_ts = db.Column(db.DateTime, nullable=True)
+    count = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.LargeBinary(16 * 1024 * 1024 - 1), nullable=False)  # MySQL 上为 MEDIUMBLOB
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_chat_archive_user_session_ts', 'user_id', 'session_id', 'last_ts', 'last_id'),
+    )
+
+    def __repr__(self):
+        return f"<ChatMessageArchive {self.session_id} {self.first_id}-{self.last_id}>"
@@ -0,0 +1,32 @@
+from datetime import datetime
+from models import db
+
+
+#按用户、按天汇总的大模型用量，由后台维护任务从 chat_message 增量汇总（见 utils/usage.py）
+class UsageDaily(db.Model):
+    __tablename__ = 'usage_daily'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    turns = db.Column(db.Integer, nullable=False, default=0)  # 对话轮数
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    #汇总进度：所有行中最大的 last_message_id 即已汇总到的 chat_message.id
+    last_message_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', name='uq_usage_daily_user_day'),
+    )
+
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'turns': self.turns,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.prompt_tokens + self.completion_tokens
+        }
+
+    def __repr__(self):
+        return f"<UsageDaily {self.user_id} {self.day}>"
@@ -1,7 +1,7 @@
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from models import db
+from utils.hashing import password_hasher
 
 
 #用户模型类定义
@@ -16,11 +16,12 @@ class User(UserMixin, db.Model):
     #定义一个名为 created_at 的列，类型为日期时间。默认值为当前 UTC 时间，表示用户创建的时间。,
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    #哈希计算在工作池中执行，不阻塞 eventlet 事件循环；认证突发时可能抛出 AuthBusy
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.generate(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
 
 #定义一个方法 to_dict，将用户实例转换为字典格式,
 # 返回一个字典，包含用户的 id、username、email 和 created_at 字段。如果 created_at 存在，则以 ISO 格式返回。
@@ -12,5 +12,6 @@ source activate chat_server
 # 开发环境（推荐本地调试）
 # python app.py
 
-# 生产环境（推荐部署上线）
+# 生产环境（推荐部署上线）：先执行数据库迁移，再启动 gunicorn
+flask --app app db upgrade || exit 1
 gunicorn --config gunicorn_config.py app:app
\ No newline at end of file
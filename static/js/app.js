@@ -13,7 +13,8 @@ class ChatApp {
     }
 
     initializeSocketIO() {
-        this.socket = io();
+        // 优先使用 WebSocket：多个 worker 时长轮询请求可能落到不同 worker
+        this.socket = io({ transports: ['websocket', 'polling'] });
 
         // WebSocket连接成功时的处理
         this.socket.on('connect', () => {
@@ -234,7 +235,7 @@ class ChatApp {
         sessions.forEach(session => {
             const sessionDiv = document.createElement('div');
             sessionDiv.className = 'session-item';
-            sessionDiv.innerHTML = `<div>${session.title || '新对话'}</div><div>${new Date(session.updated_at).toLocaleDateString()}</div>`;
+            sessionDiv.innerHTML = `<div>${session.topic || '新对话'}</div><div>${new Date(session.updated_at || session.created_at).toLocaleDateString()}</div>`;
             sessionDiv.addEventListener('click', () => this.loadChatHistory(session.session_id));
             sessionList.appendChild(sessionDiv);
         });
@@ -242,7 +243,7 @@ class ChatApp {
 
     async loadChatHistory(sessionId) {
         try {
-            const response = await fetch(`/api/chat/history/${sessionId}`);
+            const response = await fetch(`/api/chat/history/?session_id=${encodeURIComponent(sessionId)}`);
             if (response.ok) {
                 const data = await response.json();
                 this.currentSessionId = sessionId;
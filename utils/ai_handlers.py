@@ -1,28 +1,32 @@
 #AI处理工具（模型加载、请求处理、结果解析等）
 
-from openai import OpenAI
-import os
+from utils.providers import provider_pool
+from utils.response_cache import response_cache
+from utils.scheduler import llm_scheduler, SchedulerBusy
+from utils.metrics import metrics
 import logging
+import time
 
 # 设置日志记录
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = '你是一个智能助手，请用中文回答用户的问题。'
+FALLBACK_REPLY = "抱歉，AI服务暂时不可用。"
+
 
 class AIHandler:
     def __init__(self):
-        self.api_key = os.environ.get('QIANFAN_API_KEY')
-        self.appid = os.environ.get('QIANFAN_APPID')
-        self.base_url = "https://qianfan.baidubce.com/v2"
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url,
-            default_headers={"appid": self.appid} if self.appid else None
-        )
-
-    def generate_response(self, message: str, chat_history: list = None) -> str:
+        # 服务商、模型与连接池由 LLM_PROVIDERS 配置（见 utils/providers.py），默认使用 QIANFAN_* 环境变量
+        self.pool = provider_pool
+
+    @property
+    def model(self):
+        return self.pool.cache_namespace
+
+    def build_messages(self, message: str, chat_history: list = None) -> list:
         messages = []
         # 系统提示
-        messages.append({'role': 'system', 'content': '你是一个智能助手，请用中文回答用户的问题。'})
+        messages.append({'role': 'system', 'content': SYSTEM_PROMPT})
         # 添加历史对话
         if chat_history:
             for chat in chat_history[-10:]:
@@ -31,15 +35,99 @@ class AIHandler:
                     messages.append({"role": "assistant", "content": chat.get('response', '')})
         # 添加当前消息
         messages.append({'role': 'user', 'content': message})
+        return messages
+
+    def cache_key(self, messages: list) -> str:
+        return response_cache.make_key(messages, self.model)
+
+    def _complete(self, messages: list, user_id=None, usage=None) -> str:
+        # 传入 user_id 时经过调度器限流；SchedulerBusy 直接抛给调用方
+        if user_id is not None:
+            with llm_scheduler.slot(user_id):
+                return self._complete(messages, usage=usage)
+        start = time.perf_counter()
         try:
-            completion = self.client.chat.completions.create(
-                model="ernie-4.0-turbo-8k",  # 可根据实际权限更换模型
-                messages=messages
-            )
-            return completion.choices[0].message.content
+            provider, completion = self.pool.complete(messages)
         except Exception as e:
+            metrics.inc('llm_errors_total', model=self.model, error=type(e).__name__)
+            raise
+        metrics.observe('llm_request_duration_seconds', time.perf_counter() - start, model=provider.model,
+                        provider=provider.name, stream=0)
+        self._record_usage(provider, getattr(completion, 'usage', None), usage)
+        return completion.choices[0].message.content
+
+    def _record_usage(self, provider, usage, sink=None):
+        # sink 为调用方传入的字典，累加本次调用的 prompt_tokens / completion_tokens（用于落库与限流计费）
+        if usage is None:
+            return
+        if sink is not None:
+            for key in ('prompt_tokens', 'completion_tokens'):
+                sink[key] = sink.get(key, 0) + (getattr(usage, key, None) or 0)
+        if usage.prompt_tokens is not None:
+            metrics.observe('llm_prompt_tokens', usage.prompt_tokens, model=provider.model, provider=provider.name)
+        if usage.completion_tokens is not None:
+            metrics.observe('llm_completion_tokens', usage.completion_tokens, model=provider.model,
+                            provider=provider.name)
+
+    def generate_response(self, message: str, chat_history: list = None, user_id=None,
+                          use_cache: bool = True) -> str:
+        return self.generate_from_messages(self.build_messages(message, chat_history), user_id, use_cache)
+
+    def generate_from_messages(self, messages: list, user_id=None, use_cache: bool = True,
+                               fallback: bool = True, usage: dict = None) -> str:
+        # fallback 为 False 时上游异常直接抛出（批量接口按条记录错误），否则返回兜底回复；
+        # usage 字典记录实际调用上游消耗的 token（命中缓存或合并到其他请求时保持为空）
+        try:
+            if use_cache and response_cache.enabled:
+                # 缓存命中不占用调度名额；相同请求并发时只发起一次上游调用
+                return response_cache.get_or_compute(self.cache_key(messages),
+                                                     lambda: self._complete(messages, user_id, usage))
+            return self._complete(messages, user_id, usage)
+        except SchedulerBusy:
+            raise
+        except Exception as e:
+            if not fallback:
+                raise
             logger.error(f"千帆API调用失败: {str(e)}")
-            return "抱歉，AI服务暂时不可用。"
+            return FALLBACK_REPLY
+
+    def stream_response(self, message: str, chat_history: list = None, should_stop=None):
+        return self.stream_messages(self.build_messages(message, chat_history), should_stop)
+
+    def stream_messages(self, messages: list, should_stop=None, usage: dict = None):
+        """流式生成回复，逐段产出增量文本。
+
+        should_stop 为可选的无参回调，返回 True 时停止读取并关闭上游连接。
+        usage 字典在服务商返回用量时累加 prompt_tokens / completion_tokens。
+        上游异常直接抛给调用方，由调用方决定如何兜底。
+        """
+        start = time.perf_counter()
+        try:
+            # 读到首个增量才返回，首字前的故障可以切换服务商或被对冲请求替代
+            provider, stream = self.pool.open_stream(messages)
+        except Exception as e:
+            metrics.inc('llm_errors_total', model=self.model, error=type(e).__name__)
+            raise
+        labels = {'model': provider.model, 'provider': provider.name}
+        metrics.observe('llm_time_to_first_token_seconds', time.perf_counter() - start, **labels)
+        try:
+            for chunk in stream:
+                if should_stop is not None and should_stop():
+                    break
+                if getattr(chunk, 'usage', None) is not None:
+                    self._record_usage(provider, chunk.usage, usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            metrics.inc('llm_errors_total', error=type(e).__name__, **labels)
+            raise
+        finally:
+            # 提前结束（取消/异常）时释放 HTTP 连接
+            stream.close()
+            metrics.observe('llm_request_duration_seconds', time.perf_counter() - start, stream=1, **labels)
 
     def generate_session_title(self, first_message: str) -> str:
         return first_message[:15] + ("..." if len(first_message) > 15 else "")
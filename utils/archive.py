@@ -0,0 +1,145 @@
+#冷数据归档（把早于 ARCHIVE_AFTER_DAYS 天的消息按会话压缩转存到 chat_message_archive，读取历史时透明回填）
+
+from datetime import datetime, timedelta
+from itertools import groupby, takewhile
+from sqlalchemy import select, and_, or_
+from models import db
+from models.chat import ChatMessage, ChatMessageArchive
+import json
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+_MIN_TS = datetime.min
+
+
+def pack(messages):
+    """ChatMessage.to_dict() 列表 -> 压缩后的字节串。"""
+    raw = json.dumps(messages, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return zlib.compress(raw, 6), len(raw)
+
+
+def unpack(payload):
+    return json.loads(zlib.decompress(payload))
+
+
+def message_key(item):
+    #归档消息按 (timestamp, id) 排序，与热数据的游标一致
+    timestamp = item['timestamp']
+    return (datetime.fromisoformat(timestamp) if timestamp else _MIN_TS), item['id']
+
+
+def _before(boundary):
+    ts, row_id = boundary
+    return or_(ChatMessageArchive.first_ts < ts,
+               and_(ChatMessageArchive.first_ts == ts, ChatMessageArchive.first_id < row_id))
+
+
+def _after(boundary):
+    ts, row_id = boundary
+    return or_(ChatMessageArchive.last_ts > ts,
+               and_(ChatMessageArchive.last_ts == ts, ChatMessageArchive.last_id > row_id))
+
+
+class MessageArchive:
+    def __init__(self, archive_after_days=0, batch_size=500):
+        self.archive_after_days = archive_after_days
+        self.batch_size = batch_size
+        # 统计（本进程）
+        self.archived = 0
+        self.segments = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.reads = 0
+
+    def init_app(self, app):
+        self.archive_after_days = app.config.get('ARCHIVE_AFTER_DAYS', self.archive_after_days)
+        self.batch_size = app.config.get('MAINTENANCE_BATCH_SIZE', self.batch_size)
+        app.extensions['message_archive'] = self
+
+    @property
+    def enabled(self):
+        return self.archive_after_days > 0
+
+    def cutoff(self, now=None):
+        return (now or datetime.utcnow()) - timedelta(days=self.archive_after_days)
+
+    def may_contain(self, chat_session):
+        """会话创建时间晚于归档阈值时不可能有归档消息，省去一次查询。"""
+        return self.enabled and (chat_session.created_at is None or chat_session.created_at < self.cutoff())
+
+    def archive_batch(self, cutoff=None):
+        """归档一批最旧的消息（按 id 顺序取连续的一段早于 cutoff 的消息），在一个短事务中完成，返回归档条数。"""
+        cutoff = cutoff or self.cutoff()
+        #先只看最旧的一条，没有需要归档的数据时不加载整批
+        oldest = db.session.execute(select(ChatMessage.timestamp).order_by(ChatMessage.id).limit(1)).first()
+        if oldest is None or (oldest.timestamp is not None and oldest.timestamp >= cutoff):
+            return 0
+        rows = ChatMessage.query.order_by(ChatMessage.id).limit(self.batch_size).all()
+        rows = list(takewhile(lambda m: m.timestamp is None or m.timestamp < cutoff, rows))
+        rows.sort(key=lambda m: (m.user_id, m.session_id, m.id))
+        for (user_id, session_id), group in groupby(rows, key=lambda m: (m.user_id, m.session_id)):
+            group = list(group)
+            payload, raw_size = pack([m.to_dict() for m in group])
+            keys = [(m.timestamp or _MIN_TS, m.id) for m in group]
+            db.session.add(ChatMessageArchive(
+                user_id=user_id, session_id=session_id, first_id=group[0].id, last_id=group[-1].id,
+                first_ts=min(keys)[0], last_ts=max(keys)[0], count=len(group), payload=payload))
+            self.segments += 1
+            self.raw_bytes += raw_size
+            self.compressed_bytes += len(payload)
+        # 逐个删除（而非批量 DELETE）以便全文索引等 ORM 事件同步移除这些消息
+        for message in rows:
+            db.session.delete(message)
+        db.session.commit()
+        self.archived += len(rows)
+        return len(rows)
+
+    def _segments(self, user_id, session_id, *conditions, descending=True):
+        order = (ChatMessageArchive.last_ts.desc(), ChatMessageArchive.last_id.desc()) if descending else \
+            (ChatMessageArchive.last_ts.asc(), ChatMessageArchive.last_id.asc())
+        query = select(ChatMessageArchive.payload).where(
+            ChatMessageArchive.user_id == user_id, ChatMessageArchive.session_id == session_id,
+            *conditions).order_by(*order).execution_options(yield_per=20)
+        self.reads += 1
+        result = db.session.execute(query)
+        try:
+            for payload in result.scalars():
+                yield unpack(payload)
+        finally:
+            # 调用方取够条数后会提前结束迭代，及时释放游标
+            result.close()
+
+    def before(self, user_id, session_id, boundary=None, limit=50):
+        """返回早于 boundary=(timestamp, id) 的至多 limit 条归档消息，按时间倒序；boundary 为 None 时从最新的归档开始。"""
+        conditions = (_before(boundary),) if boundary else ()
+        found = []
+        for items in self._segments(user_id, session_id, *conditions):
+            found.extend(item for item in items if boundary is None or message_key(item) < boundary)
+            if len(found) >= limit:
+                break
+        found.sort(key=message_key, reverse=True)
+        return found[:limit]
+
+    def after(self, user_id, session_id, boundary=None):
+        """按时间升序逐条产出晚于 boundary 的归档消息（NDJSON 导出使用）。"""
+        conditions = (_after(boundary),) if boundary else ()
+        for items in self._segments(user_id, session_id, *conditions, descending=False):
+            for item in sorted(items, key=message_key):
+                if boundary is None or message_key(item) > boundary:
+                    yield item
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'archive_after_days': self.archive_after_days,
+            'archived': self.archived,
+            'segments': self.segments,
+            'compression_ratio': round(self.raw_bytes / self.compressed_bytes, 2) if self.compressed_bytes else None,
+            'reads': self.reads,
+        }
+
+
+# 创建全局实例
+message_archive = MessageArchive()
@@ -0,0 +1,149 @@
+#批量提示执行（有界并发调用大模型，按完成顺序产出结果，单条失败不影响其余条目）
+
+from collections import deque
+from utils.ai_handlers import ai_handler
+from utils.scheduler import llm_scheduler, SchedulerBusy
+from utils.metrics import metrics
+from utils.log_pipeline import bind_log_context, current_log_context
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BatchItem:
+    """批量请求中的一条提示；prompt_messages 等字段由接口在派发前准备好。"""
+    __slots__ = ('index', 'client_id', 'session_id', 'message', 'prompt_messages', 'use_cache',
+                 'context', 'is_new_session', 'elapsed_ms', 'usage')
+
+    def __init__(self, index, client_id, session_id, message, prompt_messages, use_cache=True,
+                 context=None, is_new_session=False):
+        self.index = index
+        self.client_id = client_id
+        self.session_id = session_id
+        self.message = message
+        self.prompt_messages = prompt_messages
+        self.use_cache = use_cache
+        self.context = context
+        self.is_new_session = is_new_session
+        self.elapsed_ms = None
+        self.usage = {}  # 本条调用的 token 用量，由 generate_from_messages 填入
+
+
+class BatchError(Exception):
+    """单条提示失败，status 为写入结果行的 HTTP 语义状态码。"""
+
+    def __init__(self, message, status, reason=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+class BatchRunner:
+    def __init__(self, max_items=200, concurrency=8, persist_size=50):
+        self.max_items = max_items
+        self.concurrency = concurrency
+        self.persist_size = persist_size
+        self._lock = threading.Lock()
+        # 统计
+        self.in_flight = 0
+        self.batches = 0
+        self.items = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def init_app(self, app):
+        self.max_items = app.config.get('BATCH_MAX_ITEMS', self.max_items)
+        self.concurrency = app.config.get('BATCH_CONCURRENCY', self.concurrency)
+        self.persist_size = app.config.get('BATCH_PERSIST_SIZE', self.persist_size)
+        app.extensions['batch_runner'] = self
+
+    def _call(self, user_id, item):
+        try:
+            # 与同步接口共用调度器和回复缓存；上游失败不返回兜底文案，而是作为该条的错误
+            return ai_handler.generate_from_messages(item.prompt_messages, user_id=user_id,
+                                                     use_cache=item.use_cache, fallback=False, usage=item.usage)
+        except SchedulerBusy as e:
+            raise BatchError('AI服务繁忙，请稍后重试', 429, e.reason)
+        except Exception as e:
+            logger.error(f"批量请求第 {item.index} 条调用失败: {str(e)}")
+            raise BatchError('AI服务暂时不可用', 502, type(e).__name__)
+
+    def run(self, socketio, user_id, items, concurrency=None):
+        """以至多 concurrency 个后台任务执行 items，按完成顺序产出 (item, response, error)。
+
+        error 为 None 或 BatchError。生成器被提前关闭（如客户端断开）时不再派发剩余条目，
+        已在进行中的调用照常结束。
+        """
+        pending = deque(items)
+        results = queue.Queue()
+        stopped = threading.Event()
+        log_context = current_log_context()
+        # 调度器按用户限制并发，多开的后台任务只会在队列中等待（并可能排队超时），因此同时以 LLM_MAX_PER_USER 为上限
+        workers = max(1, min(concurrency or self.concurrency, self.concurrency, llm_scheduler.max_per_user,
+                             len(items)))
+
+        def work():
+            # 后台任务沿用发起请求的 request_id / user_id
+            bind_log_context(**log_context)
+            while not stopped.is_set():
+                try:
+                    item = pending.popleft()
+                except IndexError:
+                    break
+                start = time.perf_counter()
+                response, error = None, None
+                try:
+                    response = self._call(user_id, item)
+                except BatchError as e:
+                    error = e
+                item.elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+                results.put((item, response, error))
+            results.put(None)
+
+        with self._lock:
+            self.in_flight += len(items)
+            self.batches += 1
+        for _ in range(workers):
+            socketio.start_background_task(work)
+        finished = done = 0
+        try:
+            while finished < workers:
+                result = results.get()
+                if result is None:
+                    finished += 1
+                    continue
+                done += 1
+                item, response, error = result
+                status = 'ok' if error is None else str(error.status)
+                metrics.inc('chat_batch_items_total', status=status)
+                with self._lock:
+                    self.in_flight -= 1
+                    self.items += 1
+                    if error is not None:
+                        self.failed += 1
+                yield result
+        finally:
+            stopped.set()
+            skipped = len(items) - done
+            if skipped:
+                with self._lock:
+                    self.in_flight -= skipped
+                    self.cancelled += skipped
+
+    def stats(self):
+        return {
+            'max_items': self.max_items,
+            'concurrency': self.concurrency,
+            'in_flight': self.in_flight,
+            'batches': self.batches,
+            'items': self.items,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+        }
+
+
+# 创建全局实例
+batch_runner = BatchRunner()
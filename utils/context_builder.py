@@ -0,0 +1,164 @@
+#对话上下文构建（按 token 预算截取最近轮次，较早轮次增量折叠为滚动摘要）
+
+import logging
+import math
+import re
+
+logger = logging.getLogger(__name__)
+
+# 中日韩字符按 1 字 1 token 估算，其余字符约 4 个 1 token
+_CJK = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+MESSAGE_OVERHEAD = 4
+SUMMARY_KEY = '_summary'
+SUMMARY_PREFIX = '此前对话摘要：\n'
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def message_tokens(messages: list) -> int:
+    return sum(count_tokens(m.get('content')) + MESSAGE_OVERHEAD for m in messages)
+
+
+def _turn_messages(turn: dict) -> list:
+    messages = [{'role': 'user', 'content': turn.get('message', '')}]
+    if turn.get('response'):
+        messages.append({'role': 'assistant', 'content': turn['response']})
+    return messages
+
+
+class ContextBuilder:
+    def __init__(self, token_budget=6000, summary_token_budget=800, summary_turn_chars=120,
+                 history_turns=10):
+        self.token_budget = token_budget
+        self.summary_token_budget = summary_token_budget
+        self.summary_turn_chars = summary_turn_chars
+        self.history_turns = history_turns
+        # 统计
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.tokens_saved = 0
+
+    def init_app(self, app):
+        self.token_budget = app.config.get('AI_CONTEXT_TOKEN_BUDGET', self.token_budget)
+        self.summary_token_budget = app.config.get('AI_SUMMARY_TOKEN_BUDGET', self.summary_token_budget)
+        self.summary_turn_chars = app.config.get('AI_SUMMARY_TURN_CHARS', self.summary_turn_chars)
+        self.history_turns = app.config.get('AI_HISTORY_TURNS', self.history_turns)
+        app.extensions['context_builder'] = self
+
+    def _condense(self, turn: dict) -> str:
+        limit = self.summary_turn_chars
+
+        def clip(text):
+            text = ' '.join((text or '').split())
+            return text if len(text) <= limit else text[:limit] + '…'
+        line = f"用户：{clip(turn.get('message'))}"
+        if turn.get('response'):
+            line += f" 助手：{clip(turn.get('response'))}"
+        return line
+
+    def _fold(self, summary: dict, turns: list, limit: int) -> dict:
+        """把移出窗口的轮次追加进摘要，超出 limit 个 token 时丢弃最早的行。"""
+        lines = summary['text'].split('\n') if summary.get('text') else []
+        lines.extend(self._condense(turn) for turn in turns)
+        while len(lines) > 1 and count_tokens('\n'.join(lines)) > limit:
+            lines.pop(0)
+        return {'text': '\n'.join(lines), 'upto_id': turns[-1].get('id') or summary.get('upto_id')}
+
+    @staticmethod
+    def _summary_message(summary: dict) -> dict:
+        return {'role': 'system', 'content': SUMMARY_PREFIX + summary['text']}
+
+    def _summary_tokens(self, summary: dict) -> int:
+        return message_tokens([self._summary_message(summary)]) if summary.get('text') else 0
+
+    def build(self, system_prompt: str, message: str, chat_history: list = None, summary: dict = None):
+        """构建提示消息列表。
+
+        chat_history 为按时间升序的最近若干轮（ChatMessage.to_dict() 格式），summary 为
+        ChatSession.context 中保存的滚动摘要 {'text', 'upto_id'}。返回 (messages, summary, stats)，
+        summary 有变化时调用方需要写回会话上下文。
+        """
+        chat_history = chat_history or []
+        summary = dict(summary or {})
+        upto_id = summary.get('upto_id') or 0
+
+        current = {'role': 'user', 'content': message}
+        fixed = message_tokens([{'role': 'system', 'content': system_prompt}, current])
+        budget = self.token_budget - fixed
+        if summary.get('text'):
+            budget -= count_tokens(summary['text']) + MESSAGE_OVERHEAD
+
+        # 从最新的一轮往前装填，最多保留 history_turns - 1 轮，保证最早加载的一轮总能被折叠进摘要
+        window, costs = [], []
+        max_window = max(self.history_turns - 1, 0)
+        for turn in reversed(chat_history):
+            cost = message_tokens(_turn_messages(turn))
+            if len(window) >= max_window or cost > budget:
+                break
+            budget -= cost
+            window.append(turn)
+            costs.append(cost)
+        window.reverse()
+        costs.reverse()
+
+        dropped = chat_history[:len(chat_history) - len(window)]
+        to_fold = [turn for turn in dropped if (turn.get('id') or 0) > upto_id]
+        # 摘要不超过 summary_token_budget，也不超过总预算扣除系统提示与本轮消息后的剩余量
+        limit = min(self.summary_token_budget,
+                    self.token_budget - fixed - count_tokens(SUMMARY_PREFIX) - MESSAGE_OVERHEAD)
+        if to_fold:
+            summary = self._fold(summary, to_fold, limit)
+        # 折叠后摘要会变长，超出总预算时继续把窗口中最早的轮次移入摘要
+        while window and fixed + self._summary_tokens(summary) + sum(costs) > self.token_budget:
+            turn = window.pop(0)
+            costs.pop(0)
+            if (turn.get('id') or 0) > upto_id:
+                to_fold.append(turn)
+                summary = self._fold(summary, [turn], limit)
+        changed = bool(to_fold)
+
+        messages = [{'role': 'system', 'content': system_prompt}]
+        if summary.get('text'):
+            messages.append(self._summary_message(summary))
+        for turn in window:
+            messages.extend(_turn_messages(turn))
+        messages.append(current)
+
+        prompt_tokens = message_tokens(messages)
+        # 对比旧策略：最近 10 轮全文
+        naive = [{'role': 'system', 'content': system_prompt}]
+        for turn in chat_history[-10:]:
+            naive.extend(_turn_messages(turn))
+        naive.append(current)
+        naive_tokens = message_tokens(naive)
+
+        stats = {
+            'prompt_tokens': prompt_tokens,
+            'naive_prompt_tokens': naive_tokens,
+            'tokens_saved': naive_tokens - prompt_tokens,
+            'window_turns': len(window),
+            'summarized_turns': len(to_fold),
+        }
+        self.turns += 1
+        self.prompt_tokens += prompt_tokens
+        self.tokens_saved += stats['tokens_saved']
+        logger.info(f"上下文构建: prompt={prompt_tokens} naive={naive_tokens} window={len(window)} "
+                    f"folded={len(to_fold)}")
+        return messages, (summary if changed else None), stats
+
+    def stats(self):
+        return {
+            'turns': self.turns,
+            'prompt_tokens': self.prompt_tokens,
+            'tokens_saved': self.tokens_saved,
+            'avg_prompt_tokens': round(self.prompt_tokens / self.turns, 1) if self.turns else None,
+        }
+
+
+# 创建全局实例
+context_builder = ContextBuilder()
@@ -1 +0,0 @@
-#Nothing
\ No newline at end of file
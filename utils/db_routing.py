@@ -0,0 +1,164 @@
+#数据库引擎配置与读写分离（连接池参数、SQLite PRAGMA、只读副本路由与读己之写、连接池统计）
+
+from functools import wraps
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import Pool
+from models import db, REPLICA_BIND
+from utils.metrics import metrics
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 写请求成功后下发的 Cookie，值为读主库截止的时间戳
+READ_AFTER_WRITE_COOKIE = 'db_rw_until'
+_SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class DatabaseRouter:
+    def __init__(self):
+        self.app = None
+        self.replica = False
+        self.read_after_write = 10
+        self.pragmas = {}
+        self._lock = threading.Lock()
+        # 统计
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidated = 0
+        self.replica_requests = 0
+        self.primary_requests = 0
+
+    def init_app(self, app):
+        """需在 db.init_app(app) 之前调用：组装引擎参数并写入配置。"""
+        config = app.config
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+            self.engine_options(config, config['SQLALCHEMY_DATABASE_URI']),
+            **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        replica_uri = config.get('SQLALCHEMY_REPLICA_URI')
+        self.replica = bool(replica_uri)
+        if self.replica:
+            binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+            binds[REPLICA_BIND] = dict(self.engine_options(config, replica_uri), url=replica_uri)
+            config['SQLALCHEMY_BINDS'] = binds
+        self.read_after_write = config.get('REPLICA_READ_AFTER_WRITE', self.read_after_write)
+        self.pragmas = {
+            'journal_mode': config.get('SQLITE_JOURNAL_MODE'),
+            'synchronous': config.get('SQLITE_SYNCHRONOUS'),
+            'busy_timeout': config.get('SQLITE_BUSY_TIMEOUT'),
+        }
+        self.app = app
+        app.extensions['db_router'] = self
+
+        # 连接与连接池事件对所有引擎生效（包括只读副本）
+        if not event.contains(Engine, 'connect', self._on_connect):
+            event.listen(Engine, 'connect', self._on_connect)
+            event.listen(Pool, 'checkout', self._on_checkout)
+            event.listen(Pool, 'invalidate', self._on_invalidate)
+
+        if self.replica:
+            @app.after_request
+            def _mark_write(response):
+                # 写请求成功后，在 read_after_write 秒内该客户端的只读请求仍读主库
+                if request.method not in _SAFE_METHODS and response.status_code < 400:
+                    until = time.time() + self.read_after_write
+                    response.set_cookie(READ_AFTER_WRITE_COOKIE, f'{until:.3f}', max_age=int(self.read_after_write) + 1,
+                                        httponly=True, samesite='Lax')
+                return response
+
+    @staticmethod
+    def engine_options(config, uri):
+        url = make_url(uri)
+        if url.get_backend_name() == 'sqlite':
+            # 内存库使用单连接的 StaticPool，不接受连接池参数
+            if url.database in (None, '', ':memory:'):
+                return {}
+            return {'pool_size': config['SQLALCHEMY_POOL_SIZE'], 'max_overflow': config['SQLALCHEMY_MAX_OVERFLOW'],
+                    'pool_timeout': config['SQLALCHEMY_POOL_TIMEOUT']}
+        return {'pool_size': config['SQLALCHEMY_POOL_SIZE'], 'max_overflow': config['SQLALCHEMY_MAX_OVERFLOW'],
+                'pool_timeout': config['SQLALCHEMY_POOL_TIMEOUT'],
+                'pool_recycle': config['SQLALCHEMY_POOL_RECYCLE'],
+                'pool_pre_ping': config['SQLALCHEMY_POOL_PRE_PING']}
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self.pragmas.items():
+                if value not in (None, ''):
+                    cursor.execute(f'PRAGMA {name} = {value}')
+        except sqlite3.DatabaseError as e:
+            logger.warning(f"设置 SQLite PRAGMA 失败: {str(e)}")
+        finally:
+            cursor.close()
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidated += 1
+
+    def use_replica(self):
+        """当前请求是否可以读副本：已配置副本，且客户端最近没有写操作。"""
+        if not self.replica:
+            return False
+        try:
+            until = float(request.cookies.get(READ_AFTER_WRITE_COOKIE) or 0)
+        except ValueError:
+            until = 0
+        return until < time.time()
+
+    def stats(self):
+        data = {
+            'replica': self.replica,
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'invalidated': self.invalidated,
+            'replica_requests': self.replica_requests,
+            'primary_requests': self.primary_requests,
+        }
+        if self.app is None:
+            return data
+        with self.app.app_context():
+            engines = dict(db.engines)
+        for key, engine in engines.items():
+            pool = engine.pool
+            if not hasattr(pool, 'checkedout'):
+                continue
+            name = key or 'primary'
+            size, checked_out, overflow = pool.size(), pool.checkedout(), max(0, pool.overflow())
+            capacity = size + max(0, getattr(pool, '_max_overflow', 0))
+            data[f'{name}_pool_size'] = size
+            data[f'{name}_checked_out'] = checked_out
+            data[f'{name}_overflow'] = overflow
+            # 连接池使用率：已取出的连接数 / (pool_size + max_overflow)
+            data[f'{name}_utilization'] = round(checked_out / capacity, 3) if capacity else 0
+        return data
+
+
+def replica_read(view):
+    """只读接口使用的装饰器（放在 login_required 之下，加载当前用户仍走主库）：查询路由到只读副本。"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if db_router.use_replica():
+            g.db_bind = REPLICA_BIND
+            db_router.replica_requests += 1
+            metrics.inc('db_routed_requests_total', bind=REPLICA_BIND)
+        elif db_router.replica:
+            db_router.primary_requests += 1
+            metrics.inc('db_routed_requests_total', bind='primary')
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# 创建全局实例
+db_router = DatabaseRouter()
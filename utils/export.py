@@ -0,0 +1,190 @@
+#聊天记录导出（会话与消息按生成器流水线逐行输出 NDJSON / CSV，可选 gzip；每行带续传游标）
+
+from datetime import datetime
+from sqlalchemy import select, and_, or_
+from models import db
+from models.chat import ChatMessage, ChatSession
+from utils.archive import message_archive
+from utils.pagination import encode_cursor, decode_cursor
+import csv
+import io
+import json
+import logging
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'ndjson': ('application/x-ndjson', 'ndjson'), 'csv': ('text/csv; charset=utf-8', 'csv')}
+CSV_FIELDS = ('type', 'cursor', 'session_id', 'id', 'timestamp', 'sender', 'message', 'response',
+              'prompt_tokens', 'completion_tokens', 'status', 'topic', 'feedback', 'start_time', 'end_time',
+              'created_at', 'updated_at', 'version', 'context', 'meta_data')
+
+
+def export_cursor(chat_session, message_key=None):
+    """续传游标："会话位置" 或 "会话位置.消息位置"，表示此位置及之前的内容已经收到。"""
+    cursor = encode_cursor(chat_session.created_at, chat_session.id)
+    if message_key is not None:
+        cursor += '.' + encode_cursor(*message_key)
+    return cursor
+
+
+def parse_export_cursor(cursor):
+    """返回 ((会话 created_at, 会话 id), 消息 (timestamp, id) 或 None)；格式不合法时抛出 ValueError。"""
+    session_part, _, message_part = cursor.partition('.')
+    session_key = decode_cursor(session_part)
+    if not message_part:
+        return session_key, None
+    ts, row_id = decode_cursor(message_part)
+    return session_key, (ts or datetime.min, row_id)
+
+
+class ChatExporter:
+    def __init__(self, session_batch=100, yield_per=500, flush_bytes=64 * 1024, gzip_level=6):
+        self.session_batch = session_batch
+        self.yield_per = yield_per
+        self.flush_bytes = flush_bytes  # 输出缓冲达到该字节数才交给 WSGI 服务器，避免逐行写 socket
+        self.gzip_level = gzip_level
+        self._lock = threading.Lock()
+        # 统计（本进程）
+        self.exports = 0
+        self.completed = 0
+        self.sessions = 0
+        self.messages = 0
+        self.bytes_out = 0
+
+    def init_app(self, app):
+        self.session_batch = app.config.get('EXPORT_SESSION_BATCH', self.session_batch)
+        self.yield_per = app.config.get('EXPORT_YIELD_PER', self.yield_per)
+        self.flush_bytes = app.config.get('EXPORT_FLUSH_BYTES', self.flush_bytes)
+        self.gzip_level = app.config.get('EXPORT_GZIP_LEVEL', self.gzip_level)
+        app.extensions['chat_exporter'] = self
+
+    def records(self, user_id, session_id=None, cursor=None):
+        """按会话创建时间顺序产出 (类型, 游标, 字典)：每个会话先是 session 记录，随后按时间升序是其全部消息
+        （先冷归档、后热数据）。会话按 session_batch 个一批键集分页读取，消息通过服务端游标分批读取，
+        同一时间只有一个游标打开，内存占用与总行数无关。"""
+        filters = [ChatSession.user_id == user_id]
+        if session_id:
+            filters.append(ChatSession.session_id == session_id)
+        boundary = None
+        if cursor:
+            session_key, message_key = parse_export_cursor(cursor)
+            # 游标所在的会话：session 记录已经收到，只续传其后的消息
+            current = db.session.execute(select(ChatSession).where(
+                *filters, ChatSession.id == session_key[1])).scalar()
+            if current is not None:
+                yield from self._messages(user_id, current, message_key)
+            boundary = (session_key[0] or datetime.min, session_key[1])
+        while True:
+            query = select(ChatSession).where(*filters)
+            if boundary is not None:
+                ts, row_id = boundary
+                query = query.where(or_(ChatSession.created_at > ts,
+                                        and_(ChatSession.created_at == ts, ChatSession.id > row_id)))
+            batch = db.session.execute(query.order_by(ChatSession.created_at, ChatSession.id)
+                                       .limit(self.session_batch)).scalars().all()
+            for chat_session in batch:
+                self.sessions += 1
+                yield 'session', export_cursor(chat_session), chat_session.to_dict()
+                yield from self._messages(user_id, chat_session)
+            if len(batch) < self.session_batch:
+                return
+            boundary = (batch[-1].created_at or datetime.min, batch[-1].id)
+
+    def _messages(self, user_id, chat_session, boundary=None):
+        if message_archive.may_contain(chat_session):
+            for item in message_archive.after(user_id, chat_session.session_id, boundary):
+                self.messages += 1
+                yield 'message', export_cursor(chat_session, (item['timestamp'] and datetime.fromisoformat(
+                    item['timestamp']), item['id'])), item
+        query = select(ChatMessage).where(ChatMessage.user_id == user_id,
+                                          ChatMessage.session_id == chat_session.session_id)
+        if boundary is not None:
+            ts, row_id = boundary
+            query = query.where(or_(ChatMessage.timestamp > ts, and_(ChatMessage.timestamp == ts,
+                                                                     ChatMessage.id > row_id)))
+        query = query.order_by(ChatMessage.timestamp, ChatMessage.id).execution_options(yield_per=self.yield_per)
+        result = db.session.execute(query)
+        try:
+            for message in result.scalars():
+                self.messages += 1
+                yield 'message', export_cursor(chat_session, (message.timestamp, message.id)), message.to_dict()
+        finally:
+            # 客户端中途断开时生成器被关闭，及时释放服务端游标
+            result.close()
+
+    @staticmethod
+    def ndjson_lines(records):
+        sessions = messages = 0
+        for kind, cursor, data in records:
+            if kind == 'session':
+                sessions += 1
+            else:
+                messages += 1
+            yield json.dumps(dict(data, type=kind, cursor=cursor), ensure_ascii=False) + '\n'
+        # 结束行：客户端据此区分完整导出与中途断开
+        yield json.dumps({'type': 'end', 'sessions': sessions, 'messages': messages}) + '\n'
+
+    @staticmethod
+    def csv_lines(records):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, CSV_FIELDS, extrasaction='ignore', restval='')
+        writer.writeheader()
+        for kind, cursor, data in records:
+            row = dict(data, type=kind, cursor=cursor)
+            for key in ('context', 'meta_data'):
+                if row.get(key) is not None:
+                    row[key] = json.dumps(row[key], ensure_ascii=False)
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def encode(self, lines, compress=False):
+        """把文本行合并为不小于 flush_bytes 的块并编码为 UTF-8，compress 时边生成边 gzip 压缩。"""
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31) if compress else None
+        parts, size = [], 0
+        for line in lines:
+            parts.append(line)
+            size += len(line)
+            if size >= self.flush_bytes:
+                chunk = self._emit(''.join(parts).encode('utf-8'), compressor)
+                parts, size = [], 0
+                if chunk:
+                    yield chunk
+        chunk = self._emit(''.join(parts).encode('utf-8'), compressor, final=True)
+        if chunk:
+            yield chunk
+        with self._lock:
+            self.completed += 1
+
+    def _emit(self, data, compressor, final=False):
+        if compressor is not None:
+            data = compressor.compress(data)
+            if final:
+                data += compressor.flush()
+        with self._lock:
+            self.bytes_out += len(data)
+        return data
+
+    def stream(self, user_id, fmt='ndjson', compress=False, session_id=None, cursor=None):
+        """导出流水线：records -> ndjson / csv 行 -> 分块（可选 gzip）字节流。"""
+        with self._lock:
+            self.exports += 1
+        records = self.records(user_id, session_id, cursor)
+        lines = self.csv_lines(records) if fmt == 'csv' else self.ndjson_lines(records)
+        return self.encode(lines, compress)
+
+    def stats(self):
+        return {
+            'exports': self.exports,
+            'completed': self.completed,
+            'sessions': self.sessions,
+            'messages': self.messages,
+            'bytes_out': self.bytes_out,
+        }
+
+
+# 创建全局实例
+chat_exporter = ChatExporter()
@@ -0,0 +1,123 @@
+#密码哈希工具（把 CPU 密集的哈希计算移出 eventlet 事件循环，并对认证突发做准入控制）
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+import logging
+import os
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AuthBusy(Exception):
+    """哈希任务排队过多或等待超时，调用方应返回 429。"""
+
+
+def _eventlet_patched():
+    if 'eventlet' not in sys.modules:
+        return False
+    from eventlet import patcher
+    return patcher.is_monkey_patched('thread')
+
+
+class PasswordHasher:
+    def __init__(self, mode='thread', workers=4, max_concurrent=4, max_pending=64, queue_timeout=5):
+        self.mode = mode
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._pending = 0
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        # 统计
+        self.completed = 0
+        self.rejected = 0
+
+    def init_app(self, app):
+        self.mode = app.config.get('PASSWORD_HASH_POOL', self.mode)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.max_concurrent = app.config.get('AUTH_MAX_CONCURRENT_HASHES', self.max_concurrent)
+        self.max_pending = app.config.get('AUTH_MAX_PENDING_HASHES', self.max_pending)
+        self.queue_timeout = app.config.get('AUTH_HASH_QUEUE_TIMEOUT', self.queue_timeout)
+        if self.mode != 'inline' and _eventlet_patched():
+            if self.mode == 'process':
+                # 多进程池与 monkey_patch 不兼容
+                logger.warning("eventlet 下不支持 PASSWORD_HASH_POOL=process，密码哈希改用 tpool 线程")
+                self.mode = 'thread'
+            # eventlet 下在 tpool 中计算：tpool 线程数按进程全局生效（EVENTLET_THREADPOOL_SIZE，默认 20，
+            # 回复缓存共享层的 I/O 也在其中），不足 workers 个时调大，只能在 tpool 首次使用前设置
+            from eventlet import tpool
+            threads = int(os.environ.get('EVENTLET_THREADPOOL_SIZE', 20))
+            if self.workers > threads:
+                tpool.set_num_threads(self.workers)
+        # 同时计算的哈希数不超过 workers（线程池大小）
+        self._slots = threading.BoundedSemaphore(self._concurrency())
+        app.extensions['password_hasher'] = self
+
+    def _concurrency(self):
+        return self.max_concurrent if self.mode == 'inline' else min(self.max_concurrent, self.workers)
+
+    def _get_executor(self):
+        # 进程池/线程池按进程懒创建，fork 出的 worker 各自创建
+        if self._executor is None or self._executor_pid != os.getpid():
+            if self.mode == 'process':
+                self._executor = ProcessPoolExecutor(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _execute(self, fn, *args):
+        if self.mode == 'inline':
+            return fn(*args)
+        if _eventlet_patched():
+            # eventlet 下使用 tpool 在真实系统线程中计算，当前 greenlet 让出直到结果返回；
+            # hashlib 的 scrypt/pbkdf2 计算期间释放 GIL
+            from eventlet import tpool
+            return tpool.execute(fn, *args)
+        return self._get_executor().submit(fn, *args).result()
+
+    def _run(self, fn, *args):
+        # 准入控制：排队数超过上限直接拒绝，否则最多等待 queue_timeout 秒获取计算名额
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise AuthBusy()
+            self._pending += 1
+        try:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                self.rejected += 1
+                raise AuthBusy()
+            try:
+                result = self._execute(fn, *args)
+                self.completed += 1
+                return result
+            finally:
+                self._slots.release()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password)
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'pending': self._pending,
+            'workers': self.workers,
+            'max_concurrent': self._concurrency(),
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+
+# 创建全局实例
+password_hasher = PasswordHasher()
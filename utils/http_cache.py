@@ -0,0 +1,42 @@
+#条件 GET 辅助（ETag / Last-Modified 校验，未变化时直接返回 304）
+
+from datetime import timezone
+from flask import request, make_response
+import hashlib
+
+
+def make_etag(*parts):
+    """由校验字段与查询参数生成弱 ETag；同一资源不同分页/格式的响应互不混用。"""
+    raw = '|'.join(str(part) for part in parts) + '|' + request.query_string.decode('latin-1')
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+
+def _aware(value):
+    #数据库中的时间均为 UTC 的 naive datetime
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def not_modified(etag, last_modified=None):
+    """客户端缓存仍有效时返回 304 响应，否则返回 None。
+
+    优先比较 If-None-Match；仅当请求没有 If-None-Match 时才使用 If-Modified-Since（秒级精度）。
+    """
+    if request.if_none_match:
+        if not request.if_none_match.contains_weak(etag):
+            return None
+    elif request.if_modified_since is None or last_modified is None:
+        return None
+    elif _aware(last_modified).replace(microsecond=0) > request.if_modified_since:
+        return None
+    return add_validators(make_response('', 304), etag, last_modified)
+
+
+def add_validators(response, etag, last_modified=None):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = _aware(last_modified)
+    # 浏览器可以缓存，但每次使用前都要带校验头回源确认
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
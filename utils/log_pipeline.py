@@ -0,0 +1,301 @@
+#异步日志（请求路径只把记录放入有界队列，由独立的系统线程统一格式化并写文件；可选 JSON 行格式、按 logger 采样）
+
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+import atexit
+import fcntl
+import json
+import logging
+import os
+import random
+import time
+import uuid
+
+try:
+    from eventlet import patcher
+    # monkey_patch 之后 threading / queue 是协程版本，写线程必须是真正的系统线程，才不会在 hub 上阻塞
+    _threading = patcher.original('threading')
+    _queue = patcher.original('queue')
+except ImportError:
+    import threading as _threading
+    import queue as _queue
+
+TEXT_FORMAT = '[%(asctime)s] [%(levelname)s] [%(process)d] %(name)s - %(message)s'
+
+# 当前请求 / 后台任务的日志上下文（request_id、session_id、user_id），协程之间互不影响
+_log_context = ContextVar('log_context', default=None)
+
+
+def bind_log_context(**fields):
+    """为当前请求或后台任务绑定日志字段，返回的 token 可交给 reset_log_context 还原。"""
+    context = dict(_log_context.get() or {})
+    context.update((key, value) for key, value in fields.items() if value is not None)
+    return _log_context.set(context)
+
+
+def current_log_context():
+    """当前日志上下文的副本，用于带到后台任务中。"""
+    return dict(_log_context.get() or {})
+
+
+def reset_log_context(token):
+    _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """在调用方把日志上下文写入记录，格式化在写线程进行时仍能取到。"""
+
+    def filter(self, record):
+        context = _log_context.get()
+        record.request_id = context.get('request_id') if context else None
+        record.session_id = context.get('session_id') if context else None
+        record.user_id = context.get('user_id') if context else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出一行 JSON。"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'msg': record.getMessage(),
+        }
+        for key in ('request_id', 'session_id', 'user_id'):
+            value = getattr(record, key, None)
+            if value is not None:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """多个 worker 进程写同一个日志文件：写入前检查文件是否已被其他进程轮转，轮转时加文件锁，
+    避免多个进程重复轮转、或继续写入已被改名的旧文件。"""
+
+    check_interval = 1.0  # 检查文件是否被轮转的最小间隔（秒），避免每条记录都 stat
+
+    _last_check = 0.0
+
+    def _reopen_if_rotated(self, force=False):
+        if self.stream is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            current = None
+        opened = os.fstat(self.stream.fileno())
+        if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+            self.stream.close()
+            self.stream = self._open()
+
+    def shouldRollover(self, record):
+        self._reopen_if_rotated()
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        with open(self.baseFilename + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # 拿到锁后再检查一次，其他进程可能已经完成轮转
+                self._reopen_if_rotated(force=True)
+                if self.stream is None or self.stream.seek(0, 2) >= self.maxBytes:
+                    super().doRollover()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class AsyncLogHandler(logging.Handler):
+    """emit 只做采样判断并放入有界队列，队列满时丢弃并计数；写线程按进程懒启动，fork 后在子进程重建。"""
+
+    def __init__(self, target, capacity=10000, sample_rates=None):
+        super().__init__()
+        self.target = target
+        self.capacity = capacity
+        self.sample_rates = sample_rates or {}
+        self._queue = None
+        self._writer_pid = None
+        self._start_lock = _threading.Lock()
+        # 统计
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.errors = 0
+        if hasattr(os, 'register_at_fork'):
+            # 父进程的写线程和队列锁不会带到子进程，子进程首次写日志时重新创建
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._queue = None
+        self._writer_pid = None
+        self._start_lock = _threading.Lock()
+
+    def _ensure_writer(self):
+        if self._writer_pid == os.getpid():
+            return self._queue
+        with self._start_lock:
+            if self._writer_pid != os.getpid():
+                self._queue = _queue.Queue(self.capacity)
+                _threading.Thread(target=self._run, args=(self._queue,), name='log-writer',
+                                  daemon=True).start()
+                self._writer_pid = os.getpid()
+        return self._queue
+
+    def _sample_rate(self, name):
+        # 按 logger 名称最长前缀匹配
+        while name:
+            rate = self.sample_rates.get(name)
+            if rate is not None:
+                return rate
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def emit(self, record):
+        if record.levelno < logging.WARNING and self.sample_rates:
+            rate = self._sample_rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return
+        # 参数和异常在调用方就地渲染，避免写线程格式化时对象已被修改
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info) \
+                if self.target.formatter else logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self._ensure_writer().put_nowait(record)
+            self.enqueued += 1
+        except _queue.Full:
+            self.dropped += 1
+
+    def _run(self, queue):
+        while True:
+            record = queue.get()
+            if record is None:
+                queue.task_done()
+                return
+            try:
+                self.target.handle(record)
+                self.written += 1
+            except Exception:
+                self.errors += 1
+            finally:
+                queue.task_done()
+
+    def flush(self):
+        """等待当前进程队列中的记录写完（退出前调用）。"""
+        queue = self._queue
+        if queue is not None and self._writer_pid == os.getpid():
+            queue.join()
+        self.target.flush()
+
+    def close(self):
+        queue = self._queue
+        if queue is not None and self._writer_pid == os.getpid():
+            queue.put(None)
+            queue.join()
+            self._writer_pid = None
+        self.target.close()
+        super().close()
+
+    def stats(self):
+        queue = self._queue if self._writer_pid == os.getpid() else None
+        return {
+            'queued': queue.qsize() if queue is not None else 0,
+            'capacity': self.capacity,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+            'errors': self.errors,
+        }
+
+
+def parse_sample_rates(value):
+    """解析 "logger=比例,logger=比例" 格式的采样配置。"""
+    rates = {}
+    for item in (value or '').split(','):
+        name, sep, rate = item.partition('=')
+        if sep and name.strip():
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class LogPipeline:
+    def __init__(self):
+        self.handler = None
+        self.async_mode = True
+
+    def init_app(self, app, log_file):
+        self.async_mode = app.config.get('LOG_ASYNC', True)
+        file_handler = SharedRotatingFileHandler(
+            log_file, maxBytes=app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+            backupCount=app.config.get('LOG_BACKUP_COUNT', 5), encoding='utf-8'
+        )
+        file_handler.setFormatter(JsonFormatter() if app.config.get('LOG_JSON') else logging.Formatter(TEXT_FORMAT))
+        if self.async_mode:
+            handler = AsyncLogHandler(file_handler, app.config.get('LOG_QUEUE_SIZE', 10000),
+                                      parse_sample_rates(app.config.get('LOG_SAMPLE_RATES')))
+            atexit.register(self.shutdown)
+        else:
+            handler = file_handler
+        handler.setLevel(app.config.get('LOG_LEVEL', logging.INFO))
+        handler.addFilter(ContextFilter())
+        self.handler = handler
+
+        # 格式中不再使用 pathname / lineno，关闭每条日志的调用栈查找
+        logging._srcfile = None
+        logging.basicConfig(level=app.config.get('LOG_LEVEL', logging.INFO), handlers=[handler])
+        app.extensions['log_pipeline'] = self
+
+        @app.before_request
+        def _bind_request_id():
+            from flask import g, request
+            request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+            g.log_context_token = bind_log_context(request_id=request_id)
+            g.request_id = request_id
+
+        @app.after_request
+        def _return_request_id(response):
+            from flask import g
+            if getattr(g, 'request_id', None):
+                response.headers.setdefault('X-Request-ID', g.request_id)
+            return response
+
+        @app.teardown_request
+        def _unbind_request_id(exc):
+            from flask import g
+            token = g.pop('log_context_token', None)
+            if token is not None:
+                try:
+                    reset_log_context(token)
+                except ValueError:
+                    # 请求内切换过协程时 token 不属于当前上下文，直接清空即可
+                    _log_context.set(None)
+
+    def shutdown(self):
+        if isinstance(self.handler, AsyncLogHandler):
+            self.handler.flush()
+
+    def stats(self):
+        if isinstance(self.handler, AsyncLogHandler):
+            return dict(self.handler.stats(), mode='async')
+        return {'mode': 'sync'}
+
+
+# 创建全局实例
+log_pipeline = LogPipeline()
@@ -0,0 +1,170 @@
+#后台维护任务（关闭空闲会话、汇总每日用量、归档旧消息）；多 worker 时通过文件锁保证同一时间只有一个进程执行
+
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, and_, or_, exists
+from models import db
+from models.chat import ChatMessage, ChatSession
+from utils.archive import message_archive
+from utils.usage import usage_rollup
+import fcntl
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MaintenanceSweeper:
+    def __init__(self, interval=60, batch_size=500, idle_timeout=300, max_batches=20, pause=0.05):
+        self.enabled = True
+        self.interval = interval
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.max_batches = max_batches  # 每轮每项任务最多执行的批数，积压的数据留到下一轮
+        self.pause = pause  # 批与批之间的间隔（秒），让出数据库写锁
+        self.lock_path = None
+        self.app = None
+        self._worker_pid = None
+        # 统计（本进程）
+        self.runs = 0
+        self.skipped = 0
+        self.closed_sessions = 0
+        self.archived_messages = 0
+        self.rolled_up_messages = 0
+        self.errors = 0
+        self.last_run_ms = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get('MAINTENANCE_ENABLED', self.enabled)
+        self.interval = app.config.get('MAINTENANCE_INTERVAL', self.interval)
+        self.batch_size = app.config.get('MAINTENANCE_BATCH_SIZE', self.batch_size)
+        self.idle_timeout = app.config.get('CHAT_TIMEOUT', self.idle_timeout)
+        self.lock_path = app.config.get('MAINTENANCE_LOCK_PATH') or os.path.join(app.instance_path,
+                                                                                  'maintenance.lock')
+        self.app = app
+        app.extensions['maintenance'] = self
+
+        @app.cli.command('maintenance-run')
+        def maintenance_run():
+            """立即执行一轮维护（关闭空闲会话、汇总每日用量、归档旧消息）。"""
+            print(self.run_once(force=True))
+
+        if self.enabled:
+            @app.before_request
+            def _start_sweeper():
+                self._ensure_worker()
+
+    def _ensure_worker(self):
+        # 后台线程按进程启动，fork 出的 worker 收到第一个请求时各自启动；是否执行由文件锁决定
+        if self._worker_pid != os.getpid():
+            self._worker_pid = os.getpid()
+            threading.Thread(target=self._run, name='maintenance', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"后台维护失败: {str(e)}")
+
+    def run_once(self, force=False):
+        """执行一轮维护。各 worker 定时调用，拿到文件锁且距上次执行已满 interval 的进程才真正执行；
+        锁文件中记录上次执行时间。返回本轮结果，未执行时返回 None。"""
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        with open(self.lock_path, 'a+') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if force else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.skipped += 1
+                return None
+            try:
+                lock_file.seek(0)
+                try:
+                    last_run = float(lock_file.read().strip() or 0)
+                except ValueError:
+                    last_run = 0
+                if not force and time.time() - last_run < self.interval * 0.9:
+                    self.skipped += 1
+                    return None
+                result = self._sweep()
+                lock_file.seek(0)
+                lock_file.truncate()
+                lock_file.write(str(time.time()))
+                lock_file.flush()
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sweep(self):
+        start = time.perf_counter()
+        with self.app.app_context():
+            try:
+                closed = self._repeat(self.close_idle_sessions)
+                # 先汇总用量再归档，保证消息移入归档前已计入 usage_daily
+                rolled_up = self._repeat(usage_rollup.rollup_batch)
+                archived = self._repeat(message_archive.archive_batch) if message_archive.enabled else 0
+            finally:
+                db.session.remove()
+        self.runs += 1
+        self.closed_sessions += closed
+        self.archived_messages += archived
+        self.rolled_up_messages += rolled_up
+        self.last_run_ms = round((time.perf_counter() - start) * 1000, 1)
+        if closed or archived or rolled_up:
+            logger.info(f"后台维护：关闭空闲会话 {closed} 个，汇总用量 {rolled_up} 条，归档消息 {archived} 条，"
+                        f"耗时 {self.last_run_ms}ms")
+        return {'closed_sessions': closed, 'rolled_up_messages': rolled_up, 'archived_messages': archived,
+                'elapsed_ms': self.last_run_ms}
+
+    def _repeat(self, task):
+        # 分批执行，每批一个短事务；批数达到上限或不足一批时结束
+        total = 0
+        for _ in range(self.max_batches):
+            done = task()
+            total += done
+            if done < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def close_idle_sessions(self):
+        """把空闲超过 CHAT_TIMEOUT 的活跃会话标记为 closed（一批），end_time 取最后一条消息的时间。"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.idle_timeout)
+        recent = exists().where(ChatMessage.user_id == ChatSession.user_id,
+                                ChatMessage.session_id == ChatSession.session_id,
+                                ChatMessage.timestamp >= cutoff)
+        idle = or_(ChatSession.updated_at < cutoff,
+                   and_(ChatSession.updated_at.is_(None), ChatSession.created_at < cutoff))
+        ids = db.session.execute(select(ChatSession.id).where(
+            ChatSession.status == 'active', idle, ~recent).limit(self.batch_size)).scalars().all()
+        if not ids:
+            return 0
+        last_message = select(func.max(ChatMessage.timestamp)).where(
+            ChatMessage.user_id == ChatSession.user_id,
+            ChatMessage.session_id == ChatSession.session_id).scalar_subquery()
+        # 条件中再次检查状态，期间被重新激活的会话不受影响
+        db.session.execute(update(ChatSession).where(ChatSession.id.in_(ids), ChatSession.status == 'active').values(
+            status='closed', end_time=func.coalesce(last_message, ChatSession.created_at),
+            **ChatSession.touch_values()).execution_options(synchronize_session=False))
+        db.session.commit()
+        return len(ids)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'interval': self.interval,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'closed_sessions': self.closed_sessions,
+            'archived_messages': self.archived_messages,
+            'rolled_up_messages': self.rolled_up_messages,
+            'errors': self.errors,
+            'last_run_ms': self.last_run_ms,
+        }
+
+
+# 创建全局实例
+maintenance = MaintenanceSweeper()
@@ -0,0 +1,360 @@
+#运行指标（直方图 / 计数器 / 组件统计，按 worker 写快照文件并在 /metrics 汇总为 Prometheus 文本格式）
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import fcntl
+import functools
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'flaskchat_'
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192)
+
+# name -> (类型, 说明, 桶)
+DEFINITIONS = {
+    'http_request_duration_seconds': ('histogram', 'HTTP 接口耗时', LATENCY_BUCKETS),
+    'http_request_db_queries': ('histogram', '每个 HTTP 请求执行的 SQL 条数', COUNT_BUCKETS),
+    'http_request_db_seconds': ('histogram', '每个 HTTP 请求的 SQL 总耗时', LATENCY_BUCKETS),
+    'db_query_duration_seconds': ('histogram', '单条 SQL 耗时', LATENCY_BUCKETS),
+    'socketio_event_duration_seconds': ('histogram', 'Socket.IO 事件处理耗时', LATENCY_BUCKETS),
+    'socketio_event_errors_total': ('counter', 'Socket.IO 事件处理异常数', None),
+    'llm_request_duration_seconds': ('histogram', '大模型调用总耗时', LATENCY_BUCKETS),
+    'llm_time_to_first_token_seconds': ('histogram', '大模型流式调用首字延迟', LATENCY_BUCKETS),
+    'llm_prompt_tokens': ('histogram', '每次调用的 prompt token 数', TOKEN_BUCKETS),
+    'llm_completion_tokens': ('histogram', '每次调用的 completion token 数', TOKEN_BUCKETS),
+    'llm_errors_total': ('counter', '大模型调用失败次数', None),
+    'search_query_duration_seconds': ('histogram', '全文检索查询耗时', LATENCY_BUCKETS),
+    'chat_batch_items_total': ('counter', '批量接口处理的提示条数（按结果状态）', None),
+    'db_routed_requests_total': ('counter', '只读接口的数据库路由（replica / 写后读主库的 primary）', None),
+    'rate_limit_rejected_total': ('counter', '因限流返回 429 的请求数', None),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metrics:
+    def __init__(self, snapshot_dir=None, snapshot_interval=5):
+        self.enabled = True
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [各桶计数..., +Inf 计数, 总和]
+        self._gauge_sources = {}  # 组件名 -> 返回统计字典的函数
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.snapshot_interval = app.config.get('METRICS_SNAPSHOT_INTERVAL', self.snapshot_interval)
+        self.snapshot_dir = app.config.get('METRICS_DIR') or os.path.join(app.instance_path, 'metrics')
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        _install_db_listeners(self)
+
+        @app.before_request
+        def _start_timer():
+            from flask import g
+            g.metrics_start = time.perf_counter()
+            g.db_queries = 0
+            g.db_seconds = 0.0
+
+        @app.after_request
+        def _record_request(response):
+            from flask import g, request
+            start = g.pop('metrics_start', None)
+            if start is None:
+                return response
+            elapsed = time.perf_counter() - start
+            # 只统计 API 蓝图，endpoint 作为标签，避免路径参数造成标签爆炸
+            if request.blueprint in ('auth', 'chat'):
+                labels = {'endpoint': request.endpoint, 'method': request.method,
+                          'status': response.status_code}
+                self.observe('http_request_duration_seconds', elapsed, **labels)
+                self.observe('http_request_db_queries', g.db_queries, endpoint=request.endpoint)
+                self.observe('http_request_db_seconds', g.db_seconds, endpoint=request.endpoint)
+            response.headers.setdefault(
+                'Server-Timing', f'db;dur={g.db_seconds * 1000:.1f};desc="{g.db_queries} queries", '
+                                 f'app;dur={elapsed * 1000:.1f}')
+            return response
+
+    def _ensure_worker(self):
+        # 快照线程按进程启动，fork 出的 worker 首次记录时各自启动
+        if self._worker_pid != os.getpid() and self.snapshot_dir:
+            self._worker_pid = os.getpid()
+            threading.Thread(target=self._run, name='metrics-snapshot', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.warning(f"写入指标快照失败: {str(e)}")
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._ensure_worker()
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        buckets = DEFINITIONS[name][2]
+        key = (name, _label_key(labels))
+        index = bisect_left(buckets, value)
+        with self._lock:
+            data = self._histograms.get(key)
+            if data is None:
+                data = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            data[index] += 1
+            data[-1] += value
+        self._ensure_worker()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed_event(self, event):
+        """Socket.IO 事件处理耗时装饰器，放在 @socketio.on 之下。"""
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = f(*args, **kwargs)
+                except TypeError:
+                    # connect 事件会先带 auth 参数试调一次，签名不符时 Flask-SocketIO 会重试，不计入
+                    raise
+                except Exception:
+                    self.inc('socketio_event_errors_total', event=event)
+                    raise
+                self.observe('socketio_event_duration_seconds', time.perf_counter() - start, event=event)
+                return result
+            return wrapper
+        return decorator
+
+    def register_stats(self, component, func):
+        """登记组件统计函数（返回字典），数值字段以 gauge 形式输出。"""
+        self._gauge_sources[component] = func
+
+    def _collect_gauges(self):
+        gauges = {}
+        for component, func in self._gauge_sources.items():
+            try:
+                stats = func()
+            except Exception as e:
+                logger.warning(f"读取 {component} 统计失败: {str(e)}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    gauges[f'{component}_{key}'] = value
+        return gauges
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, list(map(list, labels)), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(map(list, labels)), list(data)]
+                          for (name, labels), data in self._histograms.items()]
+        return {'pid': os.getpid(), 'time': time.time(), 'counters': counters,
+                'histograms': histograms, 'gauges': self._collect_gauges()}
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.snapshot_dir, f'worker-{pid}.json')
+
+    def write_snapshot(self):
+        path = self._snapshot_path(os.getpid())
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    def _read_snapshots(self):
+        """读取所有 worker 的快照；已退出 worker 的计数并入 retired.json，保证计数器单调递增。"""
+        own = self.snapshot()
+        snapshots = [own]
+        if not self.snapshot_dir:
+            return snapshots
+        self.write_snapshot()
+        retired_path = os.path.join(self.snapshot_dir, 'retired.json')
+        with open(os.path.join(self.snapshot_dir, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                retired = _load(retired_path) or {'counters': [], 'histograms': []}
+                changed = False
+                for name in os.listdir(self.snapshot_dir):
+                    if not (name.startswith('worker-') and name.endswith('.json')):
+                        continue
+                    pid = int(name[len('worker-'):-len('.json')])
+                    if pid == own['pid']:
+                        continue
+                    data = _load(os.path.join(self.snapshot_dir, name))
+                    if data is None:
+                        continue
+                    if _pid_alive(pid):
+                        snapshots.append(data)
+                    else:
+                        retired = _merge([retired, data])
+                        os.unlink(os.path.join(self.snapshot_dir, name))
+                        changed = True
+                if changed:
+                    with open(retired_path + '.tmp', 'w') as f:
+                        json.dump(retired, f, separators=(',', ':'))
+                    os.replace(retired_path + '.tmp', retired_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        snapshots.append(retired)
+        return snapshots
+
+    def render(self):
+        """汇总所有 worker 的数据，输出 Prometheus 文本格式。"""
+        snapshots = self._read_snapshots()
+        merged = _merge(snapshots)
+        lines = []
+        by_name = {}
+        for name, labels, value in merged['counters']:
+            by_name.setdefault(name, []).append(('counter', labels, value))
+        for name, labels, data in merged['histograms']:
+            by_name.setdefault(name, []).append(('histogram', labels, data))
+        for name in sorted(by_name):
+            kind, help_text, buckets = DEFINITIONS.get(name, ('counter', name, None))
+            full = PREFIX + name
+            lines.append(f'# HELP {full} {help_text}')
+            lines.append(f'# TYPE {full} {kind}')
+            for _, labels, value in by_name[name]:
+                labels = [tuple(item) for item in labels]
+                if kind == 'counter':
+                    lines.append(f'{full}{_format_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    lines.append(f'{full}_bucket{_format_labels(labels, {"le": bound})} {cumulative}')
+                cumulative += value[len(buckets)]
+                lines.append(f'{full}_bucket{_format_labels(labels, {"le": "+Inf"})} {cumulative}')
+                lines.append(f'{full}_sum{_format_labels(labels)} {value[-1]}')
+                lines.append(f'{full}_count{_format_labels(labels)} {cumulative}')
+        # 组件统计按 worker 输出，不做合并
+        gauge_names = sorted({key for snap in snapshots for key in snap.get('gauges', {})})
+        for key in gauge_names:
+            full = PREFIX + key
+            lines.append(f'# TYPE {full} gauge')
+            for snap in snapshots:
+                if key in snap.get('gauges', {}):
+                    lines.append(f'{full}{_format_labels([], {"worker": snap["pid"]})} {snap["gauges"][key]}')
+        return '\n'.join(lines) + '\n'
+
+
+def token_authorized(require=False):
+    """请求是否携带了正确的 METRICS_TOKEN（Bearer）。未配置 token 时：/metrics（require=False）不校验；
+    运维统计接口（require=True）只允许本机访问。"""
+    from flask import current_app, request
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    return not require or request.remote_addr in ('127.0.0.1', '::1')
+
+
+def ops_required(view):
+    """各组件的 /stats 接口含全局运行数据（服务商地址、队列、缓存等），与 /metrics 一样凭 METRICS_TOKEN 访问，
+    不对普通登录用户开放。"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not token_authorized(require=True):
+            from flask import jsonify
+            return jsonify({'error': '未授权'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(snapshots):
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap.get('counters', []):
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, data in snap.get('histograms', []):
+            key = (name, tuple(map(tuple, labels)))
+            current = histograms.get(key)
+            histograms[key] = list(data) if current is None else [a + b for a, b in zip(current, data)]
+    return {'counters': [[name, [list(item) for item in labels], value] for (name, labels), value in counters.items()],
+            'histograms': [[name, [list(item) for item in labels], data] for (name, labels), data in histograms.items()]}
+
+
+def _install_db_listeners(metrics):
+    from flask import g, has_app_context
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop('metrics_query_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        metrics.observe('db_query_duration_seconds', elapsed, statement=verb)
+        if has_app_context() and 'db_queries' in g:
+            g.db_queries += 1
+            g.db_seconds += elapsed
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_query_start'] = time.perf_counter()
+
+
+# 创建全局实例
+metrics = Metrics()
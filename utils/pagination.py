@@ -0,0 +1,28 @@
+#游标分页工具（(时间, id) 键集游标的编码与解码）
+
+from datetime import datetime
+import base64
+
+
+def encode_cursor(timestamp, row_id):
+    raw = f"{timestamp.isoformat() if timestamp else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (datetime, id)；格式不合法时抛出 ValueError。"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        timestamp, row_id = raw.rsplit('|', 1)
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(row_id)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def parse_limit(value, default, maximum):
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
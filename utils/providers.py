@@ -0,0 +1,414 @@
+#大模型服务商池（多个 OpenAI 兼容端点、独立连接池、按 EWMA 延迟与在途数路由、对冲请求、熔断）
+
+from collections import deque
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://qianfan.baidubce.com/v2"
+DEFAULT_MODEL = "ernie-4.0-turbo-8k"
+
+
+class ProviderUnavailable(Exception):
+    """所有服务商都处于熔断状态或已尝试失败。"""
+
+
+def is_retryable(error):
+    """连接失败、超时、429 与 5xx 视为服务商故障：计入熔断并切换到其他服务商；其余错误（如 400）直接抛出。"""
+    import openai  # 延迟导入，见 Provider.client
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (httpx.TransportError, ProviderUnavailable))
+
+
+class CircuitBreaker:
+    """连续失败 failure_threshold 次后熔断 cooldown 秒；冷却结束后放行一个试探请求，成功则恢复。"""
+
+    def __init__(self, failure_threshold=5, cooldown=30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def available(self):
+        """只读判断，不占用试探名额（路由打分时使用）。"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self._probing
+
+    def success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opens += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """试探请求以非故障错误结束（如 400 上下文超长、调用被取消）时归还试探名额，由下一个请求重新试探。"""
+        with self._lock:
+            self._probing = False
+
+
+class Provider:
+    def __init__(self, name, base_url, model, api_key=None, headers=None, weight=1.0, timeout=60,
+                 connect_timeout=5, max_connections=100, max_keepalive=20, keepalive_expiry=30,
+                 stream_usage=True, breaker=None, ewma_alpha=0.2, initial_latency=1.0):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.headers = headers or None
+        self.weight = weight
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.stream_usage = stream_usage
+        self.breaker = breaker or CircuitBreaker()
+        self.ewma_alpha = ewma_alpha
+        # 非流式看完整耗时，流式看首字延迟；没有样本时按 initial_latency 估计
+        self.ewma = {'complete': initial_latency, 'stream': initial_latency}
+        self._samples = {'complete': deque(maxlen=200), 'stream': deque(maxlen=200)}
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_pid = None
+        self._http_client = None
+        # 统计
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def client(self):
+        # HTTP 连接池按进程创建，preload_app 时不把 master 的连接带进 worker；
+        # openai（连同 pydantic 模型，导入约 300ms）也在首次使用时才导入，不计入应用启动时间
+        if self._client is None or self._client_pid != os.getpid():
+            from openai import OpenAI
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_keepalive,
+                                    keepalive_expiry=self.keepalive_expiry),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            )
+            self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, default_headers=self.headers,
+                                  http_client=http_client, max_retries=0)
+            self._http_client = http_client
+            self._client_pid = os.getpid()
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+        self._http_client = None
+        self._client_pid = os.getpid()
+
+    def warm_up(self, connect=True):
+        """创建本进程的客户端；connect 时向 base_url 发一个 HEAD 请求，提前完成 TCP / TLS 握手并留在连接池中。"""
+        self.client
+        if connect and self._http_client is not None:
+            try:
+                self._http_client.head(self.base_url, timeout=self.connect_timeout)
+            except httpx.HTTPError as e:
+                logger.warning(f"服务商 {self.name} 预热连接失败: {str(e)}")
+                return False
+        return True
+
+    def score(self, kind):
+        return self.ewma[kind] * (self.in_flight + 1) / self.weight
+
+    def percentile(self, kind, q):
+        samples = sorted(self._samples[kind])
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+
+    def end(self, kind, elapsed=None, error=None):
+        with self._lock:
+            self.in_flight -= 1
+            if elapsed is not None:
+                self.ewma[kind] += self.ewma_alpha * (elapsed - self.ewma[kind])
+                self._samples[kind].append(elapsed)
+            if error is not None:
+                self.errors += 1
+        if error is None:
+            self.breaker.success()
+        elif is_retryable(error):
+            self.breaker.failure()
+        else:
+            self.breaker.release()
+
+    def stats(self):
+        p95 = self.percentile('complete', 0.95)
+        ttft_p95 = self.percentile('stream', 0.95)
+        return {
+            'name': self.name,
+            'model': self.model,
+            'base_url': self.base_url,
+            'state': self.breaker.state,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'errors': self.errors,
+            'breaker_opens': self.breaker.opens,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'ewma_latency_ms': round(self.ewma['complete'] * 1000, 1),
+            'ewma_ttft_ms': round(self.ewma['stream'] * 1000, 1),
+            'latency_p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            'ttft_p95_ms': round(ttft_p95 * 1000, 1) if ttft_p95 is not None else None,
+        }
+
+
+class OpenStream:
+    """已收到首个增量的流式响应：buffered 为已读出的分块，之后从 chunks 继续读取。"""
+
+    def __init__(self, stream, buffered, chunks):
+        self.stream = stream
+        self.buffered = buffered
+        self.chunks = chunks
+
+    def __iter__(self):
+        return itertools.chain(self.buffered, self.chunks)
+
+    def close(self):
+        self.stream.close()
+
+
+class _Race:
+    """一次（可能带对冲的）调用，第一个成功的结果胜出，其余结果由 discard 回收。"""
+
+    def __init__(self, discard=None):
+        self.results = queue.Queue()
+        self.discard = discard
+        self.done = False
+        self.lock = threading.Lock()
+
+    def finish(self, result):
+        with self.lock:
+            if not self.done:
+                self.results.put(result)
+                return
+        # 已有胜者，晚到的成功结果直接回收（如关闭流式连接）
+        if result[2] is None and self.discard is not None:
+            self.discard(result[1])
+
+    def settle(self):
+        with self.lock:
+            self.done = True
+        while True:
+            try:
+                item = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if item[2] is None and self.discard is not None:
+                self.discard(item[1])
+
+
+def _default_providers():
+    return [{'name': 'qianfan', 'base_url': os.environ.get('QIANFAN_BASE_URL', DEFAULT_BASE_URL),
+             'model': os.environ.get('QIANFAN_MODEL', DEFAULT_MODEL), 'api_key_env': 'QIANFAN_API_KEY',
+             'headers': {'appid': os.environ['QIANFAN_APPID']} if os.environ.get('QIANFAN_APPID') else None}]
+
+
+def load_provider_config(value):
+    """LLM_PROVIDERS 可以是 JSON 数组，也可以是 JSON 文件路径；为空时使用 QIANFAN_* 环境变量。"""
+    if not value:
+        return _default_providers()
+    if value.lstrip().startswith('['):
+        return json.loads(value)
+    with open(value, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ProviderPool:
+    def __init__(self):
+        self.hedge_percentile = 0.95
+        self.hedge_min_samples = 20
+        self.max_attempts = 2
+        self.providers = []
+        self.configure(_default_providers())
+
+    def init_app(self, app):
+        self.hedge_percentile = app.config.get('LLM_HEDGE_PERCENTILE', self.hedge_percentile)
+        self.hedge_min_samples = app.config.get('LLM_HEDGE_MIN_SAMPLES', self.hedge_min_samples)
+        self.max_attempts = app.config.get('LLM_MAX_ATTEMPTS', self.max_attempts)
+        self.configure(load_provider_config(app.config.get('LLM_PROVIDERS')),
+                       failure_threshold=app.config.get('LLM_BREAKER_FAILURES', 5),
+                       cooldown=app.config.get('LLM_BREAKER_COOLDOWN', 30),
+                       ewma_alpha=app.config.get('LLM_ROUTING_EWMA_ALPHA', 0.2))
+        app.extensions['provider_pool'] = self
+
+    def configure(self, items, failure_threshold=5, cooldown=30, ewma_alpha=0.2):
+        providers = []
+        for index, item in enumerate(items):
+            item = dict(item)
+            api_key_env = item.pop('api_key_env', None)
+            api_key = item.pop('api_key', None) or (os.environ.get(api_key_env) if api_key_env else None)
+            providers.append(Provider(
+                name=item.pop('name', f'provider{index}'), api_key=api_key or 'unset',
+                breaker=CircuitBreaker(failure_threshold, cooldown), ewma_alpha=ewma_alpha, **item))
+        self.providers = providers
+
+    @property
+    def cache_namespace(self):
+        """回复缓存键使用的模型标识：配置的模型集合变化时缓存自然失效。"""
+        return '|'.join(sorted({p.model for p in self.providers}))
+
+    def choose(self, kind, exclude=()):
+        """选出得分（EWMA 延迟 × (在途数 + 1) / 权重）最低且未熔断的服务商。"""
+        candidates = [p for p in self.providers if p not in exclude and p.breaker.available()]
+        for provider in sorted(candidates, key=lambda p: p.score(kind)):
+            if provider.breaker.allow():
+                return provider
+        return None
+
+    def _hedge_delay(self, provider, kind):
+        if not self.hedge_percentile or len(self.providers) < 2:
+            return None
+        if len(provider._samples[kind]) < self.hedge_min_samples:
+            return None
+        return provider.percentile(kind, self.hedge_percentile)
+
+    def _call(self, provider, kind, start_fn, race):
+        provider.begin()
+        started = time.perf_counter()
+        try:
+            result = start_fn(provider)
+        except BaseException as e:
+            # 包括 GreenletExit 等非 Exception 异常，保证在途数与试探名额都被归还
+            provider.end(kind, error=e)
+            race.finish((provider, None, e))
+            if not isinstance(e, Exception):
+                raise
+            return
+        provider.end(kind, time.perf_counter() - started)
+        race.finish((provider, result, None))
+
+    def run(self, kind, start_fn, discard=None):
+        """调用 start_fn(provider) 并返回 (provider, 结果)。
+
+        超过主服务商 hedge_percentile 分位延迟仍未返回时，向另一个服务商发出对冲请求，先成功者胜出；
+        服务商故障时切换到下一个，最多尝试 max_attempts 个服务商。
+        """
+        tried, last_error = [], None
+        while len(tried) < self.max_attempts:
+            provider = self.choose(kind, exclude=tried)
+            if provider is None:
+                break
+            tried.append(provider)
+            race = _Race(discard)
+            hedge_delay = self._hedge_delay(provider, kind)
+            if hedge_delay is None:
+                # 不需要对冲时在当前线程直接调用
+                self._call(provider, kind, start_fn, race)
+                outstanding = 1
+                item = race.results.get_nowait()
+            else:
+                threading.Thread(target=self._call, args=(provider, kind, start_fn, race), daemon=True).start()
+                outstanding = 1
+                try:
+                    item = race.results.get(timeout=hedge_delay)
+                except queue.Empty:
+                    backup = self.choose(kind, exclude=tried)
+                    if backup is not None:
+                        tried.append(backup)
+                        backup.hedges += 1
+                        outstanding += 1
+                        logger.info(f"{provider.name} 超过 {hedge_delay * 1000:.0f}ms 未返回，对冲请求 {backup.name}")
+                        threading.Thread(target=self._call, args=(backup, kind, start_fn, race), daemon=True).start()
+                    item = race.results.get()
+            outstanding -= 1
+            while item[2] is not None and outstanding:
+                item = race.results.get()
+                outstanding -= 1
+            race.settle()
+            winner, result, error = item
+            if error is None:
+                if winner is not provider:
+                    winner.hedge_wins += 1
+                return winner, result
+            last_error = error
+            if not is_retryable(error):
+                raise error
+            logger.warning(f"服务商 {winner.name} 调用失败，尝试切换: {str(error)}")
+        if last_error is not None:
+            raise last_error
+        raise ProviderUnavailable('没有可用的大模型服务商')
+
+    def complete(self, messages):
+        def start(provider):
+            return provider.client.chat.completions.create(model=provider.model, messages=messages)
+        return self.run('complete', start)
+
+    def open_stream(self, messages):
+        """打开流式响应并读到第一个增量为止（首字延迟参与路由与对冲），返回 (provider, OpenStream)。"""
+        def start(provider):
+            kwargs = {'stream_options': {'include_usage': True}} if provider.stream_usage else {}
+            stream = provider.client.chat.completions.create(model=provider.model, messages=messages,
+                                                             stream=True, **kwargs)
+            chunks, buffered = iter(stream), []
+            try:
+                for chunk in chunks:
+                    buffered.append(chunk)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        break
+            except BaseException:
+                stream.close()
+                raise
+            return OpenStream(stream, buffered, chunks)
+        return self.run('stream', start, discard=lambda opened: opened.close())
+
+    def warm_up(self, connect=True):
+        """为本进程创建各服务商的客户端并预先建立连接（gunicorn worker 启动后调用），返回成功的个数。"""
+        return sum(1 for provider in self.providers if provider.warm_up(connect))
+
+    def stats(self):
+        return {'providers': [p.stats() for p in self.providers]}
+
+
+# 创建全局实例
+provider_pool = ProviderPool()
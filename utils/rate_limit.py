@@ -0,0 +1,251 @@
+#按用户 / IP 的令牌桶限流（请求数与大模型 token 用量），桶状态保存在 mmap 共享文件中，所有 gunicorn worker 共用
+
+from functools import wraps
+from flask import g, request, jsonify
+from flask_login import current_user
+from utils.metrics import metrics
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 每个槽位：键哈希（0 表示空槽）、剩余令牌、上次更新时间
+_SLOT = struct.Struct('<Qdd')
+_PROBES = 8  # 哈希冲突时最多向后探测的槽位数
+
+
+def parse_rate(value):
+    """"20/60" -> (容量 20, 每秒补充 20/60)；为空或容量为 0 时返回 None（不限制）。"""
+    if not value:
+        return None
+    count, _, seconds = str(value).partition('/')
+    count, seconds = float(count), float(seconds or 1)
+    if count <= 0 or seconds <= 0:
+        return None
+    return count, count / seconds
+
+
+class Decision:
+    """一次检查的结果；用于生成 RateLimit-* 响应头。"""
+    __slots__ = ('allowed', 'limit', 'remaining', 'reset', 'retry_after', 'policy')
+
+    def __init__(self, allowed, limit, remaining, reset, retry_after, policy):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+        self.policy = policy
+
+
+class SharedTokenBuckets:
+    """mmap 文件中的定长哈希表。每次操作只对一个槽位加 fcntl 记录锁，一次检查是几次系统调用的开销。"""
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self._map = None
+        self._fd = None
+        self._pid = None
+
+    def _open(self):
+        # 按进程打开，fork 出的 worker 各自映射同一个文件
+        if self._map is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            size = self.slots * _SLOT.size
+            if os.fstat(fd).st_size != size:
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size != size:
+                        os.ftruncate(fd, 0)
+                        os.ftruncate(fd, size)
+                finally:
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+            self._fd, self._map, self._pid = fd, mmap.mmap(fd, size), os.getpid()
+        return self._fd, self._map
+
+    @staticmethod
+    def key_hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') | 1
+
+    def update(self, key, capacity, rate, cost, floor=0.0):
+        """补充令牌后尝试扣除 cost：余量不足时不扣除并返回 (False, 余量)；
+        cost 为 0 时只检查余量是否为正。floor < 0 时直接扣除（允许欠账到 floor），用于事后计费。"""
+        fd, shared = self._open()
+        now = time.time()
+        wanted = self.key_hash(key)
+        start = wanted % self.slots
+        victim, victim_time = None, None
+        for probe in range(_PROBES):
+            index = (start + probe) % self.slots
+            offset = index * _SLOT.size
+            fcntl.lockf(fd, fcntl.LOCK_EX, _SLOT.size, offset)
+            try:
+                owner, tokens, updated = _SLOT.unpack_from(shared, offset)
+                if owner == wanted or owner == 0:
+                    if owner == 0:
+                        tokens, updated = capacity, now
+                    return self._apply(shared, offset, wanted, tokens, updated, now, capacity, rate, cost, floor)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, _SLOT.size, offset)
+            if victim is None or updated < victim_time:
+                victim, victim_time = offset, updated
+        # 探测范围已满：占用其中最久未更新的槽位（空闲超过 容量/速率 的桶本来就已补满，覆盖不影响结果）
+        fcntl.lockf(fd, fcntl.LOCK_EX, _SLOT.size, victim)
+        try:
+            return self._apply(shared, victim, wanted, capacity, now, now, capacity, rate, cost, floor)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, _SLOT.size, victim)
+
+    @staticmethod
+    def _apply(shared, offset, owner, tokens, updated, now, capacity, rate, cost, floor):
+        tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+        if floor < 0:
+            tokens = max(floor, tokens - cost)
+            allowed = True
+        elif cost == 0:
+            allowed = tokens > 0
+        else:
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+        _SLOT.pack_into(shared, offset, owner, tokens, now)
+        return allowed, tokens
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = True
+        self.buckets = None
+        # 名称 -> (容量, 每秒补充量)；None 表示不限制
+        self.policies = {}
+        self.policy_header = ''
+        self._lock = threading.Lock()
+        # 统计（本进程）
+        self.checks = 0
+        self.rejected = 0
+        self.charged_tokens = 0
+        self._check_seconds = 0.0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', self.enabled)
+        path = app.config.get('RATE_LIMIT_PATH') or os.path.join(app.instance_path, 'rate_limit.bin')
+        self.buckets = SharedTokenBuckets(path, app.config.get('RATE_LIMIT_SLOTS', 65536))
+        self.policies = {
+            'user_requests': parse_rate(app.config.get('RATE_LIMIT_USER_REQUESTS')),
+            'ip_requests': parse_rate(app.config.get('RATE_LIMIT_IP_REQUESTS')),
+            'user_tokens': parse_rate(app.config.get('RATE_LIMIT_USER_TOKENS')),
+            'ip_tokens': parse_rate(app.config.get('RATE_LIMIT_IP_TOKENS')),
+        }
+        # RateLimit-Policy: 20;w=60;name="user_requests", ...（w 为整桶补满所需的秒数）
+        self.policy_header = ', '.join(f'{int(capacity)};w={round(capacity / rate)};name="{name}"'
+                                       for name, (capacity, rate) in self._active())
+        app.extensions['rate_limiter'] = self
+
+        @app.after_request
+        def _rate_limit_headers(response):
+            decision = g.pop('rate_limit', None)
+            if decision is not None:
+                response.headers['RateLimit-Limit'] = str(decision.limit)
+                response.headers['RateLimit-Remaining'] = str(decision.remaining)
+                response.headers['RateLimit-Reset'] = str(decision.reset)
+                response.headers['RateLimit-Policy'] = decision.policy
+                if not decision.allowed:
+                    response.headers['Retry-After'] = str(decision.retry_after)
+            return response
+
+    def _active(self):
+        return [(name, policy) for name, policy in self.policies.items() if policy is not None]
+
+    def _buckets(self, user_id, ip, kind):
+        # 产出 (容量, 每秒补充量, 共享桶键)，未配置的策略跳过
+        for scope, ident in (('user', user_id), ('ip', ip)):
+            policy = self.policies.get(f'{scope}_{kind}')
+            if policy is not None:
+                yield policy[0], policy[1], f'{scope}:{kind}:{ident}'
+
+    def check(self, user_id, ip, cost=1):
+        """请求进入时调用：扣除请求桶的 cost 个令牌，并要求 token 桶没有欠账。
+
+        返回最紧张的那个桶对应的 Decision。被拒绝时已扣除的请求令牌不退还（拒绝本身也计入频率）。
+        """
+        start = time.perf_counter()
+        tightest, rejected = None, None
+        for kind, amount in (('requests', cost), ('tokens', 0)):
+            for capacity, rate, key in self._buckets(user_id, ip, kind):
+                allowed, tokens = self.buckets.update(key, capacity, rate, amount)
+                needed = max(amount, 1) - tokens
+                decision = Decision(allowed, max(1, int(capacity)), max(0, math.floor(tokens)),
+                                    math.ceil((capacity - tokens) / rate),
+                                    math.ceil(needed / rate) if needed > 0 else 0, self.policy_header)
+                if not allowed and (rejected is None or decision.retry_after > rejected.retry_after):
+                    rejected = decision
+                if tightest is None or decision.remaining / decision.limit < tightest.remaining / tightest.limit:
+                    tightest = decision
+        with self._lock:
+            self.checks += 1
+            self._check_seconds += time.perf_counter() - start
+            if rejected is not None:
+                self.rejected += 1
+        return rejected or tightest
+
+    def charge(self, user_id, ip, usage):
+        """调用结束后按实际用量扣除 token 桶（允许欠账，欠账期间新的请求会被拒绝）。"""
+        if not usage:
+            return
+        tokens = (usage.get('prompt_tokens') or 0) + (usage.get('completion_tokens') or 0)
+        if tokens <= 0:
+            return
+        for capacity, rate, key in self._buckets(user_id, ip, 'tokens'):
+            self.buckets.update(key, capacity, rate, tokens, floor=-capacity)
+        with self._lock:
+            self.charged_tokens += tokens
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'checks': self.checks,
+            'rejected': self.rejected,
+            'charged_tokens': self.charged_tokens,
+            'avg_check_us': round(self._check_seconds / self.checks * 1e6, 1) if self.checks else None,
+        }
+
+
+def rate_limited(view=None, cost=None):
+    """对已登录用户按用户与客户端 IP 限流（放在 login_required 之下），超限时返回 429 与 Retry-After。
+
+    cost 为按当前请求计算所需请求令牌数的函数（如 /batch 按条目数计），默认每个请求 1 个。
+    客户端 IP 取 request.remote_addr，部署在反向代理之后时需配置 PROXY_FIX_X_FOR。
+    """
+    if view is None:
+        return lambda func: rate_limited(func, cost)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not rate_limiter.enabled:
+            return view(*args, **kwargs)
+        amount = max(1, cost()) if cost is not None else 1
+        decision = rate_limiter.check(current_user.id, request.remote_addr, amount)
+        if decision is None:
+            return view(*args, **kwargs)
+        g.rate_limit = decision
+        if not decision.allowed:
+            metrics.inc('rate_limit_rejected_total', endpoint=request.endpoint)
+            if amount > decision.limit:
+                # 一次所需的令牌超过桶容量，等待多久都不会放行
+                return jsonify({'error': f'单次请求最多消耗 {decision.limit} 次额度，请拆分后重试'}), 400
+            return jsonify({'error': '请求过于频繁，请稍后重试', 'retry_after': decision.retry_after}), 429
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# 创建全局实例
+rate_limiter = RateLimiter()
@@ -0,0 +1,217 @@
+#AI回复缓存（精确匹配、进程内 LRU + 跨 worker 共享的 SQLite 层、TTL 过期、并发请求合并）
+
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _blocking(fn, *args):
+    # 共享层的 sqlite 调用会阻塞（库被锁时最多等待 timeout 秒）；eventlet 下放到 tpool 的系统线程中执行，
+    # 当前 greenlet 让出，不阻塞事件循环。sqlite3 连接为串行化模式，可在多个线程间共用
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher, tpool
+        if patcher.is_monkey_patched('thread'):
+            return tpool.execute(fn, *args)
+    return fn(*args)
+
+
+class _Pending:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1000, ttl=3600, shared_path=None, shared_max_entries=20000):
+        self.enabled = True
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared_path = shared_path
+        self.shared_max_entries = shared_max_entries
+        self._local = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()  # 只保护进程内层与计数，不在持有期间访问共享层
+        self._open_lock = threading.Lock()
+        self._inflight = {}
+        self._conn = None
+        self._conn_pid = None
+        self._sets = 0
+        # 统计
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', self.enabled)
+        self.max_entries = app.config.get('RESPONSE_CACHE_MAX_ENTRIES', self.max_entries)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        self.shared_max_entries = app.config.get('RESPONSE_CACHE_SHARED_MAX_ENTRIES', self.shared_max_entries)
+        self.shared_path = app.config.get('RESPONSE_CACHE_SHARED_PATH') or os.path.join(
+            app.instance_path, 'response_cache.db')
+        app.extensions['response_cache'] = self
+
+    @staticmethod
+    def make_key(messages, model):
+        """按规范化后的消息列表（角色 + 去除多余空白的内容）和模型名生成缓存键。"""
+        normalized = [[m.get('role'), _WHITESPACE.sub(' ', (m.get('content') or '').strip())]
+                      for m in messages]
+        raw = json.dumps([model, normalized], ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _shared(self):
+        """共享层连接按进程懒加载，fork 后在子进程中重新打开。"""
+        if self.shared_path is None:
+            return None
+        if self._conn is None or self._conn_pid != os.getpid():
+            # 单独的锁，首次建表期间不影响进程内层的查找
+            with self._open_lock:
+                if self._conn is None or self._conn_pid != os.getpid():
+                    self._conn = _blocking(self._open_shared)
+                    self._conn_pid = os.getpid()
+        return self._conn
+
+    def _open_shared(self):
+        os.makedirs(os.path.dirname(self.shared_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.shared_path, timeout=1, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS response_cache ('
+                     'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                     'expires_at REAL NOT NULL, last_access REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_last_access '
+                     'ON response_cache (last_access)')
+        return conn
+
+    def _local_put(self, key, value, expires_at):
+        self._local[key] = (value, expires_at)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        # 锁只保护进程内的 OrderedDict 与计数，共享层的读写在锁外进行
+        with self._lock:
+            item = self._local.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._local.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+                del self._local[key]
+        row = None
+        try:
+            conn = self._shared()
+            if conn is not None:
+                row = _blocking(self._shared_get, conn, key, now)
+        except sqlite3.Error as e:
+            logger.warning(f"共享缓存读取失败: {str(e)}")
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self._local_put(key, row[0], row[1])
+            self.hits += 1
+            self.shared_hits += 1
+            return row[0]
+
+    def _shared_get(self, conn, key, now):
+        row = conn.execute('SELECT value, expires_at, last_access FROM response_cache '
+                           'WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        # 近似 LRU：访问时间变化较大时才回写，避免每次命中都写库
+        if now - row[2] > self.ttl / 10:
+            conn.execute('UPDATE response_cache SET last_access = ? WHERE key = ?', (now, key))
+        return row
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._local_put(key, value, expires_at)
+            self._sets += 1
+            evict = self._sets % 100 == 0
+        try:
+            conn = self._shared()
+            if conn is not None:
+                _blocking(self._shared_set, conn, key, value, expires_at, now, evict)
+        except sqlite3.Error as e:
+            logger.warning(f"共享缓存写入失败: {str(e)}")
+
+    def _shared_set(self, conn, key, value, expires_at, now, evict):
+        conn.execute('INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_access) '
+                     'VALUES (?, ?, ?, ?)', (key, value, expires_at, now))
+        if evict:
+            self._evict_shared(conn, now)
+
+    def _evict_shared(self, conn, now):
+        conn.execute('DELETE FROM response_cache WHERE expires_at <= ?', (now,))
+        conn.execute('DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache '
+                     'ORDER BY last_access DESC LIMIT -1 OFFSET ?)', (self.shared_max_entries,))
+
+    def get_or_compute(self, key, compute):
+        """命中直接返回；未命中时同一进程内相同 key 的并发请求只调用一次 compute。"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            pending = self._inflight.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[key] = _Pending()
+            else:
+                self.coalesced += 1
+        if not leader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+        try:
+            pending.value = compute()
+            self.set(key, pending.value)
+            return pending.value
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.event.set()
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        conn = self._shared()
+        if conn is not None:
+            _blocking(conn.execute, 'DELETE FROM response_cache')
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'local_entries': len(self._local),
+        }
+
+
+# 创建全局实例
+response_cache = ResponseCache()
@@ -0,0 +1,165 @@
+#大模型调用调度器（全局/单用户并发上限、有界等待队列、用户间轮转公平、排队统计）
+
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import threading
+import time
+
+
+class SchedulerBusy(Exception):
+    """等待队列已满或排队超时，调用方应快速返回 429。"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'event', 'granted', 'enqueued_at')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency=32, max_per_user=2, max_queue=200, queue_timeout=20):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._user_in_flight = {}
+        # user_id -> 该用户的等待者队列；OrderedDict 的顺序即轮转顺序
+        self._queues = OrderedDict()
+        self._queued = 0
+        # 统计
+        self._wait_samples = deque(maxlen=1000)
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def init_app(self, app):
+        self.max_concurrency = app.config.get('LLM_MAX_CONCURRENCY', self.max_concurrency)
+        self.max_per_user = app.config.get('LLM_MAX_PER_USER', self.max_per_user)
+        self.max_queue = app.config.get('LLM_MAX_QUEUE', self.max_queue)
+        self.queue_timeout = app.config.get('LLM_QUEUE_TIMEOUT', self.queue_timeout)
+        app.extensions['llm_scheduler'] = self
+
+    def _can_run(self, user_id):
+        return (self._in_flight < self.max_concurrency
+                and self._user_in_flight.get(user_id, 0) < self.max_per_user)
+
+    def _grant(self, user_id):
+        self._in_flight += 1
+        self._user_in_flight[user_id] = self._user_in_flight.get(user_id, 0) + 1
+
+    def _dispatch(self):
+        """在持锁状态下按用户轮转唤醒等待者，直到没有可运行的为止。"""
+        progressed = True
+        while progressed and self._queued and self._in_flight < self.max_concurrency:
+            progressed = False
+            for user_id in list(self._queues):
+                if self._in_flight >= self.max_concurrency:
+                    break
+                if not self._can_run(user_id):
+                    continue
+                queue = self._queues[user_id]
+                waiter = queue.popleft()
+                self._queued -= 1
+                if queue:
+                    # 轮转：本轮已服务的用户移到末尾
+                    self._queues.move_to_end(user_id)
+                else:
+                    del self._queues[user_id]
+                self._grant(user_id)
+                waiter.granted = True
+                waiter.event.set()
+                progressed = True
+
+    def acquire(self, user_id, timeout=None):
+        """获取一个调用名额，返回排队等待秒数；队列满或超时抛出 SchedulerBusy。"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._lock:
+            # 有空闲名额且该用户没有排队中的请求时直接放行（其余等待者必然受单用户上限阻塞）
+            if user_id not in self._queues and self._can_run(user_id):
+                self._grant(user_id)
+                self.admitted += 1
+                self._wait_samples.append(0.0)
+                return 0.0
+            if self._queued >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerBusy('queue_full')
+            waiter = _Waiter(user_id)
+            self._queues.setdefault(user_id, deque()).append(waiter)
+            self._queued += 1
+            self._dispatch()
+
+        waiter.event.wait(timeout)
+        with self._lock:
+            if not waiter.granted:
+                # 超时：从队列中移除自己
+                queue = self._queues.get(user_id)
+                if queue is not None:
+                    queue.remove(waiter)
+                    self._queued -= 1
+                    if not queue:
+                        del self._queues[user_id]
+                self.timed_out += 1
+                raise SchedulerBusy('queue_timeout')
+            waited = time.monotonic() - waiter.enqueued_at
+            self.admitted += 1
+            self._wait_samples.append(waited)
+            return waited
+
+    def release(self, user_id):
+        with self._lock:
+            self._in_flight -= 1
+            count = self._user_in_flight.get(user_id, 0) - 1
+            if count > 0:
+                self._user_in_flight[user_id] = count
+            else:
+                self._user_in_flight.pop(user_id, None)
+            self._dispatch()
+
+    def is_saturated(self):
+        """等待队列已满，新请求会被立即拒绝。"""
+        return self._queued >= self.max_queue
+
+    @contextmanager
+    def slot(self, user_id, timeout=None):
+        self.acquire(user_id, timeout)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._wait_samples)
+            result = {
+                'in_flight': self._in_flight,
+                'queue_depth': self._queued,
+                'queued_users': len(self._queues),
+                'max_concurrency': self.max_concurrency,
+                'max_per_user': self.max_per_user,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'wait_ms_avg': None,
+                'wait_ms_p95': None,
+                'wait_ms_max': None,
+            }
+        if samples:
+            result['wait_ms_avg'] = round(sum(samples) / len(samples) * 1000, 1)
+            result['wait_ms_p95'] = round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1)
+            result['wait_ms_max'] = round(samples[-1] * 1000, 1)
+        return result
+
+
+# 创建全局实例
+llm_scheduler = LLMScheduler()
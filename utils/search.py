@@ -0,0 +1,320 @@
+#聊天记录全文检索（SQLite FTS5 + 中日韩文本二元分词 / MySQL ngram 全文索引）
+"""
+SQLite：chat_message_fts 虚拟表的 rowid 与 chat_message.id 一致，入库文本由 tokenize() 预先切分：
+中日韩连续字符切成重叠的二元组（"今天天气" -> 今天 天天 天气）并在末尾追加最后一个单字，其余文字按词切分并转小写。
+查询按同样规则切分，多字片段作为短语匹配（相邻二元组等价于子串匹配），单字用前缀匹配（建有单字前缀索引）。
+owner 列保存 "u<user_id>"，检索时与关键词一起在索引内求交，不需要扫描其他用户的记录。
+索引表为无内容表，ChatMessage 的插入/修改/删除在 ORM flush 时于同一事务内同步到索引。
+
+MySQL：chat_message(message, response) 上建 FULLTEXT ... WITH PARSER ngram 索引，由数据库自行维护。
+
+重建：flask --app app search-rebuild
+"""
+from sqlalchemy import bindparam, event, inspect, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from models import db
+from models.chat import ChatMessage
+from utils.metrics import metrics
+from collections import deque
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'chat_message_fts'
+INDEXED_FIELDS = ('user_id', 'message', 'response')
+MYSQL_INDEX = 'ix_chat_message_fulltext'
+# 数据库方言 -> 检索后端
+BACKENDS = {'sqlite': 'fts5', 'mysql': 'mysql', 'mariadb': 'mysql'}
+
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'([{_CJK}]+)|[^\\W_{_CJK}]+')
+
+
+def tokenize(text):
+    """把文本切分为空格分隔的索引词。"""
+    if not text:
+        return ''
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        run = match.group(0)
+        if match.group(1) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            # 每个字要么是某个二元组的首字，要么是片段末字，单字查询用前缀匹配即可全部覆盖
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return ' '.join(tokens)
+
+
+def query_terms(query):
+    """把查询切分为检索片段，返回 [(片段, 是否中日韩)]。"""
+    return [(match.group(0), bool(match.group(1))) for match in _TOKEN_RE.finditer((query or '').lower())]
+
+
+def match_expression(user_id, terms):
+    """生成 FTS5 MATCH 表达式：所有片段都需出现在 message 或 response 中。"""
+    phrases = []
+    for run, is_cjk in terms:
+        if is_cjk and len(run) > 1:
+            phrases.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+        elif is_cjk:
+            phrases.append(f'"{run}"*')
+        else:
+            phrases.append(f'"{run}"')
+    return f'owner:"u{int(user_id)}" AND {{message response}} : ({" AND ".join(phrases)})'
+
+
+def boolean_query(terms):
+    """MySQL BOOLEAN MODE 查询串：每个片段作为必须出现的短语。"""
+    return ' '.join(f'+"{run}"' for run, _ in terms)
+
+
+def snippet(text, terms, width=40):
+    """截取首个命中片段附近的原文，找不到时返回开头部分。"""
+    if not text:
+        return ''
+    lowered = text.lower()
+    positions = [pos for pos in (lowered.find(run) for run, _ in terms) if pos >= 0]
+    start = max(0, min(positions) - width // 2) if positions else 0
+    end = start + width * 2
+    return ('…' if start else '') + text[start:end] + ('…' if end < len(text) else '')
+
+
+FIELD_WEIGHTS = (('message', 2.0), ('response', 1.0))
+
+
+def _score(row, terms, avg_lengths, k1=1.2, b=0.75):
+    #BM25 形式的词频饱和与长度归一化（平均长度取自候选集），各字段加权求和
+    score = 0.0
+    for field, weight in FIELD_WEIGHTS:
+        text_value = (getattr(row, field) or '').lower()
+        if not text_value:
+            continue
+        norm = k1 * (1 - b + b * len(text_value) / avg_lengths[field])
+        for run, _ in terms:
+            tf = text_value.count(run)
+            if tf:
+                score += weight * tf * (k1 + 1) / (tf + norm)
+    return round(score, 4)
+
+
+class SearchIndex:
+    def __init__(self):
+        self.enabled = True
+        self.backend = None  # 'fts5' / 'mysql' / None（不支持）
+        self.rebuild_batch_size = 5000
+        self.max_candidates = 500
+        self.indexed = 0
+        self.queries = 0
+        self._latency_samples = deque(maxlen=1000)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SEARCH_ENABLED', self.enabled)
+        self.rebuild_batch_size = app.config.get('SEARCH_REBUILD_BATCH_SIZE', self.rebuild_batch_size)
+        self.max_candidates = app.config.get('SEARCH_MAX_CANDIDATES', self.max_candidates)
+        app.extensions['search_index'] = self
+        if self.enabled:
+            # 索引结构由迁移脚本创建（migrations/versions），启动时只按方言确定后端，不连接数据库
+            dialect = make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+            self.backend = BACKENDS.get(dialect)
+            if self.backend is None:
+                logger.warning(f"数据库 {dialect} 不支持全文检索，/api/chat/search 不可用")
+            event.listen(Session, 'before_flush', self._remove_stale)
+            event.listen(Session, 'after_flush', self._add_new)
+
+        @app.cli.command('search-rebuild')
+        def search_rebuild():
+            """重建聊天记录全文索引。"""
+            result = self.rebuild(progress=lambda done: print(f'已索引 {done} 条', flush=True))
+            print(result)
+
+    def ensure_schema(self, conn=None):
+        """确保索引结构存在（通常已由迁移创建，重建前调用）；新建时若已有历史消息，提示执行重建。"""
+        if not self.enabled:
+            return
+        if conn is None:
+            with db.engine.begin() as conn:
+                return self.ensure_schema(conn)
+        backend = BACKENDS.get(conn.dialect.name)
+        if backend == 'fts5':
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                                  {'name': FTS_TABLE}).first()
+            if not exists:
+                self._create_fts(conn)
+        elif backend == 'mysql':
+            exists = conn.execute(text(f"SHOW INDEX FROM chat_message WHERE Key_name = '{MYSQL_INDEX}'")).first()
+            if not exists:
+                # 建索引期间会回填已有数据
+                self._create_mysql_index(conn)
+            return
+        else:
+            return
+        if not exists and conn.execute(select(ChatMessage.id).limit(1)).first() is not None:
+            logger.warning("已创建全文索引，历史消息需执行 flask --app app search-rebuild 回填")
+
+    def _create_fts(self, conn, table=FTS_TABLE):
+        # 无内容表（content=''）只保存倒排索引，原文从 chat_message 读取，体积约为保存分词文本时的一半；
+        # prefix='1' 为单字建前缀索引，单字查询不必合并所有以该字开头的二元组
+        conn.execute(text(f"CREATE VIRTUAL TABLE {table} USING fts5(owner, message, response, "
+                          f"tokenize = 'unicode61', prefix = '1', content = '', columnsize = 0)"))
+
+    def _create_mysql_index(self, conn):
+        conn.execute(text(f"ALTER TABLE chat_message ADD FULLTEXT INDEX {MYSQL_INDEX} (message, response) "
+                          f"WITH PARSER ngram"))
+
+    @staticmethod
+    def _changed(session):
+        return [obj for obj in session.dirty if isinstance(obj, ChatMessage)
+                and any(inspect(obj).attrs[name].history.has_changes() for name in INDEXED_FIELDS)]
+
+    def _remove_stale(self, session, flush_context, instances):
+        #flush 前从索引中删除将被修改/删除的消息。无内容表删除时必须提供当初写入的分词结果，此时数据库中还是旧值
+        if self.backend != 'fts5':
+            return
+        changed = self._changed(session)
+        session.info['search_reindex'] = changed
+        stale = [obj.id for obj in changed] + [obj.id for obj in session.deleted if isinstance(obj, ChatMessage)]
+        if not stale:
+            return
+        conn = session.connection(bind_arguments={'mapper': ChatMessage.__mapper__})
+        rows = conn.execute(text("SELECT id, user_id, message, response FROM chat_message WHERE id IN :ids")
+                            .bindparams(bindparam('ids', expanding=True)), {'ids': stale}).all()
+        if rows:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, owner, message, response) "
+                              f"VALUES ('delete', :id, :owner, :message, :response)"),
+                         [self._row(*row) for row in rows])
+
+    def _add_new(self, session, flush_context):
+        #flush 后在同一事务内写入新增/修改的消息（session.new 此时仍为 flush 前的状态，id 已分配）
+        if self.backend != 'fts5':
+            return
+        objs = [obj for obj in session.new if isinstance(obj, ChatMessage)] + session.info.pop('search_reindex', [])
+        if not objs:
+            return
+        conn = session.connection(bind_arguments={'mapper': ChatMessage.__mapper__})
+        conn.execute(text(f"INSERT INTO {FTS_TABLE} (rowid, owner, message, response) "
+                          f"VALUES (:id, :owner, :message, :response)"),
+                     [self._row(obj.id, obj.user_id, obj.message, obj.response) for obj in objs])
+        self.indexed += len(objs)
+
+    @staticmethod
+    def _row(message_id, user_id, message, response):
+        return {'id': message_id, 'owner': f'u{user_id}', 'message': tokenize(message),
+                'response': tokenize(response)}
+
+    def rebuild(self, batch_size=None, progress=None):
+        """重建索引，返回 {'rows', 'elapsed_s'}。
+
+        SQLite 在影子表中按 id 分批回填（每批一个事务，不长时间阻塞写入），期间应用照常写旧索引；
+        最后在一个事务内补齐回填期间新增的消息并替换旧表。回填期间被修改/删除的旧消息可能需要再次重建。
+        """
+        self.ensure_schema()
+        batch_size = batch_size or self.rebuild_batch_size
+        start = time.perf_counter()
+        if self.backend == 'mysql':
+            with db.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE chat_message DROP INDEX {MYSQL_INDEX}"))
+                self._create_mysql_index(conn)
+            return {'rows': None, 'elapsed_s': round(time.perf_counter() - start, 2)}
+        if self.backend != 'fts5':
+            raise RuntimeError('当前数据库不支持全文检索')
+        shadow = f'{FTS_TABLE}_rebuild'
+        with db.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {shadow}"))
+            self._create_fts(conn, shadow)
+        last_id, done = 0, 0
+        while True:
+            with db.engine.begin() as conn:
+                copied = self._copy_batch(conn, shadow, last_id, batch_size)
+            if not copied:
+                break
+            last_id = copied[-1]['id']
+            done += len(copied)
+            if progress is not None:
+                progress(done)
+        with db.engine.begin() as conn:
+            while True:
+                copied = self._copy_batch(conn, shadow, last_id, batch_size)
+                if not copied:
+                    break
+                last_id = copied[-1]['id']
+                done += len(copied)
+            conn.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+            conn.execute(text(f"ALTER TABLE {shadow} RENAME TO {FTS_TABLE}"))
+        with db.engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"))
+        return {'rows': done, 'elapsed_s': round(time.perf_counter() - start, 2)}
+
+    def _copy_batch(self, conn, table, last_id, batch_size):
+        rows = [self._row(*row) for row in conn.execute(
+            text("SELECT id, user_id, message, response FROM chat_message WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {'last_id': last_id, 'limit': batch_size})]
+        if rows:
+            conn.execute(text(f"INSERT INTO {table} (rowid, owner, message, response) "
+                              f"VALUES (:id, :owner, :message, :response)"), rows)
+        return rows
+
+    def _candidates(self, user_id, terms, session_id=None):
+        #取最近的 max_candidates 条匹配记录（按 id 倒序，索引内即可完成，不依赖全表统计）
+        params = {'user_id': user_id, 'limit': self.max_candidates}
+        session_filter = ''
+        if session_id:
+            session_filter = ' AND m.session_id = :session_id'
+            params['session_id'] = session_id
+        if self.backend == 'fts5':
+            params['match'] = match_expression(user_id, terms)
+            sql = (f"SELECT m.id, m.message, m.response FROM {FTS_TABLE} "
+                   f"JOIN chat_message m ON m.id = {FTS_TABLE}.rowid "
+                   f"WHERE {FTS_TABLE} MATCH :match AND m.user_id = :user_id{session_filter} "
+                   f"ORDER BY {FTS_TABLE}.rowid DESC LIMIT :limit")
+        elif self.backend == 'mysql':
+            params['match'] = boolean_query(terms)
+            sql = ("SELECT m.id, m.message, m.response FROM chat_message m WHERE m.user_id = :user_id"
+                   f"{session_filter} AND MATCH(m.message, m.response) AGAINST (:match IN BOOLEAN MODE) "
+                   "ORDER BY m.id DESC LIMIT :limit")
+        else:
+            raise RuntimeError('当前数据库不支持全文检索')
+        return db.session.execute(text(sql), params).all()
+
+    def search(self, user_id, query, limit=20, offset=0, session_id=None):
+        """检索当前用户的消息，返回 ([(ChatMessage, score, terms)], has_more, truncated)。
+
+        在最近的 max_candidates 条匹配记录内按相关度排序（truncated 表示匹配数超过了该上限）。
+        FTS5 自带的 bm25() 每次查询都要统计各关键词在整个索引中的文档数，耗时随总数据量线性增长，
+        因此改为对候选集按词频、字段权重（message 高于 response）与长度归一化打分。
+        查询中没有可检索的文字时抛出 ValueError。
+        """
+        terms = query_terms(query)
+        if not terms:
+            raise ValueError('没有可检索的关键词')
+        start = time.perf_counter()
+        with metrics.timer('search_query_duration_seconds', backend=self.backend):
+            candidates = self._candidates(user_id, terms, session_id)
+            avg_lengths = {field: max(1.0, sum(len(getattr(row, field) or '') for row in candidates)
+                                      / max(1, len(candidates))) for field, _ in FIELD_WEIGHTS}
+            ranked = sorted(((_score(row, terms, avg_lengths), row.id) for row in candidates), reverse=True)
+            page = ranked[offset:offset + limit]
+            messages = {msg.id: msg for msg in ChatMessage.query.filter(
+                ChatMessage.id.in_([message_id for _, message_id in page]))} if page else {}
+        self.queries += 1
+        self._latency_samples.append((time.perf_counter() - start) * 1000)
+        hits = [(messages[message_id], score, terms) for score, message_id in page if message_id in messages]
+        return hits, offset + limit < len(ranked), len(candidates) >= self.max_candidates
+
+    def stats(self):
+        samples = sorted(self._latency_samples)
+        return {
+            'enabled': self.enabled,
+            'backend': self.backend,
+            'indexed': self.indexed,
+            'queries': self.queries,
+            'latency_ms_p50': round(samples[len(samples) // 2], 2) if samples else None,
+            'latency_ms_p95': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2) if samples else None,
+        }
+
+
+# 创建全局实例
+search_index = SearchIndex()
@@ -0,0 +1,333 @@
+#Socket.IO 跨 worker 消息分发（单机 UNIX socket 中转进程 + python-socketio PubSubManager 后端，按批发送）
+"""
+中转进程只负责转发：每个连接先发送一帧握手 {"role": "pub"|"sub", "host": host_id}，之后 pub 连接
+发来的每一帧原样转发给所有 host 不同的 sub 连接。帧格式为 4 字节大端长度 + JSON 数组（一批消息）。
+
+启动：python -m utils.socket_broker /tmp/flaskchat-socketio.sock
+（使用 gunicorn_config.py 时由 on_starting 钩子自动启动）
+"""
+from socketio.pubsub_manager import PubSubManager
+import json
+import logging
+import os
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def _frame(payload: bytes) -> bytes:
+    return _HEADER.pack(len(payload)) + payload
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('broker connection closed')
+        data += chunk
+    return data
+
+
+def parse_url(url):
+    """unix:///path/to.sock -> /path/to.sock"""
+    return url[len('unix://'):] if url.startswith('unix://') else url
+
+
+class _Peer:
+    __slots__ = ('sock', 'inbox', 'outbox', 'role', 'host')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+        self.role = None
+        self.host = None
+
+
+class Broker:
+    """单线程 selectors 转发循环，运行在独立进程中（不做 monkey_patch）。"""
+
+    def __init__(self, path, max_backlog=32 * 1024 * 1024):
+        self.path = path
+        self.max_backlog = max_backlog
+        self.selector = selectors.DefaultSelector()
+        self.peers = {}
+        self.frames = 0
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # 只允许运行服务的用户连接，否则本机任何用户都能以 pub 身份向任意 user_<id> 房间注入事件；
+        # 绑定时收紧 umask，避免 bind 与 chmod 之间的窗口
+        umask = os.umask(0o177)
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+        listener.listen(128)
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, None)
+        logger.info(f"Socket.IO 中转进程已启动 {self.path}")
+        try:
+            while True:
+                for key, mask in self.selector.select():
+                    if key.data is None:
+                        self._accept(listener)
+                        continue
+                    peer = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._read(peer)
+                    if mask & selectors.EVENT_WRITE and peer.sock.fileno() != -1:
+                        self._write(peer)
+        finally:
+            listener.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _accept(self, listener):
+        sock, _ = listener.accept()
+        sock.setblocking(False)
+        peer = _Peer(sock)
+        self.peers[sock] = peer
+        self.selector.register(sock, selectors.EVENT_READ, peer)
+
+    def _close(self, peer):
+        if peer.sock in self.peers:
+            del self.peers[peer.sock]
+            self.selector.unregister(peer.sock)
+            peer.sock.close()
+
+    def _read(self, peer):
+        try:
+            data = peer.sock.recv(256 * 1024)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(peer)
+            return
+        peer.inbox += data
+        while len(peer.inbox) >= _HEADER.size:
+            size = _HEADER.unpack_from(peer.inbox)[0]
+            if size > MAX_FRAME:
+                self._close(peer)
+                return
+            if len(peer.inbox) < _HEADER.size + size:
+                break
+            frame = bytes(peer.inbox[:_HEADER.size + size])
+            del peer.inbox[:_HEADER.size + size]
+            if peer.role is None:
+                # 握手帧格式错误只断开该连接，不影响中转进程
+                try:
+                    hello = json.loads(frame[_HEADER.size:])
+                except ValueError:
+                    hello = None
+                if not isinstance(hello, dict) or hello.get('role') not in ('pub', 'sub'):
+                    logger.warning("Socket.IO 中转收到无效握手，断开连接")
+                    self._close(peer)
+                    return
+                peer.role, peer.host = hello['role'], hello.get('host')
+                continue
+            if peer.role != 'pub':
+                self._close(peer)
+                return
+            self.frames += 1
+            self._fanout(peer, frame)
+
+    def _fanout(self, sender, frame):
+        for peer in list(self.peers.values()):
+            if peer.role != 'sub' or peer.host == sender.host:
+                continue
+            if len(peer.outbox) > self.max_backlog:
+                # 消费过慢的订阅者直接断开，由其自行重连，避免中转进程内存无限增长
+                logger.warning(f"订阅者积压超过 {self.max_backlog} 字节，断开连接")
+                self._close(peer)
+                continue
+            was_empty = not peer.outbox
+            peer.outbox += frame
+            if was_empty:
+                self._write(peer)
+
+    def _write(self, peer):
+        try:
+            sent = peer.sock.send(peer.outbox)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close(peer)
+            return
+        del peer.outbox[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if peer.outbox else 0)
+        self.selector.modify(peer.sock, events, peer)
+
+
+class UnixSocketManager(PubSubManager):
+    """通过本机中转进程在多个 worker 之间分发 Socket.IO 事件。
+
+    发布时先放入缓冲区，由后台任务在 batch_interval 时间窗内把多条消息合并成一帧发送；
+    连接按进程懒建立，preload_app 时 fork 出的 worker 各自连接。
+    """
+    name = 'unix'
+
+    def __init__(self, url='unix:///tmp/flaskchat-socketio.sock', channel='socketio', write_only=False,
+                 logger=None, batch_interval=0.002, max_batch=500):
+        self._host_pid = None
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = parse_url(url)
+        self.batch_interval = batch_interval
+        self.max_batch = max_batch
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pub_sock = None
+        self._pid = None
+        # 统计
+        self.published = 0
+        self.batches = 0
+        self.received = 0
+        self.publish_errors = 0
+
+    @property
+    def host_id(self):
+        # preload_app 时管理器在 master 中创建，fork 出的 worker 需要各自的 host_id，否则会把彼此的消息当成自己的丢弃
+        if self._host_pid != os.getpid():
+            self._host_id = uuid.uuid4().hex
+            self._host_pid = os.getpid()
+        return self._host_id
+
+    @host_id.setter
+    def host_id(self, value):
+        self._host_id = value
+        self._host_pid = os.getpid()
+
+    def _connect(self, role):
+        retry_sleep = 0.1
+        while True:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.path)
+                sock.sendall(_frame(json.dumps({'role': role, 'host': self.host_id}).encode()))
+                return sock
+            except OSError as e:
+                sock.close()
+                self._get_logger().error(f'无法连接 Socket.IO 中转进程 {self.path}: {e}，'
+                                         f'{retry_sleep} 秒后重试')
+                time.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 5)
+
+    def _ensure_flusher(self):
+        # 后台发送任务按进程启动；fork 后继承的连接和缓冲区作废
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pub_sock = None
+            self._pending = []
+            self._lock = threading.Lock()
+            self._wakeup = threading.Event()
+            if self.server is not None:
+                self.server.start_background_task(self._flush_loop)
+            else:
+                threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _publish(self, data):
+        self._ensure_flusher()
+        with self._lock:
+            self._pending.append(data)
+            self.published += 1
+            full = len(self._pending) >= self.max_batch
+        if full or len(self._pending) == 1:
+            self._wakeup.set()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait()
+            # 时间窗内到达的消息合并为一批
+            if self.batch_interval:
+                time.sleep(self.batch_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        payload = _frame(self.json.dumps(batch).encode('utf-8'))
+        for attempt in range(2):
+            try:
+                if self._pub_sock is None:
+                    self._pub_sock = self._connect('pub')
+                self._pub_sock.sendall(payload)
+                self.batches += 1
+                return
+            except OSError as e:
+                self._pub_sock = None
+                if attempt:
+                    self.publish_errors += len(batch)
+                    self._get_logger().error(f'发送到 Socket.IO 中转进程失败，丢弃 {len(batch)} 条: {e}')
+
+    def _listen(self):
+        while True:
+            sock = self._connect('sub')
+            try:
+                while True:
+                    size = _HEADER.unpack(_recv_exact(sock, _HEADER.size))[0]
+                    batch = self.json.loads(_recv_exact(sock, size))
+                    self.received += len(batch)
+                    yield from batch
+            except (OSError, ConnectionError, ValueError) as e:
+                self._get_logger().error(f'Socket.IO 中转连接断开，重新连接: {e}')
+                sock.close()
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'published': self.published,
+            'batches': self.batches,
+            'avg_batch_size': round(self.published / self.batches, 1) if self.batches else None,
+            'received': self.received,
+            'publish_errors': self.publish_errors,
+            'pending': len(self._pending),
+        }
+
+
+def message_queue_options(config):
+    """根据 SOCKETIO_MESSAGE_QUEUE 生成 SocketIO() 参数：unix:// 使用本机中转进程，
+    其他地址（redis://、amqp:// 等）交给 Flask-SocketIO 自带的后端。"""
+    url = config.get('SOCKETIO_MESSAGE_QUEUE')
+    if not url:
+        return {}
+    if url.startswith('unix://'):
+        return {'client_manager': UnixSocketManager(url, batch_interval=config.get('SOCKETIO_BATCH_INTERVAL', 0.002))}
+    return {'message_queue': url}
+
+
+def start_broker(url):
+    """以子进程方式启动中转进程（gunicorn on_starting 钩子中调用），返回 Popen 对象。"""
+    import subprocess
+    path = parse_url(url)
+    if os.path.exists(path):
+        os.unlink(path)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, '-m', 'utils.socket_broker', path], cwd=root)
+    deadline = time.monotonic() + 10
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return process
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(name)s - %(message)s')
+    Broker(sys.argv[1] if len(sys.argv) > 1 else '/tmp/flaskchat-socketio.sock').serve_forever()
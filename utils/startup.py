@@ -0,0 +1,85 @@
+#启动耗时统计与 worker 预热。app.py 在最前面导入本模块开始计时，依次记录导入、初始化各阶段的耗时；
+#gunicorn worker 启动后再记录各自的预热耗时。结果写入日志，并通过 /metrics 的 startup_* 指标输出
+#（只依赖标准库，导入本模块不影响计时）
+
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = {}  # 阶段名 -> 毫秒，按记录顺序；worker_ 开头的是 fork 后各 worker 自己的阶段
+
+    def mark(self, phase):
+        """把上一次 mark 到现在的耗时记入 phase（用于 import 这类无法包进 with 的阶段）。"""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + round((now - self._last) * 1000, 1)
+        self._last = now
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._last = time.perf_counter()
+            self.phases[name] = self.phases.get(name, 0) + round((self._last - start) * 1000, 1)
+
+    def report(self, title, prefix=''):
+        phases = {name: ms for name, ms in self.phases.items() if name.startswith(prefix)}
+        total = round(sum(phases.values()), 1)
+        logger.info(f"{title}耗时 {total}ms（" + '，'.join(f'{name} {ms}ms' for name, ms in phases.items()) + '）')
+        return total
+
+    def stats(self):
+        data = {f'{name}_ms': ms for name, ms in self.phases.items()}
+        data['total_ms'] = round(sum(self.phases.values()), 1)
+        return data
+
+
+def warm_up_worker(app, db_connections=2, llm_connect=True):
+    """worker 启动后预热：为每个数据库引擎建立至多 db_connections 个连接放回连接池（同时检查是否已执行迁移），
+    并在后台线程中为各服务商创建 HTTP 客户端、预先建立连接，不推迟 worker 开始接收请求。"""
+    from sqlalchemy import text
+    from sqlalchemy.exc import DBAPIError
+    from models import db
+    from utils.providers import provider_pool
+
+    with startup_timer.phase('worker_db_warmup'), app.app_context():
+        for key, engine in db.engines.items():
+            size = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+            connections = []
+            try:
+                for _ in range(max(1, min(db_connections, size))):
+                    connection = engine.connect()
+                    connections.append(connection)
+                    connection.execute(text('SELECT 1'))
+            except DBAPIError as e:
+                logger.error(f"预热数据库连接失败（{key or 'primary'}）: {str(e)}")
+            finally:
+                for connection in connections:
+                    connection.close()
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text('SELECT version_num FROM alembic_version')).scalar()
+        except DBAPIError:
+            logger.warning("数据库尚未执行迁移，请先运行 flask --app app db upgrade")
+
+    def _warm_llm():
+        with startup_timer.phase('worker_llm_warmup'):
+            ready = provider_pool.warm_up(connect=llm_connect)
+        logger.info(f"worker {os.getpid()} 已预热 {ready}/{len(provider_pool.providers)} 个服务商连接")
+        startup_timer.report(f"worker {os.getpid()} 预热", prefix='worker_')
+
+    threading.Thread(target=_warm_llm, name='llm-warmup', daemon=True).start()
+
+
+# 创建全局实例
+startup_timer = StartupTimer()
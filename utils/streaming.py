@@ -0,0 +1,194 @@
+#流式回复工具（后台生成、向发起用户的 Socket.IO 房间推送增量、取消与首字延迟统计）
+
+from collections import deque
+from utils.ai_handlers import ai_handler, FALLBACK_REPLY
+from utils.scheduler import llm_scheduler, SchedulerBusy
+from utils.response_cache import response_cache
+from utils.write_behind import persist_message
+from utils.rate_limit import rate_limiter
+from utils.log_pipeline import bind_log_context, current_log_context
+import threading
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class Generation:
+    """一次进行中的流式生成。"""
+
+    def __init__(self, user_id, session_id):
+        self.stream_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.session_id = session_id
+        self.cancelled = False
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.context = None
+        self.client_ip = None
+        self.usage = {}  # 服务商返回的 token 用量，保存消息与扣除限额时使用
+        self.log_context = current_log_context()
+
+    @property
+    def ttft_ms(self):
+        if self.first_token_at is None:
+            return None
+        return round((self.first_token_at - self.started_at) * 1000, 1)
+
+    @property
+    def room(self):
+        # 推送到用户房间（连接时即加入），而不是会话房间：新会话由服务端生成 session_id，
+        # 客户端来不及 join_chat，推送到会话房间的事件会丢失。客户端按事件中的 session_id 区分会话
+        return f'user_{self.user_id}'
+
+
+class StreamManager:
+    def __init__(self, ttft_window=1000):
+        self._generations = {}
+        self._lock = threading.Lock()
+        # 最近若干次的首字延迟，用于统计
+        self._ttft_samples = deque(maxlen=ttft_window)
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def start(self, app, user_id, session_id, message, prompt_messages, use_cache=True, context=None,
+              client_ip=None):
+        """启动后台生成任务，增量以 ai_token 事件推送到发起用户的 user_<id> 房间，结束时推送 ai_done。
+
+        prompt_messages 为已构建好的提示消息列表，message 为本轮用户消息（用于保存），
+        context 为本轮之后的会话上下文，保存成功后一并写入最近轮次缓存；client_ip 用于按 IP 扣除 token 限额。
+        """
+        generation = Generation(user_id, session_id)
+        with self._lock:
+            self._generations[generation.stream_id] = generation
+        socketio = app.extensions['socketio']
+        generation.context = context
+        generation.client_ip = client_ip
+        socketio.start_background_task(self._run, app, socketio, generation, message, prompt_messages,
+                                       use_cache)
+        return generation
+
+    def cancel(self, stream_id, user_id):
+        """取消指定生成，只允许发起者取消。"""
+        with self._lock:
+            generation = self._generations.get(stream_id)
+        if generation is None or generation.user_id != user_id:
+            return False
+        generation.cancelled = True
+        return True
+
+    def stats(self):
+        samples = sorted(self._ttft_samples)
+        with self._lock:
+            in_flight = len(self._generations)
+        result = {
+            'in_flight': in_flight,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'failed': self.failed,
+            'ttft_ms_avg': None,
+            'ttft_ms_p50': None,
+            'ttft_ms_p95': None,
+        }
+        if samples:
+            result['ttft_ms_avg'] = round(sum(samples) / len(samples), 1)
+            result['ttft_ms_p50'] = samples[len(samples) // 2]
+            result['ttft_ms_p95'] = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return result
+
+    def _run(self, app, socketio, generation, message, prompt_messages, use_cache=True):
+        session_id = generation.session_id
+        # 后台任务沿用发起请求的 request_id / session_id
+        bind_log_context(**generation.log_context)
+        cache_key = None
+        if use_cache and response_cache.enabled:
+            cache_key = ai_handler.cache_key(prompt_messages)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                # 命中缓存：整段作为一个增量推送，不占用调度名额
+                self._generate(app, socketio, generation, message, iter([cached]))
+                return
+        # 与同步接口共用调度器；排队失败以 ai_error 事件通知客户端
+        try:
+            llm_scheduler.acquire(generation.user_id)
+        except SchedulerBusy as e:
+            with self._lock:
+                self._generations.pop(generation.stream_id, None)
+            self.failed += 1
+            socketio.emit('ai_error', {
+                'stream_id': generation.stream_id,
+                'session_id': session_id,
+                'error': 'AI服务繁忙，请稍后重试',
+                'reason': e.reason
+            }, to=generation.room)
+            return
+        try:
+            deltas = ai_handler.stream_messages(prompt_messages, should_stop=lambda: generation.cancelled,
+                                                usage=generation.usage)
+            self._generate(app, socketio, generation, message, deltas, cache_key)
+        finally:
+            llm_scheduler.release(generation.user_id)
+
+    def _generate(self, app, socketio, generation, message, deltas, cache_key=None):
+        session_id = generation.session_id
+        parts = []
+        failed = False
+        try:
+            for delta in deltas:
+                if generation.cancelled:
+                    break
+                if generation.first_token_at is None:
+                    generation.first_token_at = time.monotonic()
+                    self._ttft_samples.append(generation.ttft_ms)
+                    logger.info(f"流式回复首字延迟 {generation.ttft_ms}ms (session={session_id})")
+                parts.append(delta)
+                socketio.emit('ai_token', {
+                    'stream_id': generation.stream_id,
+                    'session_id': session_id,
+                    'delta': delta
+                }, to=generation.room)
+        except Exception as e:
+            logger.error(f"千帆流式调用失败: {str(e)}")
+            failed = True
+
+        response = ''.join(parts)
+        if failed and not response:
+            response = FALLBACK_REPLY
+        elif cache_key and not failed and not generation.cancelled:
+            response_cache.set(cache_key, response)
+        try:
+            # 完整回复仍然作为一条 ChatMessage 保存
+            with app.app_context():
+                payload = persist_message(generation.user_id, session_id, message, response,
+                                          generation.context, generation.usage)
+        except Exception as e:
+            logger.error(f"保存流式回复失败: {str(e)}")
+            payload = None
+            failed = True
+        finally:
+            with self._lock:
+                self._generations.pop(generation.stream_id, None)
+        # 取消或失败时已产生的用量同样计入
+        rate_limiter.charge(generation.user_id, generation.client_ip, generation.usage)
+
+        if generation.cancelled:
+            self.cancelled += 1
+        elif failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+        socketio.emit('ai_done', {
+            'stream_id': generation.stream_id,
+            'session_id': session_id,
+            'message': payload,
+            'cancelled': generation.cancelled,
+            'error': failed,
+            'ttft_ms': generation.ttft_ms,
+            'total_ms': round((time.monotonic() - generation.started_at) * 1000, 1)
+        }, to=generation.room)
+
+
+# 创建全局实例
+stream_manager = StreamManager()
@@ -0,0 +1,192 @@
+#最近轮次缓存（按会话保存最近若干轮对话的环形缓冲，LRU + 空闲超时 + 内存上限）
+#缓存按 worker 进程保存，命中后调用方需用 check() 与数据库中的会话版本号、最新消息 id 核对，
+#其他 worker 修改过会话或追加过消息时丢弃重建
+
+from collections import OrderedDict, deque
+import threading
+import time
+
+# 每条记录的固定开销估算（对象头、槽位、deque 节点等），单位字节
+_TURN_OVERHEAD = 200
+_ENTRY_OVERHEAD = 600
+
+
+class Turn:
+    """一轮对话的紧凑记录，只保留构建上下文需要的字段。"""
+    __slots__ = ('id', 'message', 'response')
+
+    def __init__(self, id, message, response):
+        self.id = id
+        self.message = message
+        self.response = response
+
+    @classmethod
+    def from_message(cls, chat_message):
+        return cls(chat_message.id, chat_message.message, chat_message.response)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('id'), data.get('message'), data.get('response'))
+
+    @property
+    def size(self):
+        return _TURN_OVERHEAD + 2 * (len(self.message or '') + len(self.response or ''))
+
+    def to_dict(self):
+        return {'id': self.id, 'message': self.message, 'response': self.response}
+
+
+class SessionEntry:
+    """单个会话的缓存状态：最近轮次 + 会话的 context / meta_data（已解析）+ 读取时的会话版本号。"""
+    __slots__ = ('turns', 'context', 'meta_data', 'version', 'last_access', 'size')
+
+    def __init__(self, max_turns, context, meta_data, version=1):
+        self.turns = deque(maxlen=max_turns)
+        self.context = context
+        self.meta_data = meta_data
+        self.version = version
+        self.last_access = time.monotonic()
+        self.size = _ENTRY_OVERHEAD
+
+    @property
+    def last_message_id(self):
+        return max((turn.id for turn in self.turns if turn.id is not None), default=None)
+
+    def history(self):
+        return [turn.to_dict() for turn in self.turns]
+
+
+class RecentTurnCache:
+    def __init__(self, max_turns=10, max_sessions=2000, max_bytes=32 * 1024 * 1024, idle_timeout=300):
+        self.enabled = True
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self._entries = OrderedDict()  # (user_id, session_id) -> SessionEntry
+        self._lock = threading.Lock()
+        self._bytes = 0
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('TURN_CACHE_ENABLED', self.enabled)
+        self.max_turns = app.config.get('AI_HISTORY_TURNS', self.max_turns)
+        self.max_sessions = app.config.get('TURN_CACHE_MAX_SESSIONS', self.max_sessions)
+        self.max_bytes = app.config.get('TURN_CACHE_MAX_BYTES', self.max_bytes)
+        self.idle_timeout = app.config.get('CHAT_TIMEOUT', self.idle_timeout)
+        app.extensions['turn_cache'] = self
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _shrink(self):
+        while self._entries and (len(self._entries) > self.max_sessions or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _resize(self, entry):
+        size = _ENTRY_OVERHEAD + sum(turn.size for turn in entry.turns)
+        self._bytes += size - entry.size
+        entry.size = size
+
+    def get(self, user_id, session_id):
+        """返回会话缓存；未命中或已空闲超时返回 None。"""
+        if not self.enabled:
+            return None
+        key = (user_id, session_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.last_access > self.idle_timeout:
+                self._remove(key)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry.last_access = now
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def check(self, user_id, session_id, version, last_message_id):
+        """核对命中的缓存与数据库中的会话版本号、最新消息 id（会话不存在时 version 为 None），
+        不一致时丢弃并返回 False。"""
+        with self._lock:
+            entry = self._entries.get((user_id, session_id))
+            if entry is not None and (entry.version, entry.last_message_id) == (version, last_message_id):
+                return True
+            if entry is not None:
+                self._remove((user_id, session_id))
+            self.stale += 1
+            return False
+
+    def fill(self, user_id, session_id, context, meta_data, chat_messages=(), version=1):
+        """首次访问时用数据库结果填充，chat_messages 为按时间升序的 ChatMessage 对象（归档消息为 to_dict() 字典），
+        version 为读取时的会话版本号。"""
+        entry = SessionEntry(self.max_turns, context, meta_data, version)
+        entry.turns.extend(Turn.from_dict(msg) if isinstance(msg, dict) else Turn.from_message(msg)
+                           for msg in chat_messages)
+        if not self.enabled:
+            return entry
+        key = (user_id, session_id)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._resize(entry)
+            self._shrink()
+        return entry
+
+    def append(self, user_id, session_id, message_dict, context=None):
+        """本轮保存后追加到环形缓冲（message_dict 为 ChatMessage.to_dict() 结果），返回新记录；
+        context 不为 None 时同时更新缓存的会话上下文。"""
+        with self._lock:
+            entry = self._entries.get((user_id, session_id))
+            if entry is None:
+                return None
+            turn = Turn.from_dict(message_dict)
+            entry.turns.append(turn)
+            if context is not None:
+                entry.context = context
+            entry.last_access = time.monotonic()
+            self._resize(entry)
+            self._shrink()
+            return turn
+
+    def set_version(self, user_id, session_id, version):
+        """本进程更新会话（写回滚动摘要）后同步缓存的版本号，避免下次命中时误判为过期。"""
+        with self._lock:
+            entry = self._entries.get((user_id, session_id))
+            if entry is not None:
+                entry.version = version
+
+    def invalidate(self, user_id, session_id):
+        """会话的 context / meta_data 在本进程的其他接口被修改时调用。"""
+        with self._lock:
+            if (user_id, session_id) in self._entries:
+                self._remove((user_id, session_id))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'sessions': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'stale': self.stale,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+# 创建全局实例
+turn_cache = RecentTurnCache()
@@ -0,0 +1,92 @@
+#上传文件工具（分块流式落盘、边写边计算 SHA-256、按内容哈希去重存储）
+
+import base64
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+CHUNK_SIZE = 64 * 1024
+# base64 每 4 个字符解码为 3 个字节，按 4 的倍数切片逐段解码
+_B64_SLICE = CHUNK_SIZE // 3 * 4
+# 与 base64.b64decode 默认行为一致，忽略字母表以外的字符（如 encodebytes 输出中的换行）
+_B64_IGNORED = re.compile(r'[^A-Za-z0-9+/=]')
+
+EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+}
+
+
+class Base64Reader:
+    """把 base64 字符串包装成可按块读取的流，避免一次性解码出完整字节串。"""
+
+    def __init__(self, text):
+        self.text = text
+        self.offset = 0
+        self.pending = ''  # 上一段去掉无关字符后不足 4 个的尾部，并入下一段解码
+
+    def read(self, size=-1):
+        while self.offset < len(self.text):
+            piece = self.pending + _B64_IGNORED.sub('', self.text[self.offset:self.offset + _B64_SLICE])
+            self.offset += _B64_SLICE
+            whole = len(piece) // 4 * 4
+            self.pending = piece[whole:]
+            if whole:
+                return base64.b64decode(piece[:whole])
+        if self.pending:
+            # 末尾不足一组：与整体解码一样抛出 binascii.Error
+            piece, self.pending = self.pending, ''
+            return base64.b64decode(piece)
+        return b''
+
+
+def store_stream(stream, save_dir, extension='.png'):
+    """把流分块写入临时文件并计算 SHA-256，完成后以 <哈希>.<扩展名> 存入两级目录。
+
+    内容相同的文件只保存一份。返回保存结果和本次上传的吞吐量、缓冲峰值（本次上传在内存中
+    同时持有的最大字节数）等统计。
+    """
+    started = time.monotonic()
+    os.makedirs(save_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    peak_buffer = 0
+    fd, tmp_path = tempfile.mkstemp(dir=save_dir, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                peak_buffer = max(peak_buffer, len(chunk))
+                digest.update(chunk)
+                f.write(chunk)
+        sha256 = digest.hexdigest()
+        target_dir = os.path.join(save_dir, sha256[:2])
+        target = os.path.join(target_dir, sha256 + extension)
+        duplicate = os.path.exists(target)
+        if duplicate:
+            os.unlink(tmp_path)
+        else:
+            os.makedirs(target_dir, exist_ok=True)
+            # 同目录内原子重命名，并发上传相同内容时后写入者覆盖为同一内容
+            os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    elapsed = time.monotonic() - started
+    return {
+        'sha256': sha256,
+        'path': target,
+        'size': size,
+        'duplicate': duplicate,
+        'elapsed_ms': round(elapsed * 1000, 2),
+        'throughput_mb_s': round(size / 1024 / 1024 / elapsed, 2) if elapsed > 0 else None,
+        'peak_buffer_bytes': peak_buffer,
+    }
@@ -0,0 +1,68 @@
+#大模型用量按天汇总（后台维护任务按 chat_message.id 增量汇总到 usage_daily）
+
+from datetime import datetime, timedelta
+from itertools import takewhile
+from sqlalchemy import select, func, or_, and_
+from models import db
+from models.chat import ChatMessage
+from models.usage import UsageDaily
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UsageRollup:
+    def __init__(self, batch_size=500, lag=60):
+        self.batch_size = batch_size
+        self.lag = lag  # 只汇总写入超过 lag 秒的消息，避免 MySQL 自增 id 提交顺序与分配顺序不一致时漏掉
+        # 统计（本进程）
+        self.rolled_up = 0
+
+    def init_app(self, app):
+        self.batch_size = app.config.get('MAINTENANCE_BATCH_SIZE', self.batch_size)
+        app.extensions['usage_rollup'] = self
+
+    def rollup_batch(self):
+        """把上次汇总位置之后的一批消息累加到 usage_daily，在一个短事务中完成，返回处理的消息数。"""
+        watermark = db.session.execute(select(func.max(UsageDaily.last_message_id))).scalar() or 0
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lag)
+        rows = db.session.execute(
+            select(ChatMessage.id, ChatMessage.user_id, ChatMessage.timestamp, ChatMessage.prompt_tokens,
+                   ChatMessage.completion_tokens).where(ChatMessage.id > watermark)
+            .order_by(ChatMessage.id).limit(self.batch_size)).all()
+        rows = list(takewhile(lambda row: row.timestamp is None or row.timestamp < cutoff, rows))
+        if not rows:
+            return 0
+        totals = {}
+        for row in rows:
+            day = (row.timestamp or cutoff).date()
+            turns, prompt, completion = totals.get((row.user_id, day), (0, 0, 0))
+            totals[(row.user_id, day)] = (turns + 1, prompt + (row.prompt_tokens or 0),
+                                          completion + (row.completion_tokens or 0))
+        existing = {(item.user_id, item.day): item for item in UsageDaily.query.filter(
+            or_(*(and_(UsageDaily.user_id == user_id, UsageDaily.day == day) for user_id, day in totals)))}
+        last_id = rows[-1].id
+        for (user_id, day), (turns, prompt, completion) in totals.items():
+            item = existing.get((user_id, day))
+            if item is None:
+                item = UsageDaily(user_id=user_id, day=day, turns=0, prompt_tokens=0, completion_tokens=0)
+                db.session.add(item)
+            item.turns += turns
+            item.prompt_tokens += prompt
+            item.completion_tokens += completion
+            item.last_message_id = last_id
+        db.session.commit()
+        self.rolled_up += len(rows)
+        return len(rows)
+
+    def daily(self, user_id, days=30):
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        return UsageDaily.query.filter(UsageDaily.user_id == user_id, UsageDaily.day >= since).order_by(
+            UsageDaily.day.desc()).all()
+
+    def stats(self):
+        return {'rolled_up': self.rolled_up}
+
+
+# 创建全局实例
+usage_rollup = UsageRollup()
@@ -0,0 +1,92 @@
+#用户身份缓存（user_loader 使用的轻量用户对象，TTL + 容量上限，资料/密码变更时失效）
+
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event
+from models import db
+from models.user import User
+import threading
+import time
+
+
+class CachedUser(UserMixin):
+    """与 User 接口一致的只读用户对象，不绑定数据库会话。"""
+
+    def __init__(self, id, username, email, created_at):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.created_at = created_at
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class UserCache:
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user_id -> (CachedUser, expires_at)
+        self._lock = threading.Lock()
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('USER_CACHE_MAX_ENTRIES', self.max_entries)
+        app.extensions['user_cache'] = self
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is not None and item[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+        # 只查询需要的列，不产生 ORM 实例
+        row = db.session.query(User.id, User.username, User.email, User.created_at).filter(
+            User.id == user_id).first()
+        if row is None:
+            return None
+        user = CachedUser(*row)
+        with self._lock:
+            self._entries[user_id] = (user, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+# 创建全局实例
+user_cache = UserCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user(mapper, connection, target):
+    # 任何途径修改或删除用户后都让本 worker 的缓存失效；其他 worker 依赖 TTL 过期
+    user_cache.invalidate(target.id)
@@ -0,0 +1,309 @@
+#延迟写入 / 组提交（把多个请求的 ChatSession / ChatMessage 插入合并成一个事务批量提交，
+#请求等待所在批次提交后再返回，因此返回给客户端的数据已经落库，任何 worker 都能读到）
+
+from datetime import datetime
+from models import db
+from models.chat import ChatMessage, ChatSession
+from utils.turn_cache import turn_cache
+import atexit
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindError(Exception):
+    """等待落库超时，或多次重试后仍写入失败。"""
+
+
+class _PendingRow:
+    __slots__ = ('row', 'payload', 'turn', 'retries', 'applied', 'done', 'error')
+
+    def __init__(self, row, payload=None, turn=None):
+        self.row = row
+        self.payload = payload
+        self.turn = turn
+        self.retries = 0
+        self.applied = False  # context 补丁是否通过了版本号检查
+        self.done = threading.Event()  # 提交成功或最终丢弃后置位
+        self.error = None
+
+
+class WriteBehindQueue:
+    def __init__(self, batch_size=200, flush_interval=0.05, max_retries=3, wait_timeout=10):
+        self.enabled = False
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.wait_timeout = wait_timeout
+        self.app = None
+        self._sessions = []
+        self._updates = []
+        self._messages = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker_pid = None
+        # 统计
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('WRITE_BEHIND_ENABLED', self.enabled)
+        self.batch_size = app.config.get('WRITE_BEHIND_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('WRITE_BEHIND_FLUSH_INTERVAL', self.flush_interval)
+        self.wait_timeout = app.config.get('WRITE_BEHIND_WAIT_TIMEOUT', self.wait_timeout)
+        self.app = app
+        app.extensions['write_behind'] = self
+        if self.enabled:
+            # 进程正常退出时把剩余数据写完；gunicorn 回收 worker 时由 worker_exit 钩子调用 shutdown
+            atexit.register(self.shutdown)
+
+    def _ensure_worker(self):
+        # 后台线程按进程启动，fork 出的 worker 首次写入时各自启动
+        if self._worker_pid != os.getpid():
+            self._worker_pid = os.getpid()
+            threading.Thread(target=self._run, name='write-behind', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"延迟写入后台刷新失败: {str(e)}")
+
+    def add_session(self, user_id, session_id, **fields):
+        now = datetime.utcnow()
+        item = _PendingRow(dict(fields, user_id=user_id, session_id=session_id, created_at=now, start_time=now))
+        with self._lock:
+            self._sessions.append(item)
+        self._ensure_worker()
+        return item
+
+    def patch_context(self, user_id, session_id, patch, version):
+        """登记会话 context 的部分更新（见 ChatSession.merge_context），落库时在插入之后按登记顺序执行，
+        仅在会话版本号仍为 version 时生效。"""
+        item = _PendingRow(dict(user_id=user_id, session_id=session_id, patch=patch, expected_version=version))
+        with self._lock:
+            self._updates.append(item)
+        self._ensure_worker()
+        return item
+
+    def add_message(self, payload, turn=None):
+        """登记一条待写消息。payload 为 message_payload() 生成的字典，落库后回填 id；
+        turn 为最近轮次缓存中的对应记录，同样回填 id。
+        """
+        row = {key: payload[key] for key in ('user_id', 'session_id', 'message', 'response', 'sender',
+                                             'prompt_tokens', 'completion_tokens')}
+        row['timestamp'] = datetime.fromisoformat(payload['timestamp'])
+        item = _PendingRow(row, payload, turn)
+        with self._lock:
+            self._messages.append(item)
+            full = len(self._messages) >= self.batch_size
+        self._ensure_worker()
+        if full:
+            self._wakeup.set()
+        return item
+
+    def wait(self, items):
+        """等待登记的行随所在批次提交（组提交）：同一时间窗口内各请求的行合并为一个事务，
+        返回时已经落库，其他 worker 的读接口也能读到，消息 payload 中的 id 已回填。"""
+        for item in items:
+            if not item.done.wait(self.wait_timeout):
+                raise WriteBehindError(f"等待延迟写入超时 session={item.row['session_id']}")
+            if item.error is not None:
+                raise WriteBehindError(item.error)
+
+    def flush(self):
+        """同步写入当前所有待写数据，返回写入行数。"""
+        with self._flush_lock:
+            with self._lock:
+                sessions, self._sessions = self._sessions, []
+                updates, self._updates = self._updates, []
+                messages, self._messages = self._messages, []
+            if not sessions and not updates and not messages:
+                return 0
+            with self.app.app_context():
+                try:
+                    session_objs = [ChatSession(**item.row) for item in sessions]
+                    message_objs = [ChatMessage(**item.row) for item in messages]
+                    db.session.add_all(session_objs)
+                    db.session.add_all(message_objs)
+                    db.session.flush()
+                    ids = [obj.id for obj in message_objs]
+                    for item in updates:
+                        item.applied = ChatSession.merge_context(**item.row)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    self.errors += 1
+                    logger.error(f"延迟写入提交失败: {str(e)}")
+                    self._requeue(sessions, updates, messages)
+                    return 0
+            for item, message_id in zip(messages, ids):
+                item.payload['id'] = message_id
+                if item.turn is not None:
+                    item.turn.id = message_id
+            for item in updates:
+                _sync_turn_cache(item.row['user_id'], item.row['session_id'], item.applied,
+                                 item.row['expected_version'])
+            for item in sessions + updates + messages:
+                item.done.set()
+            written = len(sessions) + len(updates) + len(messages)
+            self.batches += 1
+            self.rows += written
+            return written
+
+    def _requeue(self, sessions, updates, messages):
+        # 放回队首等待下次重试；超过重试次数的行丢弃并记录，同时清掉对应会话的最近轮次缓存
+        kept_sessions, kept_updates, kept_messages = [], [], []
+        for items, kept in ((sessions, kept_sessions), (updates, kept_updates), (messages, kept_messages)):
+            for item in items:
+                item.retries += 1
+                if item.retries <= self.max_retries:
+                    kept.append(item)
+                    continue
+                self.dropped += 1
+                logger.error(f"延迟写入多次失败，丢弃记录 session={item.row['session_id']}")
+                turn_cache.invalidate(item.row['user_id'], item.row['session_id'])
+                item.error = f"延迟写入多次失败 session={item.row['session_id']}"
+                item.done.set()
+        with self._lock:
+            self._sessions[:0] = kept_sessions
+            self._updates[:0] = kept_updates
+            self._messages[:0] = kept_messages
+
+    def _pending(self):
+        return len(self._sessions) + len(self._updates) + len(self._messages)
+
+    def shutdown(self):
+        """进程退出前写完剩余数据。提交失败（如 SQLite database is locked）时退避重试，
+        直到队列清空或每行都超过 max_retries 次（由 _requeue 丢弃）；仍未写入的行按 error 级别记录。"""
+        if self.app is None or not self._pending():
+            return
+        delay = self.flush_interval
+        for _ in range(self.max_retries + 1):
+            written = self.flush()
+            if written:
+                logger.info(f"延迟写入退出前刷新 {written} 行")
+            if not self._pending():
+                return
+            time.sleep(delay)
+            delay *= 2
+        with self._lock:
+            left = self._sessions + self._updates + self._messages
+            self._sessions, self._updates, self._messages = [], [], []
+        self.dropped += len(left)
+        for item in left:
+            logger.error(f"延迟写入退出时仍未写入，丢弃记录 session={item.row['session_id']}")
+            item.error = f"延迟写入退出时仍未写入 session={item.row['session_id']}"
+            item.done.set()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'pending_sessions': len(self._sessions),
+            'pending_updates': len(self._updates),
+            'pending_messages': len(self._messages),
+            'batches': self.batches,
+            'rows': self.rows,
+            'avg_batch_size': round(self.rows / self.batches, 1) if self.batches else None,
+            'errors': self.errors,
+            'dropped': self.dropped,
+        }
+
+
+# 创建全局实例
+write_behind = WriteBehindQueue()
+
+
+def _usage_columns(usage):
+    usage = usage or {}
+    return {'prompt_tokens': usage.get('prompt_tokens'), 'completion_tokens': usage.get('completion_tokens')}
+
+
+def message_payload(user_id, session_id, message, response, usage=None):
+    """生成与 ChatMessage.to_dict() 同结构的字典，id 在批次提交后回填。"""
+    return dict({'id': None, 'user_id': user_id, 'session_id': session_id, 'message': message,
+                 'response': response, 'sender': 'user', 'timestamp': datetime.utcnow().isoformat()},
+                **_usage_columns(usage))
+
+
+def _sync_turn_cache(user_id, session_id, applied, version):
+    # 补丁生效时版本号恰好加一；被其他请求抢先修改时丢弃缓存，下次按数据库重建（本轮的摘要作废，下一轮重新折叠）
+    if applied:
+        turn_cache.set_version(user_id, session_id, version + 1)
+    else:
+        turn_cache.invalidate(user_id, session_id)
+
+
+def patch_context(user_id, session_id, patch, version):
+    """在当前事务中把 patch 合并进会话 context（仅在版本号仍为 version 时生效），并同步最近轮次缓存。"""
+    applied = ChatSession.merge_context(user_id, session_id, patch, version)
+    _sync_turn_cache(user_id, session_id, applied, version)
+    return applied
+
+
+def persist_message(user_id, session_id, message, response, context=None, usage=None):
+    """保存一轮对话并追加到最近轮次缓存，返回 ChatMessage.to_dict() 结构的字典。
+
+    启用延迟写入时登记到批量队列并等待所在批次提交；否则与当前事务中暂存的会话变更一起立即提交。
+    usage 为 AIHandler 填充的用量字典，保存到 prompt_tokens / completion_tokens 列。
+    """
+    if write_behind.enabled:
+        payload = message_payload(user_id, session_id, message, response, usage)
+        turn = turn_cache.append(user_id, session_id, payload, context)
+        write_behind.wait([write_behind.add_message(payload, turn)])
+        return payload
+    chat_message = ChatMessage(user_id=user_id, message=message, response=response, session_id=session_id,
+                               **_usage_columns(usage))
+    db.session.add(chat_message)
+    db.session.flush()
+    payload = chat_message.to_dict()  # 在提交前序列化，避免提交后属性过期再查一次库
+    db.session.commit()
+    turn_cache.append(user_id, session_id, payload, context)
+    return payload
+
+
+def persist_batch(user_id, turns, new_sessions=None, session_updates=None):
+    """批量保存多轮对话（/batch 接口使用），返回与 turns 顺序一致的 ChatMessage.to_dict() 结构字典列表。
+
+    turns 为 (session_id, message, response, context, usage) 列表；new_sessions 为 {session_id: context_json}，
+    表示需要新建的会话；session_updates 为 {session_id: (patch, version)}，表示需要写回滚动摘要的会话。
+    未启用延迟写入时所有插入与更新在同一个事务中提交。
+    """
+    new_sessions = new_sessions or {}
+    session_updates = session_updates or {}
+    if write_behind.enabled:
+        pending = [write_behind.add_session(user_id, session_id, context=context_json)
+                   for session_id, context_json in new_sessions.items()]
+        pending += [write_behind.patch_context(user_id, session_id, patch, version)
+                    for session_id, (patch, version) in session_updates.items()]
+        payloads = []
+        for session_id, message, response, context, usage in turns:
+            payload = message_payload(user_id, session_id, message, response, usage)
+            pending.append(write_behind.add_message(payload, turn_cache.append(user_id, session_id, payload,
+                                                                               context)))
+            payloads.append(payload)
+        write_behind.wait(pending)
+        return payloads
+    db.session.add_all([ChatSession(user_id=user_id, session_id=session_id, context=context_json)
+                        for session_id, context_json in new_sessions.items()])
+    for session_id, (patch, version) in session_updates.items():
+        patch_context(user_id, session_id, patch, version)
+    messages = [ChatMessage(user_id=user_id, message=message, response=response, session_id=session_id,
+                            **_usage_columns(usage))
+                for session_id, message, response, _, usage in turns]
+    db.session.add_all(messages)
+    db.session.flush()
+    payloads = [msg.to_dict() for msg in messages]
+    db.session.commit()
+    for payload, (session_id, _, _, context, _) in zip(payloads, turns):
+        turn_cache.append(user_id, session_id, payload, context)
+    return payloads